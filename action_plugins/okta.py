@@ -0,0 +1,205 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Action plugin shared by the Okta modules (the okta_* files here link to it).
+
+Without okta_persistent_worker the module runs the usual way, exactly as with the
+normal action, async included. With it, the task is handed to a long running
+worker process on the controller over a unix socket (module_utils/okta_worker.py),
+started on first use and kept for okta_persistent_worker_idle_timeout seconds,
+which runs the module in-process with a warm OktaClient instead of starting an
+interpreter per task. Async tasks always run the usual way, as do tasks whose
+environment sets anything but the http_proxy, https_proxy and no_proxy
+variables, which the worker applies to the task's clients.
+
+Variables:
+    okta_persistent_worker               run tasks in the worker (default false)
+    okta_persistent_worker_python        interpreter for the worker, which needs
+                                         Ansible importable and, like the
+                                         modules, Python 2 (default: the task's
+                                         ansible_python_interpreter, or the
+                                         one running Ansible)
+    okta_persistent_worker_idle_timeout  seconds before an idle worker exits
+                                         (default 300)
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from ansible import constants as C
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_bytes, to_native, to_text
+from ansible.module_utils.json_utils import _filter_non_json_lines
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+from ansible.utils.vars import merge_hash
+from ansible.vars.clean import remove_internal_keys
+
+WORKER_DIR = '~/.ansible/okta_worker'
+START_TIMEOUT = 30
+
+
+class ActionModule(ActionBase):
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+
+        # Same as the normal action, set before ActionBase.run checks them
+        self._supports_check_mode = True
+        self._supports_async = True
+
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp
+
+        # The worker applies the proxy variables of a task's environment to its
+        # clients, any other variable needs the module's own process
+        environment = dict()
+        self._compute_environment_string(environment)
+        own_process = any(not name.lower().endswith('_proxy') for name in environment)
+
+        # Async tasks need the module's own job, so they never go to the worker
+        if self._task.async_val or own_process or not boolean(self._var(task_vars, 'okta_persistent_worker', False), strict=False):
+            wrap_async = self._task.async_val and not self._connection.has_native_async
+            result = merge_hash(result, self._execute_module(module_name=self._task.action, task_vars=task_vars,
+                                                             wrap_async=wrap_async))
+            if not wrap_async:
+                self._remove_tmp_path(self._connection._shell.tmpdir)
+            return result
+
+        result = merge_hash(result, self._run_in_worker(task_vars, environment))
+        self._remove_tmp_path(self._connection._shell.tmpdir)
+        return result
+
+    def _var(self, task_vars, name, default):
+        return self._templar.template(task_vars.get(name, default))
+
+    def _module_utils_dir(self, module_path):
+        candidates = list(C.DEFAULT_MODULE_UTILS_PATH or [])
+        candidates.append(os.path.join(self._loader.get_basedir(), 'module_utils'))
+        candidates.append(os.path.join(os.path.dirname(os.path.dirname(module_path)), 'module_utils'))
+
+        for path in candidates:
+            if os.path.exists(os.path.join(path, 'okta_worker.py')):
+                return os.path.abspath(path)
+
+        raise AnsibleError("okta_worker.py not found in %s" % ", ".join(candidates))
+
+    def _socket_path(self, python, module_utils):
+        """One worker per interpreter, module_utils version and working directory,
+        so relative paths such as dest resolve as they would for the module."""
+
+        key = [python, module_utils, os.getcwd()]
+        for name in ('okta_client.py', 'okta_worker.py'):
+            key.append(str(os.path.getmtime(os.path.join(module_utils, name))))
+
+        directory = os.path.expanduser(WORKER_DIR)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+        return os.path.join(directory, hashlib.sha1(to_bytes('\0'.join(key))).hexdigest()[:16] + '.sock')
+
+    def _connect(self, path):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(path)
+        except socket.error:
+            conn.close()
+            return None
+        return conn
+
+    def _start_worker(self, path, python, module_utils, idle_timeout):
+        """Connect to the worker, starting it first if needed. Forks racing to
+        start it serialise on a lock file, so only one worker is spawned."""
+
+        conn = self._connect(path)
+        if conn is not None:
+            return conn
+
+        with open(path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            conn = self._connect(path)
+            if conn is not None:
+                return conn
+
+            # Left behind by a worker that did not exit cleanly
+            if os.path.exists(path):
+                os.remove(path)
+
+            log = path[:-len('.sock')] + '.log'
+            with open(os.devnull, 'rb') as devnull, open(log, 'ab') as stderr:
+                process = subprocess.Popen([python, os.path.join(module_utils, 'okta_worker.py'),
+                                            path, module_utils, str(idle_timeout)],
+                                           stdin=devnull, stdout=devnull, stderr=stderr,
+                                           close_fds=True, preexec_fn=os.setsid)
+
+            deadline = time.time() + START_TIMEOUT
+            while time.time() < deadline:
+                conn = self._connect(path)
+                if conn is not None:
+                    return conn
+                if process.poll() is not None:
+                    break
+                time.sleep(0.05)
+
+        raise AnsibleError("The Okta persistent worker did not start, see %s" % log)
+
+    def _run_in_worker(self, task_vars, environment):
+        module_path = self._shared_loader_obj.module_loader.find_plugin(self._task.action, mod_type='.py')
+        if module_path is None:
+            raise AnsibleError("Module %s not found" % self._task.action)
+
+        python = self._var(task_vars, 'okta_persistent_worker_python', None)
+        if not python:
+            # The modules run on the controller, with the interpreter they would have had
+            python = self._var(task_vars, 'ansible_python_interpreter', None)
+        if not python or python.startswith('auto'):
+            python = sys.executable
+        idle_timeout = int(self._var(task_vars, 'okta_persistent_worker_idle_timeout', 300))
+        module_utils = self._module_utils_dir(module_path)
+        path = self._socket_path(python, module_utils)
+
+        args = dict(self._task.args)
+        self._update_module_args(self._task.action, args, task_vars)
+
+        conn = self._start_worker(path, python, module_utils, idle_timeout)
+        try:
+            environment = dict((name, to_text(value)) for name, value in environment.items())
+            conn.sendall(to_bytes(json.dumps(dict(module_path=module_path, args=args, environment=environment))) + b'\n')
+            f = conn.makefile('rb')
+            try:
+                response = f.readline()
+            finally:
+                f.close()
+        except socket.error as e:
+            raise AnsibleError("Lost the Okta persistent worker: %s" % to_native(e))
+        finally:
+            conn.close()
+
+        if not response:
+            raise AnsibleError("The Okta persistent worker closed the connection, see %s" % (path[:-len('.sock')] + '.log'))
+
+        response = json.loads(to_text(response))
+        stdout = response['stdout']
+
+        try:
+            filtered, warnings = _filter_non_json_lines(stdout)
+            data = json.loads(filtered)
+        except ValueError:
+            data = dict(failed=True, msg="MODULE FAILURE", module_stdout=stdout)
+            if response.get('exception'):
+                data['exception'] = response['exception']
+            return data
+
+        remove_internal_keys(data)
+        return data
@@ -0,0 +1 @@
+okta.py
\ No newline at end of file
@@ -0,0 +1,530 @@
+#!/usr/bin/env python
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Local stand-in for the parts of the Okta API used by the modules.
+
+Serves users, groups and apps with their lifecycle, group membership and app
+assignment endpoints, paginates every collection with Link headers, sends
+X-Rate-Limit headers and ETags, and can add latency and inject 429/503
+responses. Point the modules at it with api_url:
+
+    python benchmarks/okta_mock.py --port 8080 --latency 0.02 --error-rate 0.01
+
+    - okta_users:
+        api_url: "http://127.0.0.1:8080"
+        api_key: "anything"
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import socket
+import string
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, quote, unquote, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import quote, unquote
+    from urlparse import parse_qs, urlparse
+
+
+ID_PREFIXES = {'users': '00u', 'groups': '00g', 'apps': '0oa'}
+FILTER_CLAUSE = re.compile(r'^\s*([\w.]+)\s+(eq|gt|lt|ge|le|sw)\s+"((?:[^"\\]|\\.)*)"\s*$')
+
+
+def new_id(prefix):
+    return prefix + ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(17))
+
+
+def timestamp(offset=0):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(time.time() + offset))
+
+
+def lookup(obj, path):
+    for key in path.split('.'):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+def matches(obj, expression):
+    """Evaluate the subset of the Okta filter syntax the modules use: clauses
+    such as profile.login eq "x" or lastUpdated gt "...", joined by and/or,
+    with backslash escapes in the values."""
+
+    for alternative in re.split(r'\s+or\s+', expression):
+        ok = True
+        for clause in re.split(r'\s+and\s+', alternative.strip('() ')):
+            m = FILTER_CLAUSE.match(clause.strip('() '))
+            if m is None:
+                raise ValueError(clause)
+            field, op, value = m.groups()
+            value = re.sub(r'\\(.)', r'\1', value)
+            actual = lookup(obj, field)
+            if actual is None:
+                ok = False
+            elif op == 'eq':
+                ok = str(actual).lower() == value.lower()
+            elif op == 'sw':
+                ok = str(actual).startswith(value)
+            elif op == 'gt':
+                ok = actual > value
+            elif op == 'ge':
+                ok = actual >= value
+            elif op == 'lt':
+                ok = actual < value
+            elif op == 'le':
+                ok = actual <= value
+            if not ok:
+                break
+        if ok:
+            return True
+    return False
+
+
+class Org(object):
+    """In-memory org state shared by all request threads."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users = {}
+        self.groups = {}
+        self.apps = {}
+        self.members = {}
+        self.app_groups = {}
+        self.app_users = {}
+        self.requests = 0
+        self.endpoints = {}
+        self.windows = {}
+
+    def store(self, kind):
+        return getattr(self, kind)
+
+    def add_user(self, login, status='ACTIVE', **profile):
+        profile['login'] = login
+        user = dict(id=new_id('00u'), status=status, created=timestamp(), lastUpdated=timestamp(),
+                    profile=profile, credentials={'provider': {'type': 'OKTA', 'name': 'OKTA'}},
+                    _links={'self': {'href': '/api/v1/users/'}})
+        self.users[user['id']] = user
+        return user
+
+    def add_group(self, name, description=''):
+        group = dict(id=new_id('00g'), type='OKTA_GROUP', created=timestamp(), lastUpdated=timestamp(),
+                     lastMembershipUpdated=timestamp(), profile=dict(name=name, description=description),
+                     _links={'self': {'href': '/api/v1/groups/'}})
+        self.groups[group['id']] = group
+        return group
+
+    def add_app(self, label, status='ACTIVE', sign_on_mode='AUTO_LOGIN'):
+        app = dict(id=new_id('0oa'), label=label, status=status, signOnMode=sign_on_mode,
+                   created=timestamp(), lastUpdated=timestamp(), settings={'signOn': {}},
+                   _links={'self': {'href': '/api/v1/apps/'}})
+        self.apps[app['id']] = app
+        return app
+
+    def seed(self, users=0, groups=0, apps=0, members_per_group=0):
+        with self.lock:
+            user_ids = [self.add_user('user%d@example.com' % i, firstName='User', lastName=str(i),
+                                      email='user%d@example.com' % i)['id'] for i in range(users)]
+            for i in range(groups):
+                group = self.add_group('Group %d' % i)
+                self.members[group['id']] = set(random.sample(user_ids, min(members_per_group, len(user_ids))))
+            for i in range(apps):
+                self.add_app('App %d' % i)
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    org = None
+    latency = 0.0
+    error_rate = 0.0
+    rate_limit = 0
+
+    def log_message(self, *args):
+        pass
+
+    def endpoint(self, method, parts):
+        template = ['api', 'v1'] + [part if i % 2 == 0 or part in ('lifecycle', 'activate', 'deactivate') else '{id}'
+                                    for i, part in enumerate(parts)]
+        return '%s /%s' % (method, '/'.join(template))
+
+    def respond(self, status, obj=None, links=None, limit=None):
+        body = b'' if obj is None else json.dumps(obj).encode('utf-8')
+        etag = None
+
+        if status == 200 and self.command == 'GET':
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            if self.headers.get('If-None-Match') == etag:
+                status, body = 304, b''
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        if limit:
+            for name, value in zip(('Limit', 'Remaining', 'Reset'), limit):
+                self.send_header('X-Rate-Limit-%s' % name, str(value))
+        for link in links or []:
+            self.send_header('Link', link)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, status, code, summary, limit=None):
+        self.respond(status, dict(errorCode=code, errorSummary=summary, errorCauses=[]), limit=limit)
+
+    def budget(self, endpoint):
+        """Fixed one minute window per endpoint, like Okta's org-wide rate limits."""
+
+        limit = self.rate_limit or 1000000
+        now = int(time.time())
+        with self.org.lock:
+            start, used = self.org.windows.get(endpoint, (now, 0))
+            if now - start >= 60:
+                start, used = now, 0
+            used += 1
+            self.org.windows[endpoint] = (start, used)
+        remaining = max(limit - used, 0)
+        return (limit, remaining, start + 60), self.rate_limit and used > limit
+
+    def page(self, items, query, limit_headers):
+        limit = int(query.get('limit', ['200'])[0])
+        after = query.get('after', [None])[0]
+
+        start = 0
+        if after is not None:
+            ids = [item['id'] for item in items]
+            start = ids.index(after) + 1 if after in ids else len(items)
+
+        page = items[start:start + limit]
+        path = urlparse(self.path).path
+        base = 'http://%s%s' % (self.headers.get('Host'), path)
+        extra = ''.join('&%s=%s' % (k, quote(v[0], safe='')) for k, v in sorted(query.items()) if k not in ('limit', 'after'))
+
+        links = ['<%s?limit=%d%s>; rel="self"' % (base, limit, extra)]
+        if start + limit < len(items):
+            links.append('<%s?limit=%d&after=%s%s>; rel="next"' % (base, limit, page[-1]['id'], extra))
+
+        self.respond(200, page, links, limit_headers)
+
+    def handle_method(self, method):
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        parts = [unquote(part) for part in parsed.path.split('/') if part][2:]
+
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+
+        endpoint = self.endpoint(method, parts)
+        with self.org.lock:
+            self.org.requests += 1
+            self.org.endpoints[endpoint] = self.org.endpoints.get(endpoint, 0) + 1
+
+        if self.latency:
+            time.sleep(random.uniform(self.latency * 0.5, self.latency * 1.5))
+
+        limit, exceeded = self.budget(endpoint)
+        if exceeded:
+            return self.error(429, 'E0000047', 'API call exceeded rate limit due to too many requests.', limit)
+        if self.error_rate and random.random() < self.error_rate:
+            if random.random() < 0.5:
+                # Like a concurrency limit hit, which clears within a second rather than at the window reset
+                return self.error(429, 'E0000047', 'API call exceeded rate limit due to too many requests.',
+                                  (limit[0], 0, int(time.time()) + 1))
+            return self.error(503, 'E0000009', 'Internal Server Error', limit)
+
+        try:
+            data = json.loads(raw.decode('utf-8')) if raw else {}
+        except ValueError:
+            return self.error(400, 'E0000003', 'The request body was not well-formed.', limit)
+
+        if not parts or parts[0] not in ID_PREFIXES:
+            return self.error(404, 'E0000022', 'The endpoint does not support the provided HTTP method', limit)
+
+        with self.org.lock:
+            try:
+                self.route(method, parts, query, data, limit)
+            except ValueError as e:
+                self.error(400, 'E0000031', 'Invalid search criteria: %s' % e, limit)
+
+    def find(self, kind, key):
+        store = self.org.store(kind)
+        if key in store:
+            return store[key]
+        if kind == 'users':
+            for user in store.values():
+                if user['profile'].get('login', '').lower() == key.lower():
+                    return user
+        return None
+
+    def route(self, method, parts, query, data, limit):
+        org = self.org
+        kind = parts[0]
+        store = org.store(kind)
+
+        if len(parts) == 1:
+            if method == 'GET':
+                items = sorted(store.values(), key=lambda item: item['id'])
+                if 'q' in query:
+                    q = query['q'][0].lower()
+                    items = [item for item in items
+                             if any(str(value).lower().startswith(q) for value in
+                                    (list(item.get('profile', {}).values()) + [item.get('label', '')]))]
+                for key in ('filter', 'search'):
+                    if key in query:
+                        expression = query[key][0]
+                        m = re.match(r'^(user|group)\.id eq "([^"]+)"$', expression)
+                        if kind == 'apps' and m:
+                            table = org.app_users if m.group(1) == 'user' else org.app_groups
+                            items = [app for app in items if m.group(2) in table.get(app['id'], {})]
+                            if query.get('expand', [''])[0] == 'user/%s' % m.group(2) and m.group(1) == 'user':
+                                items = [dict(app, _embedded={'user': table[app['id']][m.group(2)]}) for app in items]
+                        else:
+                            items = [item for item in items if matches(item, expression)]
+                return self.page(items, query, limit)
+
+            if method == 'POST':
+                return self.create(kind, query, data, limit)
+
+            return self.error(405, 'E0000022', 'The endpoint does not support the provided HTTP method', limit)
+
+        obj = self.find(kind, parts[1])
+        if obj is None:
+            return self.error(404, 'E0000007', 'Not found: Resource not found: %s (%s)' % (parts[1], kind), limit)
+
+        if len(parts) == 2:
+            return self.single(kind, obj, method, data, limit)
+
+        if parts[2] == 'lifecycle' and len(parts) == 4 and method == 'POST':
+            return self.lifecycle(kind, obj, parts[3], limit)
+
+        if kind == 'groups' and parts[2] == 'users':
+            members = org.members.setdefault(obj['id'], set())
+            if len(parts) == 3 and method == 'GET':
+                return self.page([org.users[m] for m in sorted(members) if m in org.users], query, limit)
+            if len(parts) == 4 and parts[3] not in org.users:
+                return self.error(404, 'E0000007', 'Not found: Resource not found: %s (User)' % parts[3], limit)
+            if len(parts) == 4 and method == 'PUT':
+                members.add(parts[3])
+                obj['lastMembershipUpdated'] = timestamp()
+                return self.respond(204)
+            if len(parts) == 4 and method == 'DELETE':
+                members.discard(parts[3])
+                obj['lastMembershipUpdated'] = timestamp()
+                return self.respond(204)
+
+        if kind == 'users' and parts[2] == 'groups' and len(parts) == 3 and method == 'GET':
+            groups = [org.groups[g] for g, m in sorted(org.members.items()) if obj['id'] in m and g in org.groups]
+            return self.page(groups, query, limit)
+
+        if kind == 'apps' and parts[2] in ('groups', 'users'):
+            table = (org.app_groups if parts[2] == 'groups' else org.app_users).setdefault(obj['id'], {})
+            if len(parts) == 3 and method == 'GET':
+                return self.page([table[key] for key in sorted(table)], query, limit)
+            # Users are assigned by posting {"id": ..., "scope": "USER"} to the collection, posting to
+            # /users/{id} only updates an assignment that already exists
+            created = len(parts) == 3 and parts[2] == 'users' and method == 'POST'
+            if created or len(parts) == 4:
+                target = data.get('id') if created else parts[3]
+                if method == 'GET':
+                    if target not in table:
+                        return self.error(404, 'E0000007', 'Not found: Resource not found: %s' % target, limit)
+                    return self.respond(200, table[target], limit=limit)
+                if (parts[2] == 'groups' and method == 'PUT') or (parts[2] == 'users' and method == 'POST'):
+                    if target not in org.store(parts[2]) or (parts[2] == 'users' and not created and target not in table):
+                        return self.error(404, 'E0000007', 'Not found: Resource not found: %s' % target, limit)
+                    assignment = dict(data, id=target, lastUpdated=timestamp(),
+                                      _links={'self': {'href': '/api/v1/apps/%s/%s/%s' % (obj['id'], parts[2], target)}})
+                    if parts[2] == 'users':
+                        assignment.setdefault('scope', 'USER')
+                    else:
+                        assignment.setdefault('priority', 0)
+                    table[target] = assignment
+                    return self.respond(200, assignment, limit=limit)
+                if method == 'DELETE':
+                    table.pop(target, None)
+                    return self.respond(204)
+
+        return self.error(404, 'E0000022', 'The endpoint does not support the provided HTTP method', limit)
+
+    def create(self, kind, query, data, limit):
+        org = self.org
+
+        if kind == 'users':
+            profile = data.get('profile', {})
+            if not profile.get('login'):
+                return self.error(400, 'E0000001', 'Api validation failed: login', limit)
+            if self.find('users', profile['login']) is not None:
+                return self.error(400, 'E0000001', 'Api validation failed: login: An object with this field already exists', limit)
+            activate = query.get('activate', ['true'])[0].lower() == 'true'
+            user = org.add_user(profile.pop('login'), status='ACTIVE' if activate else 'STAGED', **profile)
+            for group_id in data.get('groupIds') or []:
+                org.members.setdefault(group_id, set()).add(user['id'])
+            return self.respond(200, user, limit=limit)
+
+        if kind == 'groups':
+            profile = data.get('profile', {})
+            if not profile.get('name'):
+                return self.error(400, 'E0000001', 'Api validation failed: name', limit)
+            group = org.add_group(profile['name'], profile.get('description', ''))
+            return self.respond(200, group, limit=limit)
+
+        app = org.add_app(data.get('label', ''), sign_on_mode=data.get('signOnMode', 'AUTO_LOGIN'))
+        for key in ('settings', 'visibility', 'features', 'credentials'):
+            if key in data:
+                app[key] = data[key]
+        return self.respond(200, app, limit=limit)
+
+    def single(self, kind, obj, method, data, limit):
+        store = self.org.store(kind)
+
+        if method == 'GET':
+            return self.respond(200, obj, limit=limit)
+
+        if method in ('POST', 'PUT'):
+            if kind == 'users':
+                profile = data.get('profile', {})
+                if method == 'POST':
+                    obj['profile'].update(profile)
+                else:
+                    obj['profile'] = profile
+            elif kind == 'groups':
+                obj['profile'] = data.get('profile', {})
+            else:
+                for key, value in data.items():
+                    if key not in ('id', 'status', '_links', '_embedded', 'created', 'lastUpdated'):
+                        obj[key] = value
+            obj['lastUpdated'] = timestamp()
+            return self.respond(200, obj, limit=limit)
+
+        if method == 'DELETE':
+            if kind == 'users' and obj['status'] != 'DEPROVISIONED':
+                obj['status'] = 'DEPROVISIONED'
+                obj['lastUpdated'] = timestamp()
+                return self.respond(204)
+            if kind == 'apps' and obj['status'] != 'INACTIVE':
+                return self.error(400, 'E0000056', 'Delete application forbidden.', limit)
+            del store[obj['id']]
+            if kind == 'users':
+                for members in self.org.members.values():
+                    members.discard(obj['id'])
+            if kind == 'groups':
+                self.org.members.pop(obj['id'], None)
+            return self.respond(204)
+
+        return self.error(405, 'E0000022', 'The endpoint does not support the provided HTTP method', limit)
+
+    def lifecycle(self, kind, obj, operation, limit):
+        if operation == 'activate':
+            if kind == 'users' and obj['status'] == 'ACTIVE':
+                return self.error(403, 'E0000016', 'Activation failed because the user is already active', limit)
+            obj['status'] = 'ACTIVE'
+        elif operation == 'deactivate':
+            obj['status'] = 'DEPROVISIONED' if kind == 'users' else 'INACTIVE'
+        else:
+            return self.error(404, 'E0000022', 'The endpoint does not support the provided HTTP method', limit)
+        obj['lastUpdated'] = timestamp()
+        return self.respond(200, {}, limit=limit)
+
+    def do_GET(self):
+        self.handle_method('GET')
+
+    def do_POST(self):
+        self.handle_method('POST')
+
+    def do_PUT(self):
+        self.handle_method('PUT')
+
+    def do_DELETE(self):
+        self.handle_method('DELETE')
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, *args, **kwargs):
+        HTTPServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+
+    def process_request(self, request, client_address):
+        self.connections.add(request)
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        self.connections.discard(request)
+        HTTPServer.shutdown_request(self, request)
+
+    def stop(self):
+        """Stop serving and close idle keep-alive connections so handler threads exit."""
+
+        self.shutdown()
+        for request in list(self.connections):
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self.server_close()
+
+
+def start(port=0, latency=0.0, error_rate=0.0, rate_limit=0, org=None):
+    """Start the mock in a background thread, returning (server, org)."""
+
+    org = org or Org()
+
+    class BoundHandler(Handler):
+        pass
+
+    BoundHandler.org = org
+    BoundHandler.latency = latency
+    BoundHandler.error_rate = error_rate
+    BoundHandler.rate_limit = rate_limit
+
+    server = MockServer(('127.0.0.1', port), BoundHandler)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server, org
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='mean seconds added to each response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 429 or 503')
+    parser.add_argument('--rate-limit', type=int, default=0, help='requests per minute per endpoint, 0 for unlimited')
+    parser.add_argument('--users', type=int, default=0)
+    parser.add_argument('--groups', type=int, default=0)
+    parser.add_argument('--apps', type=int, default=0)
+    parser.add_argument('--members-per-group', type=int, default=0)
+    args = parser.parse_args()
+
+    org = Org()
+    org.seed(args.users, args.groups, args.apps, args.members_per_group)
+
+    server, org = start(args.port, args.latency, args.error_rate, args.rate_limit, org)
+    print('Okta mock listening on http://127.0.0.1:%d' % server.server_address[1])
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Benchmark every module action against the Okta mock server.
+
+Each module runs in-process, the same way Ansible runs it on the target,
+against a seeded mock org. For every operation the number of iterations,
+the HTTP requests it made, requests per second and p50/p99 task latency
+are reported. Needs an interpreter with Ansible installed:
+
+    python benchmarks/run.py --iterations 20 --users 2000 --latency 0.01
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import okta_mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY = 'benchmark-api-key-00000000'
+
+
+def load_source(name, path):
+    """Import a file as module name, like the removed imp.load_source."""
+
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_modules():
+    """Import the modules the way Ansible's module runner would see them."""
+
+    import ansible.module_utils
+    load_source('ansible.module_utils.okta_client', os.path.join(ROOT, 'module_utils', 'okta_client.py'))
+
+    modules = {}
+    for name in ('okta_users', 'okta_groups', 'okta_apps', 'okta_apps_swa', 'okta_apps_saml', 'okta_info'):
+        modules[name] = load_source('benchmark_' + name, os.path.join(ROOT, 'library', name + '.py'))
+    return modules
+
+
+def run_module(module, args):
+    """Run one task and return its parsed result."""
+
+    from ansible.module_utils import basic
+
+    basic._ANSIBLE_ARGS = json.dumps({'ANSIBLE_MODULE_ARGS': args}).encode('utf-8')
+    if hasattr(basic, '_ANSIBLE_PROFILE'):
+        basic._ANSIBLE_PROFILE = 'legacy'
+
+    stdout = sys.stdout
+    sys.stdout = captured = StringIO()
+    try:
+        module.main()
+    except SystemExit:
+        pass
+    finally:
+        sys.stdout = stdout
+
+    output = captured.getvalue()
+    try:
+        return json.loads(output[output.index('{'):])
+    except ValueError:
+        return dict(failed=True, msg=output)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+class Fixtures(object):
+    """Objects created directly in the mock org, outside the timed task."""
+
+    def __init__(self, org, tmp):
+        self.org = org
+        self.tmp = tmp
+        self.serial = 0
+
+    def name(self, prefix):
+        self.serial += 1
+        return '%s-%d' % (prefix, self.serial)
+
+    def user(self, status='ACTIVE'):
+        login = self.name('bench') + '@example.com'
+        with self.org.lock:
+            return self.org.add_user(login, status=status, firstName='Bench', lastName='User', email=login)['id']
+
+    def group(self):
+        with self.org.lock:
+            return self.org.add_group(self.name('Bench Group'))['id']
+
+    def group_name(self, index=0):
+        with self.org.lock:
+            return self.org.groups[sorted(self.org.groups)[index]]['profile']['name']
+
+    def login(self, index=0):
+        with self.org.lock:
+            return self.org.users[sorted(self.org.users)[index]]['profile']['login']
+
+    def app(self, status='ACTIVE'):
+        with self.org.lock:
+            return self.org.add_app(self.name('Bench App'), status=status)['id']
+
+    def app_with(self, table, key, value):
+        app_id = self.app()
+        with self.org.lock:
+            getattr(self.org, table).setdefault(app_id, {})[key] = dict(value, id=key)
+        return app_id
+
+    def member(self, group_id):
+        user_id = self.user()
+        with self.org.lock:
+            self.org.members.setdefault(group_id, set()).add(user_id)
+        return user_id
+
+    def some(self, kind, count):
+        with self.org.lock:
+            return sorted(getattr(self.org, kind))[:count]
+
+    def dest(self, suffix):
+        return os.path.join(self.tmp, self.name('export') + suffix)
+
+
+def operations(f, batch):
+    """(name, module, function returning the task arguments) for each action."""
+
+    def user_profile(prefix):
+        login = f.name(prefix) + '@example.com'
+        return dict(login=login, email=login, first_name='Bench', last_name='User')
+
+    def saml(**args):
+        args.update(ssoAcsUrl='https://sp.example.com/acs', audience='https://sp.example.com',
+                    recipient='https://sp.example.com/acs', destination='https://sp.example.com/acs')
+        return args
+
+    def app_assignment(table, target, action):
+        target_id = target()
+        return dict(action=action, id=f.app_with(table, target_id, {}),
+                    **{'group_id' if table == 'app_groups' else 'user_id': target_id})
+
+    def group_member():
+        group_id = f.group()
+        return dict(action='remove_user', id=group_id, user_id=f.member(group_id))
+
+    return [
+        ('users list', 'okta_users', lambda: dict(action='list', limit=200)),
+        ('users list all', 'okta_users', lambda: dict(action='list', limit=200, paginate='all')),
+        ('users list all to dest', 'okta_users', lambda: dict(action='list', limit=200, paginate='all',
+                                                              dest=f.dest('.jsonl.gz'))),
+        ('users create', 'okta_users', lambda: dict(action='create', **user_profile('create'))),
+        ('users create bulk x%d' % batch, 'okta_users',
+         lambda: dict(action='create', users=[user_profile('bulk') for i in range(batch)])),
+        ('users present unchanged', 'okta_users',
+         lambda: dict(state='present', id=f.user(), first_name='Bench', last_name='User')),
+        ('users present update', 'okta_users',
+         lambda: dict(state='present', id=f.user(), first_name='Renamed', group_ids=f.some('groups', 2))),
+        ('users update', 'okta_users', lambda: dict(action='update', id=f.user(), first_name='Renamed')),
+        ('users deactivate', 'okta_users', lambda: dict(action='deactivate', id=f.user())),
+        ('users activate', 'okta_users', lambda: dict(action='activate', id=f.user('STAGED'))),
+        ('users deactivate unchanged', 'okta_users', lambda: dict(action='deactivate', id=f.user('DEPROVISIONED'))),
+        ('users delete', 'okta_users', lambda: dict(action='delete', id=f.user('DEPROVISIONED'))),
+        ('users delete bulk x%d' % batch, 'okta_users',
+         lambda: dict(action='delete', users=[dict(id=f.user('DEPROVISIONED')) for i in range(batch)])),
+        ('users deprovision x%d' % batch, 'okta_users',
+         lambda: dict(action='deprovision', unassign_apps=True, user_ids=[f.user() for i in range(batch)])),
+        ('groups list', 'okta_groups', lambda: dict(action='list')),
+        ('groups list all', 'okta_groups', lambda: dict(action='list', paginate='all')),
+        ('groups create', 'okta_groups', lambda: dict(action='create', name=f.name('Created Group'))),
+        ('groups update', 'okta_groups', lambda: dict(action='update', id=f.group(), name=f.name('Renamed Group'))),
+        ('groups delete', 'okta_groups', lambda: dict(action='delete', id=f.group())),
+        ('groups present', 'okta_groups', lambda: dict(state='present', name=f.name('Present Group'))),
+        ('groups absent', 'okta_groups', lambda: dict(state='absent', id=f.group())),
+        ('groups add_user', 'okta_groups', lambda: dict(action='add_user', id=f.group(), user_id=f.user())),
+        ('groups add_user by name', 'okta_groups',
+         lambda: dict(action='add_user', id=f.group_name(), user_id=f.login())),
+        ('groups remove_user', 'okta_groups', group_member),
+        ('groups sync_members x%d' % batch, 'okta_groups',
+         lambda: dict(action='sync_members', id=f.group(), user_ids=f.some('users', batch))),
+        ('apps list', 'okta_apps', lambda: dict(action='list')),
+        ('apps list all', 'okta_apps', lambda: dict(action='list', limit=200, paginate='all')),
+        ('apps assign_group', 'okta_apps', lambda: dict(action='assign_group', id=f.app(), group_id=f.group())),
+        ('apps remove_group', 'okta_apps', lambda: app_assignment('app_groups', f.group, 'remove_group')),
+        ('apps assign_groups x%d' % batch, 'okta_apps',
+         lambda: dict(action='assign_groups', id=f.app(), group_ids=f.some('groups', batch))),
+        ('apps sync_assignments x%d' % batch, 'okta_apps',
+         lambda: dict(action='sync_assignments', id=f.app(), groups=f.some('groups', batch),
+                      user_ids=f.some('users', batch))),
+        ('apps assign_user', 'okta_apps', lambda: dict(action='assign_user', id=f.app(), user_id=f.user())),
+        ('apps remove_user', 'okta_apps', lambda: app_assignment('app_users', f.user, 'remove_user')),
+        ('apps deactivate', 'okta_apps', lambda: dict(action='deactivate', id=f.app())),
+        ('apps activate', 'okta_apps', lambda: dict(action='activate', id=f.app('INACTIVE'))),
+        ('apps delete', 'okta_apps', lambda: dict(action='delete', id=f.app())),
+        ('swa create', 'okta_apps_swa',
+         lambda: dict(action='create', label=f.name('SWA App'), login_url='https://swa.example.com/login',
+                      redirect_url='https://swa.example.com', scheme='EDIT_USERNAME_AND_PASSWORD')),
+        ('swa update', 'okta_apps_swa',
+         lambda: dict(action='update', id=f.app(), label=f.name('SWA App'), login_url='https://swa.example.com/login',
+                      scheme='EDIT_USERNAME_AND_PASSWORD')),
+        ('saml create', 'okta_apps_saml', lambda: saml(action='create', label=f.name('SAML App'))),
+        ('saml update', 'okta_apps_saml', lambda: saml(action='update', id=f.app(), label=f.name('SAML App'))),
+        ('info snapshot', 'okta_info', lambda: dict()),
+    ]
+
+
+def benchmark(modules, org, url, ops, iterations, only, cache_dir):
+    results = []
+
+    for name, module_name, make_args in ops:
+        if only and not any(word in name for word in only):
+            continue
+
+        durations = []
+        requests = 0
+        failures = []
+
+        for i in range(iterations):
+            args = make_args()
+            args.update(api_url=url, api_key=API_KEY, cache_dir=cache_dir)
+
+            before = org.requests
+            start = time.time()
+            result = run_module(modules[module_name], args)
+            durations.append(time.time() - start)
+            requests += org.requests - before
+
+            if result.get('failed'):
+                failures.append(result.get('msg'))
+
+        total = sum(durations)
+        results.append(dict(name=name, iterations=iterations, requests=requests,
+                            requests_per_second=requests / total if total else 0.0,
+                            p50=percentile(durations, 0.5), p99=percentile(durations, 0.99),
+                            failed=len(failures), error=failures[0] if failures else None))
+
+    return results
+
+
+def report(results):
+    print('%-28s %6s %9s %9s %9s %9s %7s' % ('operation', 'iters', 'requests', 'req/s', 'p50 ms', 'p99 ms', 'failed'))
+    for r in results:
+        print('%-28s %6d %9d %9.1f %9.1f %9.1f %7d' % (r['name'], r['iterations'], r['requests'],
+                                                      r['requests_per_second'], r['p50'] * 1000,
+                                                      r['p99'] * 1000, r['failed']))
+    for r in results:
+        if r['error']:
+            print('%s: %s' % (r['name'], r['error']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--users', type=int, default=1000, help='users seeded in the mock org')
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--apps', type=int, default=20)
+    parser.add_argument('--members-per-group', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=20, help='items per bulk and sync_members task')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean seconds added to each mock response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 429 or 503')
+    parser.add_argument('--rate-limit', type=int, default=0, help='requests per minute per endpoint, 0 for unlimited')
+    parser.add_argument('--only', action='append', help='only run operations whose name contains this')
+    parser.add_argument('--json', dest='as_json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    org = okta_mock.Org()
+    org.seed(args.users, args.groups, args.apps, args.members_per_group)
+    server, org = okta_mock.start(0, args.latency, args.error_rate, args.rate_limit, org)
+    url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    modules = load_modules()
+    tmp = tempfile.mkdtemp(prefix='okta-benchmark-')
+
+    try:
+        results = benchmark(modules, org, url, operations(Fixtures(org, tmp), args.batch),
+                            args.iterations, args.only, os.path.join(tmp, 'cache'))
+    finally:
+        server.stop()
+        shutil.rmtree(tmp)
+
+    if args.as_json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+    return 1 if any(r['failed'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+    name: okta
+    plugin_type: inventory
+    short_description: Okta users as hosts, grouped by their Okta groups
+    description:
+        - Lists the Okta groups, then the members of every group concurrently
+          with full pagination, through the same client as the modules
+          (module_utils/okta_client.py). Each member becomes a host in an
+          inventory group named after the Okta group.
+        - The result is kept in the inventory cache when cache is enabled, so a
+          warm run makes no request at all.
+        - With snapshot, a refresh only fetches the members of groups whose
+          lastMembershipUpdated changed since the previous run, and the users
+          updated since then.
+        - Uses a YAML configuration file that ends with okta.yml or okta.yaml.
+    extends_documentation_fragment:
+        - constructed
+        - inventory_cache
+    options:
+        plugin:
+            description: Token that ensures this is a source file for the plugin.
+            required: True
+            choices: ['okta']
+        organization:
+            description:
+                - Okta subdomain for your organization. (i.e.
+                  mycompany.okta.com).
+            env:
+                - name: OKTA_ORGANIZATION
+        api_url:
+            description:
+                - Base URL of the Okta org, used instead of organization for orgs
+                  outside okta.com or a local test server (i.e.
+                  https://mycompany.oktapreview.com).
+            env:
+                - name: OKTA_API_URL
+        api_key:
+            description:
+                - Okta API key.
+            required: True
+            env:
+                - name: OKTA_API_KEY
+        max_retries:
+            description:
+                - Number of times a request is retried after a 429 rate limit
+                  response, or after a 5xx error.
+            type: int
+            default: 5
+        concurrency:
+            description:
+                - Maximum number of groups whose members are fetched in parallel.
+            type: int
+            default: 10
+        limit:
+            description:
+                - Page size used for every list.
+            type: int
+            default: 200
+        q:
+            description:
+                - Only include groups whose name starts with this value.
+        filter:
+            description:
+                - Okta filter expression selecting the groups to include (i.e.
+                  type eq "OKTA_GROUP").
+        search:
+            description:
+                - Okta search expression selecting the groups to include (i.e.
+                  profile.name sw "Engineering").
+        hostname:
+            description:
+                - User profile attribute used as the inventory hostname. Users
+                  without it are left out.
+            default: login
+        snapshot:
+            description:
+                - Keep the groups, their members and the users in this local
+                  JSON file, and only fetch what changed since the previous
+                  run. Users deleted outside the listed groups are only dropped
+                  once they leave them; remove the file to rebuild it.
+            type: path
+"""
+
+EXAMPLES = """
+# okta.yml
+plugin: okta
+organization: unicorns
+api_key: TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ
+search: profile.name sw "Engineering"
+snapshot: ~/.ansible/okta_inventory.json
+cache: yes
+cache_plugin: jsonfile
+cache_connection: ~/.ansible/inventory_cache
+cache_timeout: 3600
+compose:
+  ansible_user: okta_profile.login.split('@')[0]
+keyed_groups:
+  - key: okta_status
+    prefix: status
+"""
+
+import json
+import os
+import sys
+
+from ansible import constants as C
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_native
+from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable, Constructable
+
+# load_okta_client and PluginModule are shared with the okta lookup plugin
+MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'module_utils')
+for path in list(C.DEFAULT_MODULE_UTILS_PATH or []) + [MODULE_UTILS]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from okta_plugin import load_okta_client, PluginModule  # noqa: E402
+
+USER_FIELDS = ('id', 'status', 'lastUpdated', 'profile')
+
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
+
+    NAME = 'okta'
+
+    def verify_file(self, path):
+        return super(InventoryModule, self).verify_file(path) and path.endswith(('okta.yml', 'okta.yaml'))
+
+    def load_snapshot(self, path):
+        if path is None or not os.path.exists(path):
+            return None, {}, {}
+
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            raise AnsibleError("Unable to read snapshot %s: %s" % (path, to_native(e)))
+
+        return data.get('lastUpdated'), data.get('groups', {}), data.get('users', {})
+
+    def save_snapshot(self, path, watermark, groups, users):
+        okta = load_okta_client()
+
+        try:
+            with okta.atomic_write(path) as f:
+                json.dump(dict(lastUpdated=watermark, groups=groups, users=users), f)
+        except (IOError, OSError) as e:
+            raise AnsibleError("Unable to write snapshot %s: %s" % (path, to_native(e)))
+
+    def fetch(self):
+        """Groups with their member IDs and the members, keyed by ID, from the
+        API, reusing the snapshot for groups whose membership did not change."""
+
+        okta = load_okta_client()
+
+        params = dict((name, self.get_option(name)) for name in
+                      ('organization', 'api_url', 'api_key', 'max_retries', 'concurrency'))
+        module = PluginModule(params)
+        client = okta.OktaClient(None, params['api_key'], pool_size=params['concurrency'],
+                                 max_retries=params['max_retries'])
+
+        base_url = okta.okta_base_url(module)
+        limit = self.get_option('limit')
+        path = self.get_option('snapshot')
+
+        watermark, previous, users = self.load_snapshot(path)
+
+        graph = okta.TaskGraph(module)
+        urls = {}
+
+        def fetch(url):
+            def run(item_module, deps):
+                items = []
+                for info, page in client.pages(url, item_module):
+                    items.extend(page)
+                return dict(items=items)
+            return run
+
+        def list_groups(item_module, deps):
+            result = fetch(urls['groups'])(item_module, deps)
+            for group in result['items']:
+                known = previous.get(group['id'])
+                if known is None or known['lastMembershipUpdated'] != group.get('lastMembershipUpdated'):
+                    urls[group['id']] = base_url + "/groups/%s/users?limit=%s" % (group['id'], limit)
+                    graph.add(group['id'], fetch(urls[group['id']]))
+            return result
+
+        query = dict(q=self.get_option('q'), filter=self.get_option('filter'), search=self.get_option('search'))
+        urls['groups'] = okta.list_url(module, base_url + "/groups", limit, query)
+        graph.add('groups', list_groups)
+
+        # Profiles of members of unchanged groups may still have changed
+        if watermark is not None:
+            urls['users'] = okta.list_url(module, base_url + "/users", limit,
+                                          dict(filter='lastUpdated gt "%s"' % watermark))
+            graph.add('users', fetch(urls['users']))
+
+        results = graph.run(params['concurrency'])
+
+        for key, result in results.items():
+            if result['failed']:
+                raise AnsibleError("Fetching %s failed: %s" % (urls[key], result['msg']))
+
+        groups = {}
+        for group in results['groups']['items']:
+            if group['id'] in results:
+                members = results[group['id']]['items']
+                for user in members:
+                    users[user['id']] = dict((field, user.get(field)) for field in USER_FIELDS)
+                member_ids = sorted(user['id'] for user in members)
+            else:
+                member_ids = previous[group['id']]['members']
+            groups[group['id']] = dict(name=group['profile'].get('name'),
+                                       lastMembershipUpdated=group.get('lastMembershipUpdated'),
+                                       members=member_ids)
+
+        for user in results.get('users', {}).get('items', []):
+            if user['id'] in users:
+                users[user['id']] = dict((field, user.get(field)) for field in USER_FIELDS)
+
+        wanted = set()
+        for group in groups.values():
+            wanted.update(group['members'])
+        users = dict((user_id, user) for user_id, user in users.items() if user_id in wanted)
+
+        watermark = okta.latest_timestamp(users.values(), watermark)
+
+        if path is not None:
+            self.save_snapshot(path, watermark, groups, users)
+
+        return dict(groups=groups, users=users)
+
+    def populate(self, data):
+        hostname = self.get_option('hostname')
+        strict = self.get_option('strict')
+
+        hosts = {}
+        for user_id, user in data['users'].items():
+            host = user['profile'].get(hostname)
+            if host:
+                hosts[user_id] = host
+                self.inventory.add_host(host)
+                self.inventory.set_variable(host, 'okta_id', user_id)
+                self.inventory.set_variable(host, 'okta_status', user['status'])
+                self.inventory.set_variable(host, 'okta_profile', user['profile'])
+
+        memberships = dict((user_id, []) for user_id in hosts)
+        for group_id, group in sorted(data['groups'].items()):
+            name = self.inventory.add_group(self._sanitize_group_name(group['name'] or group_id))
+            for user_id in group['members']:
+                if user_id in hosts:
+                    self.inventory.add_child(name, hosts[user_id])
+                    memberships[user_id].append(group['name'])
+
+        for user_id, host in hosts.items():
+            self.inventory.set_variable(host, 'okta_groups', memberships[user_id])
+            variables = self.inventory.get_host(host).get_vars()
+            self._set_composite_vars(self.get_option('compose'), variables, host, strict=strict)
+            self._add_host_to_composed_groups(self.get_option('groups'), variables, host, strict=strict)
+            self._add_host_to_keyed_groups(self.get_option('keyed_groups'), variables, host, strict=strict)
+
+    def parse(self, inventory, loader, path, cache=True):
+        super(InventoryModule, self).parse(inventory, loader, path, cache)
+
+        self._read_config_data(path)
+
+        if not self.get_option('organization') and not self.get_option('api_url'):
+            raise AnsibleError("The okta inventory needs organization or api_url")
+
+        cache_key = self.get_cache_key(path)
+        use_cache = self.get_option('cache') and cache
+        update_cache = self.get_option('cache') and not cache
+
+        data = None
+        if use_cache:
+            try:
+                data = self._cache[cache_key]
+            except KeyError:
+                update_cache = True
+
+        if data is None:
+            data = self.fetch()
+
+        if update_cache:
+            self._cache[cache_key] = data
+
+        self.populate(data)
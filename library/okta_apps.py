@@ -20,37 +20,185 @@ options:
         mycompany.okta.com).
     required: false
     default: None
+  api_url:
+    description:
+      - Base URL of the Okta org, used instead of organization for orgs
+        outside okta.com or a local test server (i.e.
+        https://mycompany.oktapreview.com).
+    required: false
+    default: None
   api_key:
     description:
       - Okta API key.
     required: false
     default: None
+  max_retries:
+    description:
+      - Number of times a request is retried after a 429 rate limit response,
+        or after a 5xx error for GET, PUT and DELETE requests. Requests are
+        also paced using the X-Rate-Limit headers returned by Okta.
+    required: false
+    default: 5
+  concurrency:
+    description:
+      - Maximum number of requests run in parallel by bulk actions.
+    required: false
+    default: 10
+  cache:
+    description:
+      - Cache GET responses on disk and reuse them across tasks. Fresh entries
+        are returned without a request, stale ones are revalidated with
+        If-None-Match when Okta returned an ETag. Any write made by the module
+        empties the cache.
+    required: false
+    default: false
+  cache_dir:
+    description:
+      - Directory holding the response cache and the ID index.
+    required: false
+    default: ~/.ansible/okta_cache
+  cache_ttl:
+    description:
+      - Number of seconds a cached response is used without revalidation.
+    required: false
+    default: 300
+  cache_max_entries:
+    description:
+      - Maximum number of cached responses, the least recently used are
+        evicted first.
+    required: false
+    default: 1000
+  id_cache_ttl:
+    description:
+      - Number of seconds a resolved user login, group name or app label is
+        kept in the ID index in cache_dir, so options taking IDs can be given
+        names instead without a lookup on every task. 0 disables the index.
+    required: false
+    default: 86400
+  return_mode:
+    description:
+      - How much of each returned Okta object is kept. full returns the
+        objects as received, compact drops _links, _embedded and
+        credentials, ids keeps only the object IDs and none returns no
+        objects, only the status, counts and per-entry outcomes.
+    required: false
+    default: full
+    choices: [ full, compact, ids, none ]
+  metrics:
+    description:
+      - Return a metrics list with one entry per API request, retries
+        included. Each has the method, endpoint (the path with IDs replaced
+        by {id}), status, bytes received, retries, reused (whether a
+        keep-alive connection was reused), wait (seconds paced or backing
+        off for rate limits and errors), the dns, connect, tls and ttfb
+        (time to first byte) seconds of the last attempt, and total.
+        Responses served from the cache are not requests and are left out.
+    required: false
+    default: false
+  trace_file:
+    description:
+      - Append the same per-request entries to this file as JSON lines,
+        with the start time and module name added, to profile every task
+        of a playbook run.
+    required: false
+    default: None
   action:
     description:
       - Action to take against apps API.
+      - activate, deactivate and delete read the app first and skip the
+        lifecycle calls that would not change its status, returning
+        changed false; an app that no longer exists counts as deleted.
     required: false
     default: list
-    choices: [ delete, list, assign_user, remove_user, assign_group, remove_group, activate, deactivate ]
+    choices: [ delete, list, assign_user, remove_user, assign_group, remove_group, assign_users, remove_users, assign_groups, remove_groups, sync_assignments, activate, deactivate ]
   id:
     description:
-      - ID of the app.
+      - ID of the app, or its label.
     required: false
     default: None
   group_id:
     description:
-      - Group ID to assign an app to.
+      - ID or name of the group to assign an app to.
     required: false
     default: 20
   user_id:
     description:
-      - Group ID to assign an app to.
+      - ID or login of the user to assign an app to.
     required: false
     default: 20
+  group_ids:
+    description:
+      - Group IDs or names to assign to or remove from the app in a single run with
+        the assign_groups and remove_groups actions. Groups are processed
+        concurrently, see concurrency.
+    required: false
+    default: None
+  user_ids:
+    description:
+      - User IDs or logins to assign to or remove from the app in a single run with
+        the assign_users and remove_users actions. Users are processed
+        concurrently, see concurrency.
+      - With sync_assignments, the complete list of users that should be
+        assigned to the app directly. Users who only have the app through a
+        group are left alone.
+    required: false
+    default: None
+  groups:
+    description:
+      - Complete list of groups that should be assigned to the app, used by
+        the sync_assignments action. Each entry is a group ID or name, or a
+        dictionary with id and an optional priority. Current assignments are
+        read once, then only the missing groups are assigned, priorities
+        that differ are updated and the extra groups removed, concurrently
+        (see concurrency). Omit to leave group assignments untouched.
+    required: false
+    default: None
   limit:
     description:
       - List limit.
     required: false
     default: 20
+  paginate:
+    description:
+      - Whether the list action returns a single page of results or follows
+        the Link header cursor to return the full collection.
+    required: false
+    default: page
+    choices: [ page, all ]
+  dest:
+    description:
+      - With the list action, stream each page to this file as JSON lines
+        (one object per line) as it arrives, instead of returning the
+        objects. The file is gzip compressed when the path ends in .gz.
+        Only counts are returned, so memory stays flat for large orgs.
+    required: false
+    default: None
+  q:
+    description:
+      - With the list action, only return apps whose name or label starts
+        with this value.
+    required: false
+    default: None
+  filter:
+    description:
+      - With the list action, Okta filter expression applied server side
+        (i.e. status eq "ACTIVE").
+    required: false
+    default: None
+  expand:
+    description:
+      - With the list action, embed the assignment of the given user in each
+        app, as user/ followed by the user ID. Used together with a
+        user.id eq filter.
+    required: false
+    default: None
+  fields:
+    description:
+      - With the list action, only keep these fields of each object in the
+        result or dest file. Nested fields are given with dots (i.e.
+        profile.login).
+    required: false
+    default: None
 """
 
 EXAMPLES = '''
@@ -60,6 +208,29 @@ EXAMPLES = '''
     api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
     limit: 20
 
+# List all apps, following pagination
+- okta_apps:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    limit: 200
+    paginate: all
+
+# List the active apps assigned to a user, with the assignment embedded
+- okta_apps:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    filter: 'user.id eq "00u5b3gqiLpE114tV2M7"'
+    expand: "user/00u5b3gqiLpE114tV2M7"
+    fields: [ id, label, _embedded ]
+
+# Export all apps to a compressed JSON lines file
+- okta_apps:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    limit: 200
+    paginate: all
+    dest: "/var/lib/okta/apps.jsonl.gz"
+
 # Activate app
 - okta_apps:
     action: activate
@@ -97,6 +268,29 @@ EXAMPLES = '''
     id: "01c5pEucucMPWXjFM456"
     group_id: "01c5pEucucMPWXjFM457"
 
+# Assign an app to many groups in one run
+- okta_apps:
+    action: assign_groups
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    id: "01c5pEucucMPWXjFM456"
+    group_ids:
+      - "01c5pEucucMPWXjFM457"
+      - "01c5pEucucMPWXjFM458"
+    concurrency: 20
+
+# Make the app assignments exactly these groups and users
+- okta_apps:
+    action: sync_assignments
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    id: "01c5pEucucMPWXjFM456"
+    groups:
+      - { id: "01c5pEucucMPWXjFM457", priority: 0 }
+      - { id: "01c5pEucucMPWXjFM458", priority: 1 }
+    user_ids:
+      - "01c5pEucucMPWXjFM459"
+
 # Assign an app to a user
 - okta_apps:
     action: assign_user
@@ -136,15 +330,77 @@ url:
   returned: always
   type: str
   sample: https://www.ansible.com/
+retries:
+  description: Number of requests retried after a rate limit or server error
+  returned: always
+  type: int
+  sample: 0
+results:
+  description: Per-target id, json, status, msg, url and failed flag, with
+    changed set when the assignment was written, plus the action taken for
+    sync_assignments
+  returned: when action is assign_groups, remove_groups, assign_users, remove_users or sync_assignments
+  type: list
+changed:
+  description: Whether a write was made
+  returned: when action is activate, deactivate, delete, assign_groups, remove_groups, assign_users, remove_users or sync_assignments
+  type: bool
+added_groups:
+  description: Group IDs assigned to the app
+  returned: when action is sync_assignments
+  type: list
+updated_groups:
+  description: Group IDs whose assignment priority was changed
+  returned: when action is sync_assignments
+  type: list
+removed_groups:
+  description: Group IDs removed from the app
+  returned: when action is sync_assignments
+  type: list
+added_users:
+  description: User IDs assigned to the app
+  returned: when action is sync_assignments
+  type: list
+removed_users:
+  description: User IDs removed from the app
+  returned: when action is sync_assignments
+  type: list
+count:
+  description: Number of objects written to dest
+  returned: when action is list and dest is set
+  type: int
+dest:
+  description: Path the list was written to
+  returned: when action is list and dest is set
+  type: str
+rate_limit_wait:
+  description: Seconds spent waiting on rate limits and retry backoff
+  returned: always
+  type: float
+  sample: 1.5
+cache:
+  description: Response cache hits and misses
+  returned: when cache is enabled
+  type: dict
+  sample: {"hits": 3, "misses": 1}
+metrics:
+  description: One entry per API request with its method, endpoint, status, bytes,
+    retries, reused, wait and the dns, connect, tls, ttfb and total seconds
+  returned: when metrics is enabled
+  type: list
+  sample: [{"method": "GET", "endpoint": "/api/v1/users/{id}", "status": 200, "bytes": 1043, "retries": 0, "reused": false, "wait": 0.0, "dns": 0.0012, "connect": 0.0214, "tls": 0.0437, "ttfb": 0.0921, "total": 0.1593}]
+pages:
+  description: Number of pages (and API requests) fetched when paginate is all
+  returned: when action is list and paginate is all, or dest is set
+  type: int
+  sample: 4
 '''
 
-def delete(module,base_url,api_key,id):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def delete(module,base_url,client,id):
 
     url = base_url+"/%s" % (id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='DELETE')
+    response, info = client.fetch(url, method='DELETE')
 
     if info['status'] != 204:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -156,13 +412,49 @@ def delete(module,base_url,api_key,id):
 
     return info['status'], info['msg'], content, url
 
-def list(module,base_url,api_key,limit):
+def find(module,base_url,client,id):
+
+    url = base_url+"/%s" % (id)
+
+    response, info = client.fetch(url, method='GET')
+
+    if info['status'] == 404:
+        return None, info, url
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
+
+    return json.loads(to_text(response.read(), encoding='UTF-8')), info, url
 
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def lifecycle(module,base_url,client,action,id):
 
-    url = base_url+"/?limit=%s" % (limit)
+    # The app is read first, so transitions to the state it is already in are
+    # skipped instead of posted
+    app, info, url = find(module,base_url,client,id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+    if app is None:
+        if action != "delete":
+            module.fail_json(msg="App %s does not exist" % (id))
+        return False, info['status'], info['msg'], "", url
+
+    if (action == "activate" and app['status'] == "ACTIVE") or (action == "deactivate" and app['status'] == "INACTIVE"):
+        return False, info['status'], info['msg'], module.jsonify(app), url
+
+    if action == "activate":
+        status, message, content, url = activate(module,base_url,client,id)
+    elif action == "deactivate":
+        status, message, content, url = deactivate(module,base_url,client,id)
+    else:
+        if app['status'] != "INACTIVE":
+            deactivate(module,base_url,client,id)
+        status, message, content, url = delete(module,base_url,client,id)
+
+    return True, status, message, content, url
+
+def list(module,base_url,client,limit,query):
+
+    url = list_url(module,base_url,limit,query)
+
+    response, info = client.fetch(url, method='GET')
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -174,13 +466,14 @@ def list(module,base_url,api_key,limit):
 
     return info['status'], info['msg'], content, url
 
-def assign_group(module,base_url,api_key,group_id,id):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def assign_group(module,base_url,client,group_id,id,priority=None):
 
     url = base_url+"/%s/groups/%s" % (id,group_id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='PUT')
+    if priority is not None:
+        response, info = client.fetch(url, method='PUT', data=module.jsonify(dict(priority=priority)))
+    else:
+        response, info = client.fetch(url, method='PUT')
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -192,13 +485,11 @@ def assign_group(module,base_url,api_key,group_id,id):
 
     return info['status'], info['msg'], content, url
 
-def remove_group(module,base_url,api_key,group_id,id):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def remove_group(module,base_url,client,group_id,id):
 
     url = base_url+"/%s/groups/%s" % (id,group_id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='DELETE')
+    response, info = client.fetch(url, method='DELETE')
 
     if info['status'] != 204:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -210,13 +501,12 @@ def remove_group(module,base_url,api_key,group_id,id):
 
     return info['status'], info['msg'], content, url
 
-def assign_user(module,base_url,api_key,user_id,id,send_email):
+def assign_user(module,base_url,client,user_id,id,send_email):
 
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+    # POST to /users/{user_id} only updates an existing assignment, new ones go to the collection
+    url = base_url+"/%s/users?sendEmail=%s" % (id,send_email)
 
-    url = base_url+"/%s/users/%s?sendEmail=%s" % (id,user_id,send_email)
-
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST')
+    response, info = client.fetch(url, method='POST', data=module.jsonify(dict(id=user_id, scope='USER')))
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -228,13 +518,11 @@ def assign_user(module,base_url,api_key,user_id,id,send_email):
 
     return info['status'], info['msg'], content, url
 
-def remove_user(module,base_url,api_key,user_id,id,send_email):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def remove_user(module,base_url,client,user_id,id,send_email):
 
     url = base_url+"/%s/users/%s?sendEmail=%s" % (id,user_id,send_email)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='DELETE')
+    response, info = client.fetch(url, method='DELETE')
 
     if info['status'] != 204:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -246,13 +534,11 @@ def remove_user(module,base_url,api_key,user_id,id,send_email):
 
     return info['status'], info['msg'], content, url
 
-def activate(module,base_url,api_key,id):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def activate(module,base_url,client,id):
 
     url = base_url+"/%s/lifecycle/activate" % (id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST')
+    response, info = client.fetch(url, method='POST')
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -264,13 +550,11 @@ def activate(module,base_url,api_key,id):
 
     return info['status'], info['msg'], content, url
 
-def deactivate(module,base_url,api_key,id):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def deactivate(module,base_url,client,id):
 
     url = base_url+"/%s/lifecycle/deactivate" % (id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST')
+    response, info = client.fetch(url, method='POST')
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -282,68 +566,277 @@ def deactivate(module,base_url,api_key,id):
 
     return info['status'], info['msg'], content, url
 
+def bulk(module,base_url,client,action,id,targets,send_email,concurrency):
+
+    def run(item_module, target):
+
+        if action == "assign_groups":
+            status, message, content, url = assign_group(item_module,base_url,client,target,id)
+        elif action == "remove_groups":
+            status, message, content, url = remove_group(item_module,base_url,client,target,id)
+        elif action == "assign_users":
+            status, message, content, url = assign_user(item_module,base_url,client,target,id,send_email)
+        elif action == "remove_users":
+            status, message, content, url = remove_user(item_module,base_url,client,target,id,send_email)
+
+        try:
+            js = json.loads(to_text(content, encoding='UTF-8'))
+        except ValueError:
+            js = ""
+
+        # Every entry that did not fail wrote its assignment
+        return dict(id=target, json=js, status=status, msg=message, url=url, changed=True)
+
+    results = run_batch(module, run, targets, concurrency)
+
+    for target, result in zip(targets, results):
+        result.setdefault('id', target)
+
+    return results
+
+def desired_groups(module,client,groups):
+
+    wanted = {}
+
+    for group in groups:
+        if not isinstance(group, dict):
+            group = dict(id=group)
+        unknown = [key for key in group if key not in ('id', 'priority')]
+        if unknown:
+            module.fail_json(msg="Unsupported keys in groups entry: %s" % (", ".join(unknown)))
+        if not group.get('id'):
+            module.fail_json(msg="Each entry in groups needs an id")
+        priority = group.get('priority')
+        if priority is not None:
+            try:
+                priority = int(priority)
+            except (TypeError, ValueError):
+                module.fail_json(msg="Priority of group %s must be an integer" % (group['id']))
+        wanted[resolve_id(module,client,"groups",group['id'])] = priority
+
+    return wanted
+
+def sync_assignments(module,base_url,client,id,groups,user_ids,send_email,concurrency):
+
+    operations = []
+
+    if groups is not None:
+        wanted = desired_groups(module,client,groups)
+
+        current = {}
+        for info, items in client.pages(base_url+"/%s/groups?limit=200" % (id), module):
+            for group in items:
+                current[group['id']] = group.get('priority')
+
+        for group_id in sorted(wanted):
+            if group_id not in current:
+                operations.append(("assign_group", group_id, wanted[group_id]))
+            elif wanted[group_id] is not None and wanted[group_id] != current[group_id]:
+                operations.append(("update_group", group_id, wanted[group_id]))
+        operations += [("remove_group", group_id, None) for group_id in sorted(set(current) - set(wanted))]
+
+    if user_ids is not None:
+        wanted = set(user_ids)
+
+        # Users who only get the app through a group have scope GROUP, they are
+        # managed by the group assignments and never removed here
+        current = set()
+        for info, items in client.pages(base_url+"/%s/users?limit=500" % (id), module):
+            current.update(user['id'] for user in items if user.get('scope') == "USER")
+
+        operations += [("assign_user", user_id, None) for user_id in sorted(wanted - current)]
+        operations += [("remove_user", user_id, None) for user_id in sorted(current - wanted)]
+
+    def run(item_module, operation):
+
+        op, target, priority = operation
+
+        if op in ("assign_group", "update_group"):
+            status, message, content, url = assign_group(item_module,base_url,client,target,id,priority)
+        elif op == "remove_group":
+            status, message, content, url = remove_group(item_module,base_url,client,target,id)
+        elif op == "assign_user":
+            status, message, content, url = assign_user(item_module,base_url,client,target,id,send_email)
+        else:
+            status, message, content, url = remove_user(item_module,base_url,client,target,id,send_email)
+
+        return dict(action=op, id=target, status=status, msg=message, url=url)
+
+    results = run_batch(module, run, operations, concurrency)
+
+    for operation, result in zip(operations, results):
+        result.setdefault('action', operation[0])
+        result.setdefault('id', operation[1])
+
+    return results
+
 def main():
+    argument_spec = okta_argument_spec()
+    argument_spec.update(
+        action         = dict(type='str', default='list', choices=['delete', 'list', 'assign_group', 'remove_group', 'assign_user', 'remove_user', 'assign_groups', 'remove_groups', 'assign_users', 'remove_users', 'sync_assignments', 'activate', 'deactivate']),
+        id     = dict(type='str', default=None),
+        group_id     = dict(type='str', default=None),
+        user_id     = dict(type='str', default=None),
+        group_ids     = dict(type='list', default=None),
+        user_ids     = dict(type='list', default=None),
+        groups     = dict(type='list', default=None),
+        limit     = dict(type='int', default=20),
+        paginate     = dict(type='str', default='page', choices=['page', 'all']),
+        dest         = dict(type='path', default=None),
+        q     = dict(type='str', default=None),
+        filter     = dict(type='str', default=None),
+        expand     = dict(type='str', default=None),
+        fields     = dict(type='list', default=None),
+        send_email     = dict(type='str', default='false')
+    )
+
     module = AnsibleModule(
-        argument_spec = dict(
-            organization      = dict(type='str', default=None),
-            api_key       = dict(type='str', no_log=True),
-            action         = dict(type='str', default='list', choices=['delete', 'list', 'assign_group', 'remove_group', 'assign_user', 'remove_user', 'activate', 'deactivate']),
-            id     = dict(type='str', default=None),
-            group_id     = dict(type='str', default=None),
-            user_id     = dict(type='str', default=None),
-            limit     = dict(type='int', default=20),
-            send_email     = dict(type='str', default='false')
-        )
+        argument_spec = argument_spec,
+        required_if = [
+            ['action', 'assign_groups', ['id', 'group_ids']],
+            ['action', 'remove_groups', ['id', 'group_ids']],
+            ['action', 'assign_users', ['id', 'user_ids']],
+            ['action', 'remove_users', ['id', 'user_ids']],
+            ['action', 'sync_assignments', ['id']],
+        ]
     )
 
-    organization = module.params['organization']
-    api_key = module.params['api_key']
     action = module.params['action']
     id = module.params['id']
     group_id = module.params['group_id']
     user_id = module.params['user_id']
+    group_ids = module.params['group_ids']
+    user_ids = module.params['user_ids']
+    groups = module.params['groups']
     limit = module.params['limit']
+    paginate = module.params['paginate']
+    dest = module.params['dest']
+    q = module.params['q']
+    filter = module.params['filter']
+    expand = module.params['expand']
+    fields = module.params['fields']
     send_email = module.params['send_email']
+    concurrency = module.params['concurrency']
+    return_mode = module.params['return_mode']
+
+    if expand is not None and not expand.startswith("user/"):
+        module.fail_json(msg="expand must be user/ followed by a user ID")
+
+    query = dict(q=q, filter=filter, expand=expand)
+
+    base_url = okta_base_url(module, "apps")
+    client = okta_client(module)
+
+    id = resolve_id(module,client,"apps",id)
+    group_id = resolve_id(module,client,"groups",group_id)
+    user_id = resolve_id(module,client,"users",user_id)
+    group_ids = resolve_ids(module,client,"groups",group_ids)
+    user_ids = resolve_ids(module,client,"users",user_ids)
 
-    base_url = "https://%s-admin.okta.com/api/v1/apps" % (organization)
+    if action == "list" and dest is not None:
+        url, count, pages = export(module,base_url,client,limit,query,fields,paginate,dest)
 
-    if action == "delete":
-        status, message, content, url = deactivate(module,base_url,api_key,id)
-        status, message, content, url = delete(module,base_url,api_key,id)
+        uresp = {}
+        uresp['changed'] = True
+        uresp['dest'] = dest
+        uresp['count'] = count
+        uresp['pages'] = pages
+        uresp['url'] = url
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
+
+        module.exit_json(**uresp)
+
+    if action in ("assign_groups", "remove_groups", "assign_users", "remove_users"):
+        if action.endswith("_groups"):
+            targets = group_ids
+        else:
+            targets = user_ids
+
+        results = bulk(module,base_url,client,action,id,targets,send_email,concurrency)
+        failed = len([result for result in results if result['failed']])
+
+        uresp = {}
+        uresp['changed'] = len([result for result in results if result.get('changed')]) > 0
+        uresp['results'] = results
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
+
+        if failed:
+            module.fail_json(msg="%s of %s assignments failed" % (failed, len(results)), **uresp)
+
+        module.exit_json(**uresp)
+
+    if action == "sync_assignments":
+        if groups is None and user_ids is None:
+            module.fail_json(msg="sync_assignments needs groups, user_ids or both")
+
+        results = sync_assignments(module,base_url,client,id,groups,user_ids,send_email,concurrency)
+        failed = len([result for result in results if result['failed']])
+
+        uresp = {}
+        uresp['changed'] = len(results) > 0
+        for op, key in (("assign_group", "added_groups"), ("update_group", "updated_groups"), ("remove_group", "removed_groups"), ("assign_user", "added_users"), ("remove_user", "removed_users")):
+            uresp[key] = [result['id'] for result in results if result['action'] == op and not result['failed']]
+        uresp['results'] = results
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
+
+        if failed:
+            module.fail_json(msg="%s of %s assignment changes failed" % (failed, len(results)), **uresp)
+
+        module.exit_json(**uresp)
+
+    changed = None
+
+    if action in ("delete", "activate", "deactivate"):
+        changed, status, message, content, url = lifecycle(module,base_url,client,action,id)
     elif action == "list":
-        status, message, content, url = list(module,base_url,api_key,limit)
+        if paginate == "all":
+            status, message, content, url, pages = list_all(module,base_url,client,limit,query)
+        else:
+            status, message, content, url = list(module,base_url,client,limit,query)
     elif action == "assign_group":
-        status, message, content, url = assign_group(module,base_url,api_key,group_id,id)
+        status, message, content, url = assign_group(module,base_url,client,group_id,id)
     elif action == "remove_group":
-        status, message, content, url = remove_group(module,base_url,api_key,group_id,id)
+        status, message, content, url = remove_group(module,base_url,client,group_id,id)
     elif action == "assign_user":
-        status, message, content, url = assign_user(module,base_url,api_key,user_id,id,send_email)
+        status, message, content, url = assign_user(module,base_url,client,user_id,id,send_email)
     elif action == "remove_user":
-        status, message, content, url = remove_user(module,base_url,api_key,user_id,id,send_email)
-    elif action == "activate":
-        status, message, content, url = activate(module,base_url,api_key,id)
-    elif action == "deactivate":
-        status, message, content, url = deactivate(module,base_url,api_key,id)
+        status, message, content, url = remove_user(module,base_url,client,user_id,id,send_email)
 
     uresp = {}
-    content = to_text(content, encoding='UTF-8')
 
-    try:
-        js = json.loads(content)
-    except ValueError, e:
-        js = ""
+    if changed is not None:
+        uresp['changed'] = changed
+
+    if action == "list" and paginate == "all":
+        js = content
+        uresp['pages'] = pages
+    else:
+        content = to_text(content, encoding='UTF-8')
+
+        try:
+            js = json.loads(content)
+        except ValueError, e:
+            js = ""
+
+    if action == "list" and js:
+        js = project(js, fields)
 
     uresp['json'] = js
     uresp['status'] = status
     uresp['msg'] = message
     uresp['url'] = url
+    shape_result(uresp, return_mode)
+    uresp.update(client.stats())
 
     module.exit_json(**uresp)
 
 # import module snippets
 import json
 from ansible.module_utils.basic import *
-from ansible.module_utils.urls import *
+from ansible.module_utils.okta_client import export, list_all, list_url, okta_argument_spec, okta_base_url, okta_client, project, resolve_id, resolve_ids, run_batch, shape_result
 
 if __name__ == '__main__':
     main()
@@ -11,6 +11,8 @@ module: okta_apps_saml
 short_description: Communicate with the Okta API to manage SAML applications
 description:
     - The Okta apps module manages Okta applications
+    - In check mode the app is read once and the change the action would
+      make is returned as a diff, without any writes.
 version_added: "1.0"
 author: "Whitney Champion (@shortstack)"
 options:
@@ -20,11 +22,88 @@ options:
         mycompany.okta.com).
     required: false
     default: None
+  api_url:
+    description:
+      - Base URL of the Okta org, used instead of organization for orgs
+        outside okta.com or a local test server (i.e.
+        https://mycompany.oktapreview.com).
+    required: false
+    default: None
   api_key:
     description:
       - Okta API key.
     required: false
     default: None
+  max_retries:
+    description:
+      - Number of times a request is retried after a 429 rate limit response,
+        or after a 5xx error for GET, PUT and DELETE requests. Requests are
+        also paced using the X-Rate-Limit headers returned by Okta.
+    required: false
+    default: 5
+  concurrency:
+    description:
+      - Maximum number of requests run in parallel by bulk actions.
+    required: false
+    default: 10
+  cache:
+    description:
+      - Cache GET responses on disk and reuse them across tasks. Fresh entries
+        are returned without a request, stale ones are revalidated with
+        If-None-Match when Okta returned an ETag. Any write made by the module
+        empties the cache.
+    required: false
+    default: false
+  cache_dir:
+    description:
+      - Directory holding the response cache and the ID index.
+    required: false
+    default: ~/.ansible/okta_cache
+  cache_ttl:
+    description:
+      - Number of seconds a cached response is used without revalidation.
+    required: false
+    default: 300
+  cache_max_entries:
+    description:
+      - Maximum number of cached responses, the least recently used are
+        evicted first.
+    required: false
+    default: 1000
+  id_cache_ttl:
+    description:
+      - Number of seconds a resolved user login, group name or app label is
+        kept in the ID index in cache_dir, so options taking IDs can be given
+        names instead without a lookup on every task. 0 disables the index.
+    required: false
+    default: 86400
+  return_mode:
+    description:
+      - How much of each returned Okta object is kept. full returns the
+        objects as received, compact drops _links, _embedded and
+        credentials, ids keeps only the object IDs and none returns no
+        objects, only the status, counts and per-entry outcomes.
+    required: false
+    default: full
+    choices: [ full, compact, ids, none ]
+  metrics:
+    description:
+      - Return a metrics list with one entry per API request, retries
+        included. Each has the method, endpoint (the path with IDs replaced
+        by {id}), status, bytes received, retries, reused (whether a
+        keep-alive connection was reused), wait (seconds paced or backing
+        off for rate limits and errors), the dns, connect, tls and ttfb
+        (time to first byte) seconds of the last attempt, and total.
+        Responses served from the cache are not requests and are left out.
+    required: false
+    default: false
+  trace_file:
+    description:
+      - Append the same per-request entries to this file as JSON lines,
+        with the start time and module name added, to profile every task
+        of a playbook run.
+    required: false
+    default: None
   action:
     description:
       - Action to take against apps API.
@@ -33,7 +112,7 @@ options:
     choices: [ create, update ]
   id:
     description:
-      - ID of the app.
+      - ID of the app, or its label.
     required: false
     default: None
   label:
@@ -167,27 +246,41 @@ url:
   returned: always
   type: str
   sample: https://www.ansible.com/
+retries:
+  description: Number of requests retried after a rate limit or server error
+  returned: always
+  type: int
+  sample: 0
+changed:
+  description: Whether the action would make a change
+  returned: in check mode
+  type: bool
+diff:
+  description: The app before and after the action, computed from a single read
+  returned: in check mode
+  type: dict
+rate_limit_wait:
+  description: Seconds spent waiting on rate limits and retry backoff
+  returned: always
+  type: float
+  sample: 1.5
+cache:
+  description: Response cache hits and misses
+  returned: when cache is enabled
+  type: dict
+  sample: {"hits": 3, "misses": 1}
+metrics:
+  description: One entry per API request with its method, endpoint, status, bytes,
+    retries, reused, wait and the dns, connect, tls, ttfb and total seconds
+  returned: when metrics is enabled
+  type: list
+  sample: [{"method": "GET", "endpoint": "/api/v1/users/{id}", "status": 200, "bytes": 1043, "retries": 0, "reused": false, "wait": 0.0, "dns": 0.0012, "connect": 0.0214, "tls": 0.0437, "ttfb": 0.0921, "total": 0.1593}]
 '''
 
-def create(module,base_url,api_key,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def sign_on(defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements):
 
-    payload = {}
-    settings = {}
     signOn = {}
-    features = []
-    hide = {}
 
-    hide['iOS'] = "false"
-    hide['web'] = "false"
-
-    visibility = {}
-    visibility['autoSubmitToolbar'] = "false"
-    visibility['hide'] = hide
-
-    if label is not None:
-        payload['label'] = label
     if defaultRelayState is not None:
         signOn['defaultRelayState'] = defaultRelayState
     if ssoAcsUrl is not None:
@@ -223,15 +316,50 @@ def create(module,base_url,api_key,label,defaultRelayState,ssoAcsUrl,idpIssuer,a
     if attributeStatements is not None:
         signOn['attributeStatements'] = attributeStatements
 
-    settings['signOn'] = signOn
+    return signOn
+
+def create_payload(label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements):
+
+    payload = {}
+    settings = {}
+    features = []
+    hide = {}
+
+    hide['iOS'] = "false"
+    hide['web'] = "false"
+
+    visibility = {}
+    visibility['autoSubmitToolbar'] = "false"
+    visibility['hide'] = hide
+
+    if label is not None:
+        payload['label'] = label
+
+    settings['signOn'] = sign_on(defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements)
     payload['signOnMode'] = "SAML_2_0"
     payload['features'] = features
     payload['visibility'] = visibility
     payload['settings'] = settings
 
+    return payload
+
+def update_payload(payload,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements):
+
+    if label is not None:
+        payload['label'] = label
+
+    settings = payload.setdefault('settings', {})
+    settings.setdefault('signOn', {}).update(sign_on(defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements))
+
+    return payload
+
+def create(module,base_url,client,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements):
+
+    payload = create_payload(label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements)
+
     url = base_url
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+    response, info = client.fetch(url, method='POST', data=module.jsonify(payload))
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -243,60 +371,18 @@ def create(module,base_url,api_key,label,defaultRelayState,ssoAcsUrl,idpIssuer,a
 
     return info['status'], info['msg'], content, url
 
-def update(module,base_url,api_key,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
-
-    payload = {}
+def update(module,base_url,client,id,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements):
 
     url = base_url+"/%s" % (id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET', data=module.jsonify(payload))
+    payload = client.get(url, module)
 
-    try:
-        content = response.read()
-        payload = json.loads(content)
-    except AttributeError:
-        content = info.pop('body', '')
+    if payload is None:
+        module.fail_json(msg="App %s does not exist" % (id))
 
-    if label is not None:
-        payload['label'] = label
-    if defaultRelayState is not None:
-        signOn['defaultRelayState'] = defaultRelayState
-    if ssoAcsUrl is not None:
-        signOn['ssoAcsUrl'] = ssoAcsUrl
-    if idpIssuer is not None:
-        signOn['idpIssuer'] = idpIssuer
-    if audience is not None:
-        signOn['audience'] = audience
-    if recipient is not None:
-        signOn['recipient'] = recipient
-    if destination is not None:
-        signOn['destination'] = destination
-    if subjectNameIdTemplate is not None:
-        signOn['subjectNameIdTemplate'] = subjectNameIdTemplate
-    if subjectNameIdFormat is not None:
-        signOn['subjectNameIdFormat'] = subjectNameIdFormat
-    if responseSigned is not None:
-        signOn['responseSigned'] = responseSigned
-    if assertionSigned is not None:
-        signOn['assertionSigned'] = assertionSigned
-    if signatureAlgorithm is not None:
-        signOn['signatureAlgorithm'] = signatureAlgorithm
-    if digestAlgorithm is not None:
-        signOn['digestAlgorithm'] = digestAlgorithm
-    if honorForceAuthn is not None:
-        signOn['honorForceAuthn'] = honorForceAuthn
-    if authnContextClassRef is not None:
-        signOn['authnContextClassRef'] = authnContextClassRef
-    if spIssuer is not None:
-        signOn['spIssuer'] = spIssuer
-    if requestCompressed is not None:
-        signOn['requestCompressed'] = requestCompressed
-    if attributeStatements is not None:
-        signOn['attributeStatements'] = attributeStatements
+    payload = update_payload(payload,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='PUT', data=module.jsonify(payload))
+    response, info = client.fetch(url, method='PUT', data=module.jsonify(payload))
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -308,38 +394,62 @@ def update(module,base_url,api_key,label,defaultRelayState,ssoAcsUrl,idpIssuer,a
 
     return info['status'], info['msg'], content, url
 
+def visible(app):
+
+    app = copy.deepcopy(app)
+
+    for key in ('_links', '_embedded', 'lastUpdated'):
+        app.pop(key, None)
+
+    return app
+
+def check(module,base_url,client,action,id,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements):
+
+    if action == "create":
+        return True, dict(before={}, after=create_payload(label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements))
+
+    current = client.get(base_url+"/%s" % (id), module)
+
+    if current is None:
+        module.fail_json(msg="App %s does not exist" % (id))
+
+    before = visible(current)
+    after = visible(update_payload(copy.deepcopy(current),label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements))
+
+    return before != after, dict(before=before, after=after)
+
 def main():
+    argument_spec = okta_argument_spec()
+    argument_spec.update(
+        action         = dict(type='str', default='list', choices=['create', 'update', 'delete', 'list', 'assign_group', 'remove_group', 'assign_user', 'remove_user', 'activate', 'deactivate']),
+        id     = dict(type='str', default=None),
+        label  = dict(type='str', default=None),
+        limit     = dict(type='int', default=20),
+        defaultRelayState     = dict(type='str', default=""),
+        ssoAcsUrl     = dict(type='str', default=None),
+        idpIssuer     = dict(type='str', default="http://www.okta.com/${org.externalKey}"),
+        audience     = dict(type='str', default=None),
+        recipient     = dict(type='str', default=None),
+        destination     = dict(type='str', default=None),
+        subjectNameIdTemplate     = dict(type='str', default="${user.userName}"),
+        subjectNameIdFormat     = dict(type='str', default="urn:oasis:names:tc:SAML:1.1:nameid-format:unspecified"),
+        responseSigned     = dict(type='bool', default=True),
+        assertionSigned     = dict(type='bool', default=True),
+        signatureAlgorithm     = dict(type='str', default="RSA_SHA256"),
+        digestAlgorithm     = dict(type='str', default="SHA256"),
+        honorForceAuthn     = dict(type='bool', default=True),
+        authnContextClassRef     = dict(type='str', default="urn:oasis:names:tc:SAML:2.0:ac:classes:PasswordProtectedTransport"),
+        spIssuer     = dict(type='str', default=None),
+        requestCompressed     = dict(type='bool', default=False),
+        attributeStatements     = dict(type='str', default=None),
+        send_email     = dict(type='str', default='false')
+    )
+
     module = AnsibleModule(
-        argument_spec = dict(
-            organization      = dict(type='str', default=None),
-            api_key       = dict(type='str', no_log=True),
-            action         = dict(type='str', default='list', choices=['create', 'update', 'delete', 'list', 'assign_group', 'remove_group', 'assign_user', 'remove_user', 'activate', 'deactivate']),
-            id     = dict(type='str', default=None),
-            label  = dict(type='str', default=None),
-            limit     = dict(type='int', default=20),
-            defaultRelayState     = dict(type='str', default=""),
-            ssoAcsUrl     = dict(type='str', default=None),
-            idpIssuer     = dict(type='str', default="http://www.okta.com/${org.externalKey}"),
-            audience     = dict(type='str', default=None),
-            recipient     = dict(type='str', default=None),
-            destination     = dict(type='str', default=None),
-            subjectNameIdTemplate     = dict(type='str', default="${user.userName}"),
-            subjectNameIdFormat     = dict(type='str', default="urn:oasis:names:tc:SAML:1.1:nameid-format:unspecified"),
-            responseSigned     = dict(type='bool', default=True),
-            assertionSigned     = dict(type='bool', default=True),
-            signatureAlgorithm     = dict(type='str', default="RSA_SHA256"),
-            digestAlgorithm     = dict(type='str', default="SHA256"),
-            honorForceAuthn     = dict(type='bool', default=True),
-            authnContextClassRef     = dict(type='str', default="urn:oasis:names:tc:SAML:2.0:ac:classes:PasswordProtectedTransport"),
-            spIssuer     = dict(type='str', default=None),
-            requestCompressed     = dict(type='bool', default=False),
-            attributeStatements     = dict(type='str', default=None),
-            send_email     = dict(type='str', default='false')
-        )
+        argument_spec = argument_spec,
+        supports_check_mode = True
     )
 
-    organization = module.params['organization']
-    api_key = module.params['api_key']
     action = module.params['action']
     id = module.params['id']
     label = module.params['label']
@@ -362,13 +472,28 @@ def main():
     requestCompressed = module.params['requestCompressed']
     attributeStatements = module.params['attributeStatements']
     send_email = module.params['send_email']
+    return_mode = module.params['return_mode']
+
+    base_url = okta_base_url(module, "apps")
+    client = okta_client(module)
+
+    id = resolve_id(module,client,"apps",id)
+
+    if module.check_mode:
+        changed, diff = check(module,base_url,client,action,id,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements)
+
+        uresp = {}
+        uresp['changed'] = changed
+        uresp['diff'] = diff
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
 
-    base_url = "https://%s-admin.okta.com/api/v1/apps" % (organization)
+        module.exit_json(**uresp)
 
     if action == "create":
-        status, message, content, url = create(module,base_url,api_key,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements)
+        status, message, content, url = create(module,base_url,client,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements)
     elif action == "update":
-        status, message, content, url = update(module,base_url,api_key,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements)
+        status, message, content, url = update(module,base_url,client,id,label,defaultRelayState,ssoAcsUrl,idpIssuer,audience,recipient,destination,subjectNameIdTemplate,subjectNameIdFormat,responseSigned,assertionSigned,signatureAlgorithm,digestAlgorithm,honorForceAuthn,authnContextClassRef,spIssuer,requestCompressed,attributeStatements)
 
     uresp = {}
     content = to_text(content, encoding='UTF-8')
@@ -382,13 +507,16 @@ def main():
     uresp['status'] = status
     uresp['msg'] = message
     uresp['url'] = url
+    shape_result(uresp, return_mode)
+    uresp.update(client.stats())
 
     module.exit_json(**uresp)
 
 # import module snippets
+import copy
 import json
 from ansible.module_utils.basic import *
-from ansible.module_utils.urls import *
+from ansible.module_utils.okta_client import okta_argument_spec, okta_base_url, okta_client, resolve_id, shape_result
 
 if __name__ == '__main__':
     main()
@@ -11,6 +11,8 @@ module: okta_apps_swa
 short_description: Communicate with the Okta API to manage SWA applications
 description:
     - The Okta apps module manages Okta applications
+    - In check mode the app is read once and the change the action would
+      make is returned as a diff, without any writes.
 version_added: "1.0"
 author: "Whitney Champion (@shortstack)"
 options:
@@ -20,11 +22,88 @@ options:
         mycompany.okta.com).
     required: false
     default: None
+  api_url:
+    description:
+      - Base URL of the Okta org, used instead of organization for orgs
+        outside okta.com or a local test server (i.e.
+        https://mycompany.oktapreview.com).
+    required: false
+    default: None
   api_key:
     description:
       - Okta API key.
     required: false
     default: None
+  max_retries:
+    description:
+      - Number of times a request is retried after a 429 rate limit response,
+        or after a 5xx error for GET, PUT and DELETE requests. Requests are
+        also paced using the X-Rate-Limit headers returned by Okta.
+    required: false
+    default: 5
+  concurrency:
+    description:
+      - Maximum number of requests run in parallel by bulk actions.
+    required: false
+    default: 10
+  cache:
+    description:
+      - Cache GET responses on disk and reuse them across tasks. Fresh entries
+        are returned without a request, stale ones are revalidated with
+        If-None-Match when Okta returned an ETag. Any write made by the module
+        empties the cache.
+    required: false
+    default: false
+  cache_dir:
+    description:
+      - Directory holding the response cache and the ID index.
+    required: false
+    default: ~/.ansible/okta_cache
+  cache_ttl:
+    description:
+      - Number of seconds a cached response is used without revalidation.
+    required: false
+    default: 300
+  cache_max_entries:
+    description:
+      - Maximum number of cached responses, the least recently used are
+        evicted first.
+    required: false
+    default: 1000
+  id_cache_ttl:
+    description:
+      - Number of seconds a resolved user login, group name or app label is
+        kept in the ID index in cache_dir, so options taking IDs can be given
+        names instead without a lookup on every task. 0 disables the index.
+    required: false
+    default: 86400
+  return_mode:
+    description:
+      - How much of each returned Okta object is kept. full returns the
+        objects as received, compact drops _links, _embedded and
+        credentials, ids keeps only the object IDs and none returns no
+        objects, only the status, counts and per-entry outcomes.
+    required: false
+    default: full
+    choices: [ full, compact, ids, none ]
+  metrics:
+    description:
+      - Return a metrics list with one entry per API request, retries
+        included. Each has the method, endpoint (the path with IDs replaced
+        by {id}), status, bytes received, retries, reused (whether a
+        keep-alive connection was reused), wait (seconds paced or backing
+        off for rate limits and errors), the dns, connect, tls and ttfb
+        (time to first byte) seconds of the last attempt, and total.
+        Responses served from the cache are not requests and are left out.
+    required: false
+    default: false
+  trace_file:
+    description:
+      - Append the same per-request entries to this file as JSON lines,
+        with the start time and module name added, to profile every task
+        of a playbook run.
+    required: false
+    default: None
   action:
     description:
       - Action to take against apps API.
@@ -33,7 +112,7 @@ options:
     choices: [ create, update ]
   id:
     description:
-      - ID of the app.
+      - ID of the app, or its label.
     required: false
     default: None
   label:
@@ -136,11 +215,38 @@ url:
   returned: always
   type: str
   sample: https://www.ansible.com/
+retries:
+  description: Number of requests retried after a rate limit or server error
+  returned: always
+  type: int
+  sample: 0
+changed:
+  description: Whether the action would make a change
+  returned: in check mode
+  type: bool
+diff:
+  description: The app before and after the action, computed from a single read
+  returned: in check mode
+  type: dict
+rate_limit_wait:
+  description: Seconds spent waiting on rate limits and retry backoff
+  returned: always
+  type: float
+  sample: 1.5
+cache:
+  description: Response cache hits and misses
+  returned: when cache is enabled
+  type: dict
+  sample: {"hits": 3, "misses": 1}
+metrics:
+  description: One entry per API request with its method, endpoint, status, bytes,
+    retries, reused, wait and the dns, connect, tls, ttfb and total seconds
+  returned: when metrics is enabled
+  type: list
+  sample: [{"method": "GET", "endpoint": "/api/v1/users/{id}", "status": 200, "bytes": 1043, "retries": 0, "reused": false, "wait": 0.0, "dns": 0.0012, "connect": 0.0214, "tls": 0.0437, "ttfb": 0.0921, "total": 0.1593}]
 '''
 
-def create(module,base_url,api_key,label,login_url,redirect_url):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def create_payload(label,login_url,redirect_url):
 
     payload = {}
     settings = {}
@@ -168,43 +274,18 @@ def create(module,base_url,api_key,label,login_url,redirect_url):
     payload['visibility'] = visibility
     payload['settings'] = settings
 
-    url = base_url
-
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
-
-    if info['status'] != 200:
-        module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
-
-    try:
-        content = response.read()
-    except AttributeError:
-        content = info.pop('body', '')
-
-    return info['status'], info['msg'], content, url
+    return payload
 
-def update(module,base_url,api_key,label,login_url,redirect_url,id,scheme,username,password_input):
+def update_payload(payload,label,login_url,redirect_url,scheme,username,password_input):
 
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
-
-    payload = {}
     password = {}
 
-    url = base_url+"/%s" % (id)
-
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET', data=module.jsonify(payload))
-
-    try:
-        content = response.read()
-        payload = json.loads(content)
-    except AttributeError:
-        content = info.pop('body', '')
-
     if label is not None:
         payload['label'] = label
     if login_url is not None:
         payload['settings']['signOn']['loginUrl'] = login_url
     if redirect_url is not None:
-        payload['settings']['signOn']['redirect_url'] = redirect_url
+        payload['settings']['signOn']['redirectUrl'] = redirect_url
 
     if (scheme is not None) and (username is not None) and (password_input is not None):
         payload['credentials']['scheme'] = scheme
@@ -220,7 +301,15 @@ def update(module,base_url,api_key,label,login_url,redirect_url,id,scheme,userna
         credentials['userNameTemplate'] = userNameTemplate
         payload['credentials'] = credentials
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='PUT', data=module.jsonify(payload))
+    return payload
+
+def create(module,base_url,client,label,login_url,redirect_url):
+
+    payload = create_payload(label,login_url,redirect_url)
+
+    url = base_url
+
+    response, info = client.fetch(url, method='POST', data=module.jsonify(payload))
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -232,26 +321,76 @@ def update(module,base_url,api_key,label,login_url,redirect_url,id,scheme,userna
 
     return info['status'], info['msg'], content, url
 
+def update(module,base_url,client,label,login_url,redirect_url,id,scheme,username,password_input):
+
+    url = base_url+"/%s" % (id)
+
+    payload = client.get(url, module)
+
+    if payload is None:
+        module.fail_json(msg="App %s does not exist" % (id))
+
+    payload = update_payload(payload,label,login_url,redirect_url,scheme,username,password_input)
+
+    response, info = client.fetch(url, method='PUT', data=module.jsonify(payload))
+
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
+
+    try:
+        content = response.read()
+    except AttributeError:
+        content = info.pop('body', '')
+
+    return info['status'], info['msg'], content, url
+
+def visible(app):
+
+    app = copy.deepcopy(app)
+
+    for key in ('_links', '_embedded', 'lastUpdated'):
+        app.pop(key, None)
+
+    if 'password' in app.get('credentials', {}):
+        app['credentials']['password'] = {'value': "********"}
+
+    return app
+
+def check(module,base_url,client,action,label,login_url,redirect_url,id,scheme,username,password_input):
+
+    if action == "create":
+        return True, dict(before={}, after=visible(create_payload(label,login_url,redirect_url)))
+
+    current = client.get(base_url+"/%s" % (id), module)
+
+    if current is None:
+        module.fail_json(msg="App %s does not exist" % (id))
+
+    before = visible(current)
+    after = visible(update_payload(copy.deepcopy(current),label,login_url,redirect_url,scheme,username,password_input))
+
+    return before != after, dict(before=before, after=after)
+
 def main():
+    argument_spec = okta_argument_spec()
+    argument_spec.update(
+        action         = dict(type='str', default='list', choices=['create', 'update']),
+        id     = dict(type='str', default=None),
+        login_url  = dict(type='str', default=None),
+        redirect_url  = dict(type='str', default=None),
+        label  = dict(type='str', default=None),
+        limit     = dict(type='int', default=20),
+        scheme  = dict(type='str', default=None, choices=['ADMIN_SETS_CREDENTIALS', 'EDIT_PASSWORD_ONLY', 'EDIT_USERNAME_AND_PASSWORD', 'EXTERNAL_PASSWORD_SYNC	', 'SHARED_USERNAME_AND_PASSWORD']),
+        username  = dict(type='str', default=None),
+        password  = dict(type='str', default=None, no_log=True),
+        send_email     = dict(type='str', default='false')
+    )
+
     module = AnsibleModule(
-        argument_spec = dict(
-            organization      = dict(type='str', default=None),
-            api_key       = dict(type='str', no_log=True),
-            action         = dict(type='str', default='list', choices=['create', 'update']),
-            id     = dict(type='str', default=None),
-            login_url  = dict(type='str', default=None),
-            redirect_url  = dict(type='str', default=None),
-            label  = dict(type='str', default=None),
-            limit     = dict(type='int', default=20),
-            scheme  = dict(type='str', default=None, choices=['ADMIN_SETS_CREDENTIALS', 'EDIT_PASSWORD_ONLY', 'EDIT_USERNAME_AND_PASSWORD', 'EXTERNAL_PASSWORD_SYNC	', 'SHARED_USERNAME_AND_PASSWORD']),
-            username  = dict(type='str', default=None),
-            password  = dict(type='str', default=None, no_log=True),
-            send_email     = dict(type='str', default='false')
-        )
+        argument_spec = argument_spec,
+        supports_check_mode = True
     )
 
-    organization = module.params['organization']
-    api_key = module.params['api_key']
     action = module.params['action']
     id = module.params['id']
     login_url = module.params['login_url']
@@ -262,13 +401,28 @@ def main():
     username = module.params['username']
     password = module.params['password']
     send_email = module.params['send_email']
+    return_mode = module.params['return_mode']
+
+    base_url = okta_base_url(module, "apps")
+    client = okta_client(module)
+
+    id = resolve_id(module,client,"apps",id)
+
+    if module.check_mode:
+        changed, diff = check(module,base_url,client,action,label,login_url,redirect_url,id,scheme,username,password)
+
+        uresp = {}
+        uresp['changed'] = changed
+        uresp['diff'] = diff
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
 
-    base_url = "https://%s-admin.okta.com/api/v1/apps" % (organization)
+        module.exit_json(**uresp)
 
     if action == "create":
-        status, message, content, url = create(module,base_url,api_key,label,login_url,redirect_url)
+        status, message, content, url = create(module,base_url,client,label,login_url,redirect_url)
     elif action == "update":
-        status, message, content, url = update(module,base_url,api_key,label,login_url,redirect_url,id,scheme,username,password)
+        status, message, content, url = update(module,base_url,client,label,login_url,redirect_url,id,scheme,username,password)
 
     uresp = {}
     content = to_text(content, encoding='UTF-8')
@@ -282,13 +436,16 @@ def main():
     uresp['status'] = status
     uresp['msg'] = message
     uresp['url'] = url
+    shape_result(uresp, return_mode)
+    uresp.update(client.stats())
 
     module.exit_json(**uresp)
 
 # import module snippets
+import copy
 import json
 from ansible.module_utils.basic import *
-from ansible.module_utils.urls import *
+from ansible.module_utils.okta_client import okta_argument_spec, okta_base_url, okta_client, resolve_id, shape_result
 
 if __name__ == '__main__':
     main()
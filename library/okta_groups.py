@@ -11,6 +11,9 @@ module: okta_groups
 short_description: Communicate with the Okta API to manage groups
 description:
     - The Okta groups module manages Okta groups
+    - In check mode the group is read once and the change the action would
+      make is returned as a diff, without any writes. sync_members reports
+      the users it would add and remove.
 version_added: "1.0"
 author: "Whitney Champion (@shortstack)"
 options:
@@ -20,20 +23,97 @@ options:
         mycompany.okta.com).
     required: false
     default: None
+  api_url:
+    description:
+      - Base URL of the Okta org, used instead of organization for orgs
+        outside okta.com or a local test server (i.e.
+        https://mycompany.oktapreview.com).
+    required: false
+    default: None
   api_key:
     description:
       - Okta API key.
     required: false
     default: None
+  max_retries:
+    description:
+      - Number of times a request is retried after a 429 rate limit response,
+        or after a 5xx error for GET, PUT and DELETE requests. Requests are
+        also paced using the X-Rate-Limit headers returned by Okta.
+    required: false
+    default: 5
+  concurrency:
+    description:
+      - Maximum number of requests run in parallel by bulk actions.
+    required: false
+    default: 10
+  cache:
+    description:
+      - Cache GET responses on disk and reuse them across tasks. Fresh entries
+        are returned without a request, stale ones are revalidated with
+        If-None-Match when Okta returned an ETag. Any write made by the module
+        empties the cache.
+    required: false
+    default: false
+  cache_dir:
+    description:
+      - Directory holding the response cache and the ID index.
+    required: false
+    default: ~/.ansible/okta_cache
+  cache_ttl:
+    description:
+      - Number of seconds a cached response is used without revalidation.
+    required: false
+    default: 300
+  cache_max_entries:
+    description:
+      - Maximum number of cached responses, the least recently used are
+        evicted first.
+    required: false
+    default: 1000
+  id_cache_ttl:
+    description:
+      - Number of seconds a resolved user login, group name or app label is
+        kept in the ID index in cache_dir, so options taking IDs can be given
+        names instead without a lookup on every task. 0 disables the index.
+    required: false
+    default: 86400
+  return_mode:
+    description:
+      - How much of each returned Okta object is kept. full returns the
+        objects as received, compact drops _links, _embedded and
+        credentials, ids keeps only the object IDs and none returns no
+        objects, only the status, counts and per-entry outcomes.
+    required: false
+    default: full
+    choices: [ full, compact, ids, none ]
+  metrics:
+    description:
+      - Return a metrics list with one entry per API request, retries
+        included. Each has the method, endpoint (the path with IDs replaced
+        by {id}), status, bytes received, retries, reused (whether a
+        keep-alive connection was reused), wait (seconds paced or backing
+        off for rate limits and errors), the dns, connect, tls and ttfb
+        (time to first byte) seconds of the last attempt, and total.
+        Responses served from the cache are not requests and are left out.
+    required: false
+    default: false
+  trace_file:
+    description:
+      - Append the same per-request entries to this file as JSON lines,
+        with the start time and module name added, to profile every task
+        of a playbook run.
+    required: false
+    default: None
   action:
     description:
       - Action to take against groups API.
     required: false
     default: list
-    choices: [ create, update, delete, list, add_user, remove_user ]
+    choices: [ create, update, delete, list, add_user, remove_user, sync_members ]
   id:
     description:
-      - ID of the group.
+      - ID of the group, or its name.
     required: false
     default: None
   name:
@@ -46,14 +126,79 @@ options:
       - Group description.
     required: false
     default: yes
+  state:
+    description:
+      - Declarative mode, used instead of action. With present the group is
+        looked up by id, or by exact name through the q search, then created
+        if missing or updated only when name or description differ. With
+        absent the group is deleted if it exists.
+    required: false
+    default: None
+    choices: [ present, absent ]
   limit:
     description:
       - List limit.
     required: false
     default: 200
+  paginate:
+    description:
+      - Whether the list action returns a single page of results or follows
+        the Link header cursor to return the full collection.
+    required: false
+    default: page
+    choices: [ page, all ]
+  dest:
+    description:
+      - With the list action, stream each page to this file as JSON lines
+        (one object per line) as it arrives, instead of returning the
+        objects. The file is gzip compressed when the path ends in .gz.
+        Only counts are returned, so memory stays flat for large orgs.
+    required: false
+    default: None
+  q:
+    description:
+      - With the list action, only return groups whose name starts with this
+        value. Cannot be combined with filter or search.
+    required: false
+    default: None
+  filter:
+    description:
+      - With the list action, Okta filter expression applied server side
+        (i.e. type eq "OKTA_GROUP").
+    required: false
+    default: None
+  search:
+    description:
+      - With the list action, Okta search expression applied server side,
+        which supports more properties and operators than filter (i.e.
+        profile.name sw "Eng").
+    required: false
+    default: None
+  expand:
+    description:
+      - With the list action, embed group statistics or the apps assigned to
+        each group in the result.
+    required: false
+    default: None
+    choices: [ stats, app ]
+  fields:
+    description:
+      - With the list action, only keep these fields of each object in the
+        result or dest file. Nested fields are given with dots (i.e.
+        profile.login).
+    required: false
+    default: None
   user_id:
     description:
-      - ID of user to add to group.
+      - ID or login of user to add to group.
+    required: false
+    default: None
+  user_ids:
+    description:
+      - Complete list of user IDs or logins that should be members of the group, used
+        by the sync_members action. Current members are read once, then only
+        the missing users are added and the extra users removed, concurrently
+        (see concurrency).
     required: false
     default: None
 """
@@ -65,6 +210,28 @@ EXAMPLES = '''
     api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
     limit: 200
 
+# List all groups, following pagination
+- okta_groups:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    limit: 200
+    paginate: all
+
+# List the IDs and names of groups starting with Eng
+- okta_groups:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    q: "Eng"
+    fields: [ id, profile.name ]
+
+# Export all groups to a compressed JSON lines file
+- okta_groups:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    limit: 200
+    paginate: all
+    dest: "/var/lib/okta/groups.jsonl.gz"
+
 # Create group
 - okta_groups:
     action: create
@@ -73,6 +240,21 @@ EXAMPLES = '''
     name: "Imaginary Creatures"
     description: "They are so majestic"
 
+# Ensure group exists with the given description
+- okta_groups:
+    state: present
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    name: "Imaginary Creatures"
+    description: "They are so majestic"
+
+# Ensure group is removed
+- okta_groups:
+    state: absent
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    name: "Imaginary Creatures"
+
 # Update group
 - okta_groups:
     action: update
@@ -90,6 +272,16 @@ EXAMPLES = '''
     id: "01c5pEucucMPWXjFM457"
     user_id: "01c5pEucucMPWXjFM456"
 
+# Make the group membership exactly this list of users
+- okta_groups:
+    action: sync_members
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    id: "01c5pEucucMPWXjFM457"
+    user_ids:
+      - "01c5pEucucMPWXjFM456"
+      - "01c5pEucucMPWXjFM458"
+
 # Remove user from group
 - okta_groups:
     action: remove_user
@@ -126,11 +318,63 @@ url:
   returned: always
   type: str
   sample: https://www.ansible.com/
+retries:
+  description: Number of requests retried after a rate limit or server error
+  returned: always
+  type: int
+  sample: 0
+changed:
+  description: Whether a write was made
+  returned: when state is given, action is sync_members, or in check mode
+  type: bool
+added:
+  description: User IDs added to the group
+  returned: when action is sync_members
+  type: list
+removed:
+  description: User IDs removed from the group
+  returned: when action is sync_members
+  type: list
+results:
+  description: Per-user action, user_id, status, msg, url and failed flag
+  returned: when action is sync_members
+  type: list
+count:
+  description: Number of objects written to dest
+  returned: when action is list and dest is set
+  type: int
+dest:
+  description: Path the list was written to
+  returned: when action is list and dest is set
+  type: str
+diff:
+  description: Profile of the group before and after the action, computed from a single read
+  returned: in check mode, except for sync_members
+  type: dict
+rate_limit_wait:
+  description: Seconds spent waiting on rate limits and retry backoff
+  returned: always
+  type: float
+  sample: 1.5
+cache:
+  description: Response cache hits and misses
+  returned: when cache is enabled
+  type: dict
+  sample: {"hits": 3, "misses": 1}
+metrics:
+  description: One entry per API request with its method, endpoint, status, bytes,
+    retries, reused, wait and the dns, connect, tls, ttfb and total seconds
+  returned: when metrics is enabled
+  type: list
+  sample: [{"method": "GET", "endpoint": "/api/v1/users/{id}", "status": 200, "bytes": 1043, "retries": 0, "reused": false, "wait": 0.0, "dns": 0.0012, "connect": 0.0214, "tls": 0.0437, "ttfb": 0.0921, "total": 0.1593}]
+pages:
+  description: Number of pages (and API requests) fetched when paginate is all
+  returned: when action is list and paginate is all, or dest is set
+  type: int
+  sample: 4
 '''
 
-def create(module,base_url,api_key,name,description):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def payload(name,description):
 
     payload = {}
     profile = {}
@@ -142,9 +386,15 @@ def create(module,base_url,api_key,name,description):
 
     payload['profile'] = profile
 
+    return payload
+
+def create(module,base_url,client,name,description):
+
+    data = payload(name,description)
+
     url = base_url
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+    response, info = client.fetch(url, method='POST', data=module.jsonify(data))
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -156,23 +406,13 @@ def create(module,base_url,api_key,name,description):
 
     return info['status'], info['msg'], content, url
 
-def update(module,base_url,api_key,id,name,description):
+def update(module,base_url,client,id,name,description):
 
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
-
-    payload = {}
-    profile = {}
-
-    if name is not None:
-        profile['name'] = name
-    if description is not None:
-        profile['description'] = description
-
-    payload['profile'] = profile
+    data = payload(name,description)
 
     url = base_url+"/%s" % (id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='PUT', data=module.jsonify(payload))
+    response, info = client.fetch(url, method='PUT', data=module.jsonify(data))
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -184,13 +424,11 @@ def update(module,base_url,api_key,id,name,description):
 
     return info['status'], info['msg'], content, url
 
-def delete(module,base_url,api_key,id):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def delete(module,base_url,client,id):
 
     url = base_url+"/%s" % (id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='DELETE') # delete
+    response, info = client.fetch(url, method='DELETE') # delete
 
     if info['status'] != 204:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -202,13 +440,11 @@ def delete(module,base_url,api_key,id):
 
     return info['status'], info['msg'], content, url
 
-def list(module,base_url,api_key,limit):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def list(module,base_url,client,limit,query):
 
-    url = base_url+"/?limit=%s" % (limit)
+    url = list_url(module,base_url,limit,query)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+    response, info = client.fetch(url, method='GET')
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -220,13 +456,11 @@ def list(module,base_url,api_key,limit):
 
     return info['status'], info['msg'], content, url
 
-def add_user(module,base_url,api_key,id,user_id):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def add_user(module,base_url,client,id,user_id):
 
     url = base_url+"/%s/users/%s" % (id,user_id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='PUT')
+    response, info = client.fetch(url, method='PUT')
 
     if info['status'] != 204:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -238,13 +472,11 @@ def add_user(module,base_url,api_key,id,user_id):
 
     return info['status'], info['msg'], content, url
 
-def remove_user(module,base_url,api_key,id,user_id):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def remove_user(module,base_url,client,id,user_id):
 
     url = base_url+"/%s/users/%s" % (id,user_id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='DELETE')
+    response, info = client.fetch(url, method='DELETE')
 
     if info['status'] != 204:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -255,63 +487,304 @@ def remove_user(module,base_url,api_key,id,user_id):
 
     return info['status'], info['msg'], content, url
 
+def find(module,base_url,client,id,name):
+
+    if id is not None:
+        url = base_url+"/%s" % (id)
+
+        response, info = client.fetch(url, method='GET')
+
+        if info['status'] == 404:
+            return None, info, url
+        if info['status'] != 200:
+            module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
+
+        return json.loads(to_text(response.read(), encoding='UTF-8')), info, url
+
+    url = base_url+"?q=%s&limit=200" % (quote(name))
+
+    # q is a prefix match on the name, so keep paging until an exact match turns up.
+    for info, items in client.pages(url, module):
+        for group in items:
+            if group['profile'].get('name') == name:
+                return group, info, url
+
+    return None, info, url
+
+def present(module,base_url,client,id,name,description):
+
+    group, info, url = find(module,base_url,client,id,name)
+
+    if group is None:
+        if id is not None:
+            module.fail_json(msg="Group %s does not exist" % (id))
+        status, message, content, url = create(module,base_url,client,name,description)
+        return True, status, message, content, url
+
+    profile = group['profile']
+    wanted_name = name if name is not None else profile.get('name')
+    wanted_description = description if description is not None else profile.get('description')
+
+    if profile.get('name') == wanted_name and (profile.get('description') or "") == (wanted_description or ""):
+        return False, info['status'], info['msg'], module.jsonify(group), url
+
+    status, message, content, url = update(module,base_url,client,group['id'],wanted_name,wanted_description)
+    return True, status, message, content, url
+
+def absent(module,base_url,client,id,name):
+
+    group, info, url = find(module,base_url,client,id,name)
+
+    if group is None:
+        return False, info['status'], info['msg'], "", url
+
+    status, message, content, url = delete(module,base_url,client,group['id'])
+    return True, status, message, content, url
+
+def sync_members(module,base_url,client,id,user_ids,concurrency):
+
+    url = base_url+"/%s/users?limit=1000" % (id)
+
+    current = set()
+    for info, items in client.pages(url, module):
+        current.update(user['id'] for user in items)
+
+    wanted = set(user_ids)
+
+    operations = [("add_user", user_id) for user_id in sorted(wanted - current)]
+    operations += [("remove_user", user_id) for user_id in sorted(current - wanted)]
+
+    if module.check_mode:
+        return [dict(action=op, user_id=user_id, failed=False) for op, user_id in operations], url
+
+    def run(item_module, operation):
+
+        op, user_id = operation
+
+        if op == "add_user":
+            status, message, content, url = add_user(item_module,base_url,client,id,user_id)
+        else:
+            status, message, content, url = remove_user(item_module,base_url,client,id,user_id)
+
+        return dict(action=op, user_id=user_id, status=status, msg=message, url=url)
+
+    results = run_batch(module, run, operations, concurrency)
+
+    for operation, result in zip(operations, results):
+        result.setdefault('action', operation[0])
+        result.setdefault('user_id', operation[1])
+
+    return results, url
+
+def check(module,base_url,client,state,action,id,user_id,name,description):
+
+    if state is not None:
+        group, info, url = find(module,base_url,client,id,name)
+
+        if group is None and id is not None and state == "present":
+            module.fail_json(msg="Group %s does not exist" % (id))
+
+        before = dict(profile=group['profile']) if group is not None else {}
+        after = {}
+
+        if state == "present":
+            after = copy.deepcopy(before) or dict(profile={})
+            after['profile'].update(payload(name,description)['profile'])
+
+        return before != after, dict(before=before, after=after)
+
+    if action == "create":
+        return True, dict(before={}, after=payload(name,description))
+
+    if action in ("add_user", "remove_user"):
+        # The user's groups are usually one page, where the group's members may be many
+        member = False
+        for info, items in client.pages(okta_base_url(module, "users/%s/groups?limit=200" % (user_id)), module):
+            if any(group['id'] == id for group in items):
+                member = True
+                break
+
+        if member == (action == "add_user"):
+            return False, {}
+
+        sign = "+" if action == "add_user" else "-"
+        return True, dict(prepared="%s user %s in group %s" % (sign, user_id, id))
+
+    current = client.get(base_url+"/%s" % (id), module)
+
+    if current is None:
+        module.fail_json(msg="Group %s does not exist" % (id))
+
+    before = dict(profile=current['profile'])
+    after = {}
+
+    if action == "update":
+        after = payload(name,description)
+
+    return before != after, dict(before=before, after=after)
+
 def main():
+    argument_spec = okta_argument_spec()
+    argument_spec.update(
+        action         = dict(type='str', default='list', choices=['create', 'update', 'delete', 'list', 'add_user', 'remove_user', 'sync_members']),
+        id     = dict(type='str', default=None),
+        user_id     = dict(type='str', default=None),
+        user_ids     = dict(type='list', default=None),
+        name    = dict(type='str', default=None),
+        description    = dict(type='str', default=None),
+        limit    = dict(type='int', default=200),
+        paginate    = dict(type='str', default='page', choices=['page', 'all']),
+        dest        = dict(type='path', default=None),
+        q     = dict(type='str', default=None),
+        filter     = dict(type='str', default=None),
+        search     = dict(type='str', default=None),
+        expand     = dict(type='str', default=None, choices=['stats', 'app']),
+        fields     = dict(type='list', default=None),
+        state    = dict(type='str', default=None, choices=['present', 'absent'])
+    )
+
     module = AnsibleModule(
-        argument_spec = dict(
-            organization      = dict(type='str', default=None),
-            api_key       = dict(type='str', no_log=True),
-            action         = dict(type='str', default='list', choices=['create', 'update', 'delete', 'list', 'add_user', 'remove_user']),
-            id     = dict(type='str', default=None),
-            user_id     = dict(type='str', default=None),
-            name    = dict(type='str', default=None),
-            description    = dict(type='str', default=None),
-            limit    = dict(type='int', default=200)
-        )
+        argument_spec = argument_spec,
+        supports_check_mode = True,
+        mutually_exclusive = [['q', 'filter', 'search']],
+        required_if = [
+            ['state', 'present', ['id', 'name'], True],
+            ['state', 'absent', ['id', 'name'], True],
+            ['action', 'sync_members', ['id', 'user_ids']]
+        ]
     )
 
-    organization = module.params['organization']
-    api_key = module.params['api_key']
     action = module.params['action']
     id = module.params['id']
     user_id = module.params['user_id']
+    user_ids = module.params['user_ids']
     name = module.params['name']
     description = module.params['description']
     limit = module.params['limit']
-
-    base_url = "https://%s-admin.okta.com/api/v1/groups" % (organization)
-
-    if action == "create":
-        status, message, content, url = create(module,base_url,api_key,name,description)
+    paginate = module.params['paginate']
+    dest = module.params['dest']
+    q = module.params['q']
+    filter = module.params['filter']
+    search = module.params['search']
+    expand = module.params['expand']
+    fields = module.params['fields']
+    state = module.params['state']
+    concurrency = module.params['concurrency']
+    return_mode = module.params['return_mode']
+
+    query = dict(q=q, filter=filter, search=search, expand=expand)
+
+    base_url = okta_base_url(module, "groups")
+    client = okta_client(module)
+
+    # present and absent already find groups by name
+    if state is not None and id is not None and name is None and not is_okta_id(id):
+        id, name = None, id
+    id = resolve_id(module,client,"groups",id)
+    user_id = resolve_id(module,client,"users",user_id)
+    user_ids = resolve_ids(module,client,"users",user_ids)
+    changed = None
+
+    if state is None and action == "list" and dest is not None:
+        if module.check_mode:
+            module.exit_json(changed=True, dest=dest)
+
+        url, count, pages = export(module,base_url,client,limit,query,fields,paginate,dest)
+
+        uresp = {}
+        uresp['changed'] = True
+        uresp['dest'] = dest
+        uresp['count'] = count
+        uresp['pages'] = pages
+        uresp['url'] = url
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
+
+        module.exit_json(**uresp)
+
+    if state is None and action == "sync_members":
+        results, url = sync_members(module,base_url,client,id,user_ids,concurrency)
+        failed = len([result for result in results if result['failed']])
+
+        uresp = {}
+        uresp['changed'] = len(results) > 0
+        uresp['added'] = [result['user_id'] for result in results if result['action'] == "add_user" and not result['failed']]
+        uresp['removed'] = [result['user_id'] for result in results if result['action'] == "remove_user" and not result['failed']]
+        uresp['results'] = results
+        uresp['url'] = url
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
+
+        if failed:
+            module.fail_json(msg="%s of %s membership changes failed" % (failed, len(results)), **uresp)
+
+        module.exit_json(**uresp)
+
+    if module.check_mode and (state is not None or action != "list"):
+        changed, diff = check(module,base_url,client,state,action,id,user_id,name,description)
+
+        uresp = {}
+        uresp['changed'] = changed
+        uresp['diff'] = diff
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
+
+        module.exit_json(**uresp)
+
+    if state == "present":
+        changed, status, message, content, url = present(module,base_url,client,id,name,description)
+    elif state == "absent":
+        changed, status, message, content, url = absent(module,base_url,client,id,name)
+    elif action == "create":
+        status, message, content, url = create(module,base_url,client,name,description)
     elif action == "update":
-        status, message, content, url = update(module,base_url,api_key,id,name,description)
+        status, message, content, url = update(module,base_url,client,id,name,description)
     elif action == "delete":
-        status, message, content, url = delete(module,base_url,api_key,id)
+        status, message, content, url = delete(module,base_url,client,id)
     elif action == "list":
-        status, message, content, url = list(module,base_url,api_key,limit)
+        if paginate == "all":
+            status, message, content, url, pages = list_all(module,base_url,client,limit,query)
+        else:
+            status, message, content, url = list(module,base_url,client,limit,query)
     elif action == "add_user":
-        status, message, content, url = add_user(module,base_url,api_key,id,user_id)
+        status, message, content, url = add_user(module,base_url,client,id,user_id)
     elif action == "remove_user":
-        status, message, content, url = remove_user(module,base_url,api_key,id,user_id)
+        status, message, content, url = remove_user(module,base_url,client,id,user_id)
 
     uresp = {}
-    content = to_text(content, encoding='UTF-8')
 
-    try:
-        js = json.loads(content)
-    except ValueError, e:
-        js = ""
+    if changed is not None:
+        uresp['changed'] = changed
+
+    if state is None and action == "list" and paginate == "all":
+        js = content
+        uresp['pages'] = pages
+    else:
+        content = to_text(content, encoding='UTF-8')
+
+        try:
+            js = json.loads(content)
+        except ValueError, e:
+            js = ""
+
+    if state is None and action == "list" and js:
+        js = project(js, fields)
 
     uresp['json'] = js
     uresp['status'] = status
     uresp['msg'] = message
     uresp['url'] = url
+    shape_result(uresp, return_mode)
+    uresp.update(client.stats())
 
     module.exit_json(**uresp)
 
 # import module snippets
+import copy
 import json
 from ansible.module_utils.basic import *
-from ansible.module_utils.urls import *
+from ansible.module_utils.okta_client import export, is_okta_id, list_all, list_url, okta_argument_spec, okta_base_url, okta_client, project, resolve_id, resolve_ids, run_batch, shape_result
+from ansible.module_utils.six.moves.urllib.parse import quote
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,344 @@
+#!/usr/bin/python
+# (c) 2019, Whitney Champion <whitney.ellis.champion@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+module: okta_info
+short_description: Snapshot users, groups, apps and their relationships from the Okta API
+description:
+    - The Okta info module reads an entire org in one task. Users, groups and
+      apps are listed concurrently with full pagination, then group
+      memberships and app assignments are fetched concurrently for every
+      group and app, and cross-reference indexes are built from them.
+version_added: "1.0"
+author: "Whitney Champion (@shortstack)"
+options:
+  organization:
+    description:
+      - Okta subdomain for your organization. (i.e.
+        mycompany.okta.com).
+    required: false
+    default: None
+  api_url:
+    description:
+      - Base URL of the Okta org, used instead of organization for orgs
+        outside okta.com or a local test server (i.e.
+        https://mycompany.oktapreview.com).
+    required: false
+    default: None
+  api_key:
+    description:
+      - Okta API key.
+    required: false
+    default: None
+  max_retries:
+    description:
+      - Number of times a request is retried after a 429 rate limit response,
+        or after a 5xx error for GET, PUT and DELETE requests. Requests are
+        also paced using the X-Rate-Limit headers returned by Okta.
+    required: false
+    default: 5
+  concurrency:
+    description:
+      - Maximum number of collections fetched in parallel.
+    required: false
+    default: 10
+  cache:
+    description:
+      - Cache GET responses on disk and reuse them across tasks. Fresh entries
+        are returned without a request, stale ones are revalidated with
+        If-None-Match when Okta returned an ETag. Any write made by the module
+        empties the cache.
+    required: false
+    default: false
+  cache_dir:
+    description:
+      - Directory holding the response cache and the ID index.
+    required: false
+    default: ~/.ansible/okta_cache
+  cache_ttl:
+    description:
+      - Number of seconds a cached response is used without revalidation.
+    required: false
+    default: 300
+  cache_max_entries:
+    description:
+      - Maximum number of cached responses, the least recently used are
+        evicted first.
+    required: false
+    default: 1000
+  id_cache_ttl:
+    description:
+      - Number of seconds a resolved user login, group name or app label is
+        kept in the ID index in cache_dir, so options taking IDs can be given
+        names instead without a lookup on every task. 0 disables the index.
+    required: false
+    default: 86400
+  return_mode:
+    description:
+      - How much of each returned Okta object is kept. full returns the
+        objects as received, compact drops _links, _embedded and
+        credentials, ids keeps only the object IDs and none returns no
+        objects, only the status, counts and per-entry outcomes.
+    required: false
+    default: full
+    choices: [ full, compact, ids, none ]
+  metrics:
+    description:
+      - Return a metrics list with one entry per API request, retries
+        included. Each has the method, endpoint (the path with IDs replaced
+        by {id}), status, bytes received, retries, reused (whether a
+        keep-alive connection was reused), wait (seconds paced or backing
+        off for rate limits and errors), the dns, connect, tls and ttfb
+        (time to first byte) seconds of the last attempt, and total.
+        Responses served from the cache are not requests and are left out.
+    required: false
+    default: false
+  trace_file:
+    description:
+      - Append the same per-request entries to this file as JSON lines,
+        with the start time and module name added, to profile every task
+        of a playbook run.
+    required: false
+    default: None
+  gather:
+    description:
+      - Collections to fetch. Memberships and assignments need the groups or
+        apps list, which is fetched for them even when not requested.
+    required: false
+    default: [ users, groups, apps, group_members, app_groups ]
+    choices: [ users, groups, apps, group_members, app_groups, app_users ]
+  limit:
+    description:
+      - Page size used for every collection.
+    required: false
+    default: 200
+  dest:
+    description:
+      - Write the snapshot as JSON to this path and return only the counts.
+    required: false
+    default: None
+"""
+
+EXAMPLES = '''
+# Snapshot the org
+- okta_info:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+  register: okta
+
+- debug:
+    msg: "{{ okta.user_groups['00u5b3gqiLpE114tV2M7'] }}"
+
+# Write the nightly inventory to a file, including direct app user assignments
+- okta_info:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    gather: [ users, groups, apps, group_members, app_groups, app_users ]
+    concurrency: 20
+    dest: "/var/lib/okta/snapshot.json"
+'''
+
+RETURN = r'''
+users:
+  description: All users
+  returned: when users is gathered and dest is not set
+  type: list
+groups:
+  description: All groups
+  returned: when groups are gathered and dest is not set
+  type: list
+apps:
+  description: All apps
+  returned: when apps are gathered and dest is not set
+  type: list
+group_members:
+  description: User IDs of the members of each group, keyed by group ID
+  returned: when group_members is gathered and dest is not set
+  type: dict
+user_groups:
+  description: Group IDs of each user, keyed by user ID
+  returned: when group_members is gathered and dest is not set
+  type: dict
+app_groups:
+  description: Group IDs assigned to each app, keyed by app ID
+  returned: when app_groups is gathered and dest is not set
+  type: dict
+group_apps:
+  description: App IDs assigned to each group, keyed by group ID
+  returned: when app_groups is gathered and dest is not set
+  type: dict
+app_users:
+  description: User IDs assigned to each app, keyed by app ID
+  returned: when app_users is gathered and dest is not set
+  type: dict
+counts:
+  description: Number of objects or relationships in each collection
+  returned: always
+  type: dict
+  sample: {"users": 80000, "groups": 1200, "apps": 150}
+dest:
+  description: Path the snapshot was written to
+  returned: when dest is set
+  type: str
+metrics:
+  description: One entry per API request with its method, endpoint, status, bytes,
+    retries, reused, wait and the dns, connect, tls, ttfb and total seconds
+  returned: when metrics is enabled
+  type: list
+  sample: [{"method": "GET", "endpoint": "/api/v1/users/{id}", "status": 200, "bytes": 1043, "retries": 0, "reused": false, "wait": 0.0, "dns": 0.0012, "connect": 0.0214, "tls": 0.0437, "ttfb": 0.0921, "total": 0.1593}]
+'''
+
+RELATIONS = (
+    ('group_members', 'groups', "/groups/%s/users?limit=%s"),
+    ('app_groups', 'apps', "/apps/%s/groups?limit=%s"),
+    ('app_users', 'apps', "/apps/%s/users?limit=%s"),
+)
+
+def fetch_all(module,client,url):
+
+    results = []
+
+    for info, items in client.pages(url, module):
+        results.extend(items)
+
+    return results
+
+def invert(index):
+
+    inverted = {}
+
+    for key, values in index.items():
+        for value in values:
+            inverted.setdefault(value, []).append(key)
+
+    return inverted
+
+def snapshot(module,base_url,client,gather,limit,concurrency):
+
+    collections = [name for name in ('users', 'groups', 'apps') if name in gather]
+    for relation, parent, path in RELATIONS:
+        if relation in gather and parent not in collections:
+            collections.append(parent)
+
+    # Membership and assignment fetches for the groups or apps start as soon
+    # as that list is complete, while the other collections are still paging
+    graph = TaskGraph(module)
+    urls = {}
+
+    def fetch(url):
+        def run(item_module, deps):
+            return dict(items=fetch_all(item_module,client,url))
+        return run
+
+    def collection(name):
+        def run(item_module, deps):
+            items = fetch_all(item_module,client,urls[name])
+            for relation, parent, path in RELATIONS:
+                if relation in gather and parent == name:
+                    for item in items:
+                        key = (relation, item['id'])
+                        urls[key] = base_url+path % (item['id'], limit)
+                        graph.add(key, fetch(urls[key]))
+            return dict(items=items)
+        return run
+
+    for name in collections:
+        urls[name] = base_url+"/%s?limit=%s" % (name, limit)
+        graph.add(name, collection(name))
+
+    results = graph.run(concurrency)
+
+    for key, result in results.items():
+        if result['failed']:
+            module.fail_json(msg="Fetching %s failed: %s" % (urls[key], result['msg']))
+
+    data = {}
+    for relation, parent, path in RELATIONS:
+        if relation in gather:
+            data[relation] = {}
+
+    for key, result in results.items():
+        if isinstance(key, tuple):
+            data[key[0]][key[1]] = [item['id'] for item in result['items']]
+        else:
+            data[key] = result['items']
+
+    if 'group_members' in gather:
+        data['user_groups'] = invert(data['group_members'])
+    if 'app_groups' in gather:
+        data['group_apps'] = invert(data['app_groups'])
+
+    counts = {}
+    for name, value in data.items():
+        if isinstance(value, dict):
+            counts[name] = sum(len(ids) for ids in value.values())
+        else:
+            counts[name] = len(value)
+
+    return data, counts
+
+def write(module,dest,data):
+
+    try:
+        with atomic_write(dest) as f:
+            json.dump(data, f)
+    except (IOError, OSError) as e:
+        module.fail_json(msg="Unable to write %s: %s" % (dest, to_native(e)))
+
+def main():
+    argument_spec = okta_argument_spec()
+    argument_spec.update(
+        gather     = dict(type='list', default=['users', 'groups', 'apps', 'group_members', 'app_groups'], choices=['users', 'groups', 'apps', 'group_members', 'app_groups', 'app_users']),
+        limit     = dict(type='int', default=200),
+        dest     = dict(type='path', default=None)
+    )
+
+    module = AnsibleModule(
+        argument_spec = argument_spec,
+        supports_check_mode = True
+    )
+
+    gather = module.params['gather']
+    limit = module.params['limit']
+    dest = module.params['dest']
+    concurrency = module.params['concurrency']
+    return_mode = module.params['return_mode']
+
+    base_url = okta_base_url(module)
+    client = okta_client(module)
+
+    data, counts = snapshot(module,base_url,client,gather,limit,concurrency)
+
+    # Every name in the snapshot is current, so later tasks can resolve them without a lookup
+    for name in ('users', 'groups', 'apps'):
+        if name in data:
+            remember_ids(module,client,name,data[name])
+
+    uresp = {}
+
+    if dest is not None:
+        if not module.check_mode:
+            write(module,dest,data)
+        uresp['changed'] = True
+        uresp['dest'] = dest
+    else:
+        uresp.update(data)
+
+    uresp['counts'] = counts
+    shape_result(uresp, return_mode, ('users', 'groups', 'apps'))
+    uresp.update(client.stats())
+
+    module.exit_json(**uresp)
+
+# import module snippets
+import json
+from ansible.module_utils.basic import *
+from ansible.module_utils.okta_client import atomic_write, okta_argument_spec, okta_base_url, okta_client, remember_ids, shape_result, TaskGraph
+
+if __name__ == '__main__':
+    main()
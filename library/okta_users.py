@@ -11,6 +11,8 @@ module: okta_users
 short_description: Communicate with the Okta API to manage users
 description:
     - The Okta user module manages Okta users
+    - In check mode the user is read once and the change the action would
+      make is returned as a diff, without any writes.
 version_added: "1.0"
 author: "Whitney Champion (@shortstack)"
 options:
@@ -20,20 +22,114 @@ options:
         mycompany.okta.com).
     required: false
     default: None
+  api_url:
+    description:
+      - Base URL of the Okta org, used instead of organization for orgs
+        outside okta.com or a local test server (i.e.
+        https://mycompany.oktapreview.com).
+    required: false
+    default: None
   api_key:
     description:
       - Okta API key.
     required: false
     default: None
+  max_retries:
+    description:
+      - Number of times a request is retried after a 429 rate limit response,
+        or after a 5xx error for GET, PUT and DELETE requests. Requests are
+        also paced using the X-Rate-Limit headers returned by Okta.
+    required: false
+    default: 5
+  concurrency:
+    description:
+      - Maximum number of requests run in parallel by bulk actions.
+    required: false
+    default: 10
+  cache:
+    description:
+      - Cache GET responses on disk and reuse them across tasks. Fresh entries
+        are returned without a request, stale ones are revalidated with
+        If-None-Match when Okta returned an ETag. Any write made by the module
+        empties the cache.
+    required: false
+    default: false
+  cache_dir:
+    description:
+      - Directory holding the response cache and the ID index.
+    required: false
+    default: ~/.ansible/okta_cache
+  cache_ttl:
+    description:
+      - Number of seconds a cached response is used without revalidation.
+    required: false
+    default: 300
+  cache_max_entries:
+    description:
+      - Maximum number of cached responses, the least recently used are
+        evicted first.
+    required: false
+    default: 1000
+  id_cache_ttl:
+    description:
+      - Number of seconds a resolved user login, group name or app label is
+        kept in the ID index in cache_dir, so options taking IDs can be given
+        names instead without a lookup on every task. 0 disables the index.
+    required: false
+    default: 86400
+  return_mode:
+    description:
+      - How much of each returned Okta object is kept. full returns the
+        objects as received, compact drops _links, _embedded and
+        credentials, ids keeps only the object IDs and none returns no
+        objects, only the status, counts and per-entry outcomes.
+    required: false
+    default: full
+    choices: [ full, compact, ids, none ]
+  metrics:
+    description:
+      - Return a metrics list with one entry per API request, retries
+        included. Each has the method, endpoint (the path with IDs replaced
+        by {id}), status, bytes received, retries, reused (whether a
+        keep-alive connection was reused), wait (seconds paced or backing
+        off for rate limits and errors), the dns, connect, tls and ttfb
+        (time to first byte) seconds of the last attempt, and total.
+        Responses served from the cache are not requests and are left out.
+    required: false
+    default: false
+  trace_file:
+    description:
+      - Append the same per-request entries to this file as JSON lines,
+        with the start time and module name added, to profile every task
+        of a playbook run.
+    required: false
+    default: None
   action:
     description:
       - Action to take against user API.
+      - activate, deactivate and delete read the user first and skip the
+        lifecycle calls that would not change its status, returning
+        changed false; a user that no longer exists counts as deleted.
+        With users, the entries given by ID are read together with a
+        filtered list per 20 users.
     required: false
     default: list
-    choices: [ create, update, delete, list, activate, deactivate ]
+    choices: [ create, update, delete, list, activate, deactivate, deprovision ]
+  state:
+    description:
+      - Declarative mode, used instead of action. With present the user is
+        read once by id, or by login, then created if missing. An existing
+        user only gets a partial update with the profile attributes that
+        differ, and is added to any of group_ids they are not a member of;
+        other memberships and the password are left alone. With absent the
+        user is deactivated if needed and deleted if it exists. Also
+        applies to each entry of users.
+    required: false
+    default: None
+    choices: [ present, absent ]
   id:
     description:
-      - ID of the user.
+      - ID or login of the user.
     required: false
     default: None
   login:
@@ -68,7 +164,33 @@ options:
     default: None
   group_ids:
     description:
-      - List of Group IDs to add the user to.
+      - List of Group IDs or group names to add the user to.
+    required: false
+    default: None
+  user_ids:
+    description:
+      - List of user IDs or logins to offboard with the deprovision action.
+        All users are deactivated concurrently (see concurrency), and each
+        one is deleted as soon as its deactivation succeeded; a user that
+        fails a stage is left out of the later ones and reported in
+        results.
+    required: false
+    default: None
+  unassign_apps:
+    description:
+      - With the deprovision action, remove the direct app assignments of
+        each user before deactivating it. Assignments inherited through a
+        group are left to the group.
+    required: false
+    default: false
+  users:
+    description:
+      - List of users to process in a single run with the create, update,
+        activate, deactivate or delete action, or with state. Each entry
+        accepts the id, login, password, first_name, last_name, email,
+        group_ids and activate options; group_ids and activate default to
+        the values given for the task. Entries are processed concurrently,
+        see concurrency. Passwords given here are masked like password.
     required: false
     default: None
   limit:
@@ -76,6 +198,64 @@ options:
       - List limit.
     required: false
     default: 25
+  paginate:
+    description:
+      - Whether the list action returns a single page of results or follows
+        the Link header cursor to return the full collection.
+    required: false
+    default: page
+    choices: [ page, all ]
+  dest:
+    description:
+      - With the list action, stream each page to this file as JSON lines
+        (one object per line) as it arrives, instead of returning the
+        objects. The file is gzip compressed when the path ends in .gz.
+        Only counts are returned, so memory stays flat for large orgs.
+    required: false
+    default: None
+  q:
+    description:
+      - With the list action, only return users whose first name, last name
+        or email starts with this value. Cannot be combined with filter or
+        search.
+    required: false
+    default: None
+  filter:
+    description:
+      - With the list action, Okta filter expression applied server side
+        (i.e. status eq "ACTIVE").
+    required: false
+    default: None
+  search:
+    description:
+      - With the list action, Okta search expression applied server side,
+        which supports more properties and operators than filter (i.e.
+        profile.department eq "Engineering").
+    required: false
+    default: None
+  fields:
+    description:
+      - With the list action, only keep these fields of each object in the
+        result or dest file. Nested fields are given with dots (i.e.
+        profile.login).
+    required: false
+    default: None
+  snapshot:
+    description:
+      - With the list action, keep all users in this local JSON file
+        together with the highest lastUpdated seen. Later runs only fetch
+        users updated since then, using a lastUpdated filter, merge them
+        into the file and return just those users. The first run, or a
+        missing file, fetches everything.
+    required: false
+    default: None
+  full_refresh:
+    description:
+      - With snapshot, ignore the stored snapshot and rebuild it from a full
+        list. Users deleted from Okta never show up as updated, run a full
+        refresh now and then to drop them.
+    required: false
+    default: false
 """
 
 EXAMPLES = '''
@@ -85,6 +265,38 @@ EXAMPLES = '''
     api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
     limit: 25
 
+# List all users, following pagination
+- okta_users:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    limit: 200
+    paginate: all
+
+# List the logins of all active users in Engineering, filtered by Okta
+- okta_users:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    limit: 200
+    paginate: all
+    search: 'status eq "ACTIVE" and profile.department eq "Engineering"'
+    fields: [ id, profile.login ]
+
+# Hourly sync, only fetching users changed since the previous run
+- okta_users:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    limit: 200
+    snapshot: "/var/lib/okta/users.json"
+  register: okta_changes
+
+# Export all users to a compressed JSON lines file
+- okta_users:
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    limit: 200
+    paginate: all
+    dest: "/var/lib/okta/users.jsonl.gz"
+
 # Create user
 - okta_users:
     action: create
@@ -128,6 +340,31 @@ EXAMPLES = '''
     - { login: "alice@aol.com", first_name: "Alice", last_name: "A", email: "alice@aolcom", password: "ilovebob111", activate: yes }
     - { login: "bob@aol.com", first_name: "Bob", last_name: "B", email: "bob@aolcom", password: "ilovealice111", activate: yes }
 
+# Create multiple users in group in one run
+- okta_users:
+    action: create
+    organization: "crypto"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    group_ids:
+      - "00f5b3gqiLpE324tV2M7"
+    concurrency: 10
+    users:
+      - { login: "alice@aol.com", first_name: "Alice", last_name: "A", email: "alice@aolcom", password: "ilovebob111" }
+      - { login: "bob@aol.com", first_name: "Bob", last_name: "B", email: "bob@aolcom", password: "ilovealice111" }
+  no_log: true
+
+# Make sure a user exists with this profile, only writing what differs
+- okta_users:
+    state: present
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    login: "whitney@unicorns.lol"
+    first_name: "Whitney"
+    last_name: "Champion"
+    email: "whitney@unicorns.lol"
+    group_ids:
+      - "00f5b3gqiLpE114tV2M7"
+
 # Update user's email address
 - okta_users:
     action: update
@@ -156,6 +393,18 @@ EXAMPLES = '''
     organization: "unicorns"
     api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
     id: "01c5pEucucMPWXjFM456"
+
+# Offboard several users in one run, removing their app assignments first
+- okta_users:
+    action: deprovision
+    organization: "unicorns"
+    api_key: "TmHvH4LY9HH9MDRDiLChLGwhRjHsarTCBzpwbua3ntnQ"
+    unassign_apps: yes
+    concurrency: 10
+    user_ids:
+      - "alice@aol.com"
+      - "bob@aol.com"
+      - "01c5pEucucMPWXjFM456"
 '''
 
 RETURN = r'''
@@ -178,11 +427,69 @@ url:
   returned: always
   type: str
   sample: https://www.ansible.com/
+retries:
+  description: Number of requests retried after a rate limit or server error
+  returned: always
+  type: int
+  sample: 0
+results:
+  description: Per-user id, login, json, status, msg, url and failed flag. With
+    deprovision, per-user user (as given), id, apps unassigned, deactivated
+    and deleted flags, and failed flag with the failing stage and msg; in
+    check mode, what would be done.
+  returned: when users is given, or action is deprovision
+  type: list
+count:
+  description: Number of objects written to dest, or users held in the snapshot
+  returned: when action is list and dest or snapshot is set
+  type: int
+watermark:
+  description: Highest lastUpdated stored in the snapshot, the next run fetches users updated after it
+  returned: when action is list and snapshot is set
+  type: str
+  sample: "2019-06-04T17:02:53.000Z"
+snapshot:
+  description: Path of the snapshot file
+  returned: when action is list and snapshot is set
+  type: str
+dest:
+  description: Path the list was written to
+  returned: when action is list and dest is set
+  type: str
+changed:
+  description: Whether the action would make a change, whether state, a
+    lifecycle action or deprovision made one, or with snapshot whether any
+    user was updated since the previous run
+  returned: when state is given, in check mode, when action is activate, deactivate, delete or deprovision, or when action is list and snapshot is set
+  type: bool
+diff:
+  description: Status and profile of the user before and after the action, computed from a single read
+  returned: in check mode
+  type: dict
+rate_limit_wait:
+  description: Seconds spent waiting on rate limits and retry backoff
+  returned: always
+  type: float
+  sample: 1.5
+cache:
+  description: Response cache hits and misses
+  returned: when cache is enabled
+  type: dict
+  sample: {"hits": 3, "misses": 1}
+metrics:
+  description: One entry per API request with its method, endpoint, status, bytes,
+    retries, reused, wait and the dns, connect, tls, ttfb and total seconds
+  returned: when metrics is enabled
+  type: list
+  sample: [{"method": "GET", "endpoint": "/api/v1/users/{id}", "status": 200, "bytes": 1043, "retries": 0, "reused": false, "wait": 0.0, "dns": 0.0012, "connect": 0.0214, "tls": 0.0437, "ttfb": 0.0921, "total": 0.1593}]
+pages:
+  description: Number of pages (and API requests) fetched when paginate is all
+  returned: when action is list and paginate is all, or dest or snapshot is set
+  type: int
+  sample: 4
 '''
 
-def create(module,base_url,api_key,login,password_input,email,first_name,last_name,group_ids,activate):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def create_payload(login,password_input,email,first_name,last_name,group_ids):
 
     payload = {}
     profile = {}
@@ -208,9 +515,15 @@ def create(module,base_url,api_key,login,password_input,email,first_name,last_na
     payload['groupIds'] = groupIds
     payload['profile'] = profile
 
+    return payload
+
+def create(module,base_url,client,login,password_input,email,first_name,last_name,group_ids,activate):
+
+    payload = create_payload(login,password_input,email,first_name,last_name,group_ids)
+
     url = base_url+"?activate=%s" % (activate)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+    response, info = client.fetch(url, method='POST', data=module.jsonify(payload))
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -222,11 +535,7 @@ def create(module,base_url,api_key,login,password_input,email,first_name,last_na
 
     return info['status'], info['msg'], content, url
 
-def update(module,base_url,api_key,id,login,email,first_name,last_name):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
-
-    url = base_url+"/%s" % (id)
+def update_payload(login,email,first_name,last_name):
 
     payload = {}
     profile = {}
@@ -242,7 +551,15 @@ def update(module,base_url,api_key,id,login,email,first_name,last_name):
 
     payload['profile'] = profile
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST', data=module.jsonify(payload))
+    return payload
+
+def update(module,base_url,client,id,login,email,first_name,last_name):
+
+    url = base_url+"/%s" % (id)
+
+    payload = update_payload(login,email,first_name,last_name)
+
+    response, info = client.fetch(url, method='POST', data=module.jsonify(payload))
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -254,13 +571,11 @@ def update(module,base_url,api_key,id,login,email,first_name,last_name):
 
     return info['status'], info['msg'], content, url
 
-def delete(module,base_url,api_key,id):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def delete(module,base_url,client,id):
 
     url = base_url+"/%s" % (id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='DELETE')
+    response, info = client.fetch(url, method='DELETE')
 
     if info['status'] != 204:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -272,13 +587,11 @@ def delete(module,base_url,api_key,id):
 
     return info['status'], info['msg'], content, url
 
-def activate(module,base_url,api_key,id):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def activate(module,base_url,client,id):
 
     url = base_url+"/%s/lifecycle/activate" % (id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST')
+    response, info = client.fetch(url, method='POST')
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -290,13 +603,11 @@ def activate(module,base_url,api_key,id):
 
     return info['status'], info['msg'], content, url
 
-def deactivate(module,base_url,api_key,id):
-
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+def deactivate(module,base_url,client,id):
 
     url = base_url+"/%s/lifecycle/deactivate" % (id)
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='POST')
+    response, info = client.fetch(url, method='POST')
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -308,13 +619,141 @@ def deactivate(module,base_url,api_key,id):
 
     return info['status'], info['msg'], content, url
 
-def list(module,base_url,api_key,limit):
+def find(module,base_url,client,id,login):
+
+    # Okta resolves either the id or the login in the path, so one GET finds the user
+    url = base_url+"/%s" % (quote(id if id is not None else login, safe='@'))
+
+    response, info = client.fetch(url, method='GET')
+
+    if info['status'] == 404:
+        return None, info, url
+    if info['status'] != 200:
+        module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
+
+    return json.loads(to_text(response.read(), encoding='UTF-8')), info, url
+
+def plan(module,base_url,client,id,login,email,first_name,last_name,group_ids):
+
+    user, info, url = find(module,base_url,client,id,login)
+
+    if user is None:
+        if id is not None:
+            module.fail_json(msg="User %s does not exist" % (id))
+        return user, info, url, None, None
+
+    wanted = update_payload(login,email,first_name,last_name)['profile']
+    changes = dict((key, value) for key, value in wanted.items() if user['profile'].get(key) != value)
+
+    missing = []
+    if group_ids:
+        current = set()
+        for page_info, items in client.pages(base_url+"/%s/groups" % (user['id']), module):
+            current.update(group['id'] for group in items)
+        missing = [group_id for group_id in group_ids if group_id not in current]
 
-    headers = '{ "Content-Type": "application/json", "Authorization": "SSWS %s", "Accept": "application/json" }' % (api_key)
+    return user, info, url, changes, missing
 
-    url = base_url+"/?limit=%s" % (limit)
+def add_to_group(module,base_url,client,id,group_id):
 
-    response, info = fetch_url(module=module, url=url, headers=json.loads(headers), method='GET')
+    url = okta_base_url(module, "groups")+"/%s/users/%s" % (group_id,id)
+
+    response, info = client.fetch(url, method='PUT')
+
+    if info['status'] != 204:
+        module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
+
+    return info['status'], info['msg'], "", url
+
+def present(module,base_url,client,id,login,password_input,email,first_name,last_name,group_ids,activate_user):
+
+    user, info, url, changes, missing = plan(module,base_url,client,id,login,email,first_name,last_name,group_ids)
+
+    if user is None:
+        status, message, content, url = create(module,base_url,client,login,password_input,email,first_name,last_name,group_ids,activate_user)
+        return True, status, message, content, url
+
+    if not changes and not missing:
+        return False, info['status'], info['msg'], module.jsonify(user), url
+
+    status, message, content = info['status'], info['msg'], module.jsonify(user)
+
+    # POST to /users/{id} is a partial update, only the attributes that differ are sent
+    if changes:
+        status, message, content, url = update(module,base_url,client,user['id'],changes.get('login'),changes.get('email'),changes.get('firstName'),changes.get('lastName'))
+
+    for group_id in missing:
+        add_to_group(module,base_url,client,user['id'],group_id)
+
+    return True, status, message, content, url
+
+def absent(module,base_url,client,id,login):
+
+    user, info, url = find(module,base_url,client,id,login)
+
+    return lifecycle(module,base_url,client,"delete",id or login,user,info,url)
+
+def lifecycle(module,base_url,client,action,id,user,info,url):
+
+    # user is the current object, read or prefetched, so transitions to the
+    # state it is already in are skipped instead of posted
+    if user is None:
+        if action != "delete":
+            module.fail_json(msg="User %s does not exist" % (id))
+        return False, info['status'], info['msg'], "", url
+
+    if (action == "activate" and user['status'] == "ACTIVE") or (action == "deactivate" and user['status'] == "DEPROVISIONED"):
+        return False, info['status'], info['msg'], module.jsonify(user), url
+
+    if action == "activate":
+        status, message, content, url = activate(module,base_url,client,user['id'])
+    elif action == "deactivate":
+        status, message, content, url = deactivate(module,base_url,client,user['id'])
+    else:
+        if user['status'] != "DEPROVISIONED":
+            deactivate(module,base_url,client,user['id'])
+        status, message, content, url = delete(module,base_url,client,user['id'])
+
+    return True, status, message, content, url
+
+def prefetch(module,base_url,client,ids,concurrency):
+
+    # One filtered list per chunk of IDs instead of one read per user; IDs of
+    # a chunk that failed are left out and read on their own later
+    chunks = [ids[start:start + 20] for start in range(0, len(ids), 20)]
+
+    def run(item_module, chunk):
+
+        url = list_url(item_module,base_url,200,dict(filter=" or ".join('id eq "%s"' % (id) for id in chunk)))
+
+        found = {}
+        for info, items in client.pages(url, item_module):
+            found.update((user['id'], user) for user in items)
+
+        return dict(found=found, info=dict(status=info['status'], msg=info['msg']))
+
+    known = {}
+    for chunk, result in zip(chunks, run_batch(module, run, chunks, concurrency)):
+        if result['failed']:
+            continue
+        for id in chunk:
+            known[id] = (result['found'].get(id), result['info'])
+
+    return known
+
+def current(module,base_url,client,known,id,login=None):
+
+    if id in known:
+        user, info = known[id]
+        return user, info, base_url+"/%s" % (id)
+
+    return find(module,base_url,client,id,login)
+
+def list(module,base_url,client,limit,query):
+
+    url = list_url(module,base_url,limit,query)
+
+    response, info = client.fetch(url, method='GET')
 
     if info['status'] != 200:
         module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
@@ -326,26 +765,316 @@ def list(module,base_url,api_key,limit):
 
     return info['status'], info['msg'], content, url
 
+def check(module,base_url,client,state,action,id,login,password_input,email,first_name,last_name,group_ids):
+
+    if state == "present":
+        user, info, url, changes, missing = plan(module,base_url,client,id,login,email,first_name,last_name,group_ids)
+
+        if user is None:
+            payload = create_payload(login,password_input,email,first_name,last_name,group_ids)
+            payload.pop('credentials')
+            return True, dict(before={}, after=payload)
+
+        before = dict(profile=user['profile'])
+        after = copy.deepcopy(before)
+        after['profile'].update(changes)
+
+        if group_ids:
+            before['groupIds'] = [group_id for group_id in group_ids if group_id not in missing]
+            after['groupIds'] = [group_id for group_id in group_ids]
+
+        return before != after, dict(before=before, after=after)
+
+    if state == "absent":
+        user, info, url = find(module,base_url,client,id,login)
+
+        if user is None:
+            return False, dict(before={}, after={})
+
+        return True, dict(before=dict(status=user['status'], profile=user['profile']), after={})
+
+    if action == "create":
+        payload = create_payload(login,password_input,email,first_name,last_name,group_ids)
+        payload.pop('credentials')
+        return True, dict(before={}, after=payload)
+
+    user, info, url = find(module,base_url,client,id,login)
+
+    if user is None:
+        if action == "delete":
+            return False, dict(before={}, after={})
+        module.fail_json(msg="User %s does not exist" % (id if id is not None else login))
+
+    before = dict(status=user['status'], profile=user['profile'])
+    after = copy.deepcopy(before)
+
+    if action == "update":
+        after['profile'].update(update_payload(login,email,first_name,last_name)['profile'])
+    elif action == "delete":
+        after = {}
+    elif action == "activate":
+        after['status'] = "ACTIVE"
+    elif action == "deactivate":
+        after['status'] = "DEPROVISIONED"
+
+    return before != after, dict(before=before, after=after)
+
+def bulk(module,base_url,client,state,action,users,group_ids,activate_user,concurrency):
+
+    known = {}
+    if state is None and action in ("delete", "activate", "deactivate") and not module.check_mode:
+        ids = [user['id'] for user in users if user.get('id') and is_okta_id(user['id'])]
+        known = prefetch(module,base_url,client,sorted(set(ids)),concurrency)
+
+    def run(item_module, user):
+
+        # Entries are checked against the users suboptions, which leave unset keys as None
+        item = dict(user)
+        if item['group_ids'] is None:
+            item['group_ids'] = group_ids
+        if item['activate'] is None:
+            item['activate'] = activate_user
+
+        if (state is not None or action in ("delete", "activate", "deactivate")) and item['id'] is None and item['login'] is None:
+            item_module.fail_json(msg="%s needs id or login in each users entry" % ("state" if state is not None else action))
+
+        if state is None:
+            item['id'] = resolve_id(item_module,client,"users",item['id'])
+        item['group_ids'] = resolve_ids(item_module,client,"groups",item['group_ids'])
+
+        if module.check_mode:
+            changed, diff = check(item_module,base_url,client,state,action,item['id'],item['login'],item['password'],item['email'],item['first_name'],item['last_name'],item['group_ids'])
+            return dict(id=item['id'], login=item['login'], changed=changed, diff=diff)
+
+        changed = None
+
+        if state == "present":
+            changed, status, message, content, url = present(item_module,base_url,client,item['id'],item['login'],item['password'],item['email'],item['first_name'],item['last_name'],item['group_ids'],item['activate'])
+        elif state == "absent":
+            changed, status, message, content, url = absent(item_module,base_url,client,item['id'],item['login'])
+        elif action == "create":
+            status, message, content, url = create(item_module,base_url,client,item['login'],item['password'],item['email'],item['first_name'],item['last_name'],item['group_ids'],item['activate'])
+        elif action == "update":
+            status, message, content, url = update(item_module,base_url,client,item['id'],item['login'],item['email'],item['first_name'],item['last_name'])
+        else:
+            user, info, url = current(item_module,base_url,client,known,item['id'],item['login'])
+            if user is not None:
+                item['id'] = user['id']
+            changed, status, message, content, url = lifecycle(item_module,base_url,client,action,item['id'] if item['id'] is not None else item['login'],user,info,url)
+
+        try:
+            js = json.loads(to_text(content, encoding='UTF-8'))
+        except ValueError:
+            js = ""
+
+        result = dict(id=item['id'], login=item['login'], json=js, status=status, msg=message, url=url)
+        if changed is not None:
+            result['changed'] = changed
+
+        return result
+
+    results = run_batch(module, run, users, concurrency)
+
+    for user, result in zip(users, results):
+        result.setdefault('id', user.get('id'))
+        result.setdefault('login', user.get('login'))
+
+    return results
+
+def unassign_apps(module,base_url,client,id):
+
+    apps_url = okta_base_url(module, "apps")
+
+    # expand=user/{id} embeds the app user, whose scope tells direct assignments
+    # from those inherited through a group, which Okta refuses to remove
+    url = list_url(module,apps_url,200,dict(filter='user.id eq "%s"' % (id), expand="user/%s" % (id)))
+
+    app_ids = []
+    for info, items in client.pages(url, module):
+        app_ids.extend(app['id'] for app in items if app.get('_embedded', {}).get('user', {}).get('scope') != "GROUP")
+
+    if module.check_mode:
+        return app_ids
+
+    for app_id in app_ids:
+        response, info = client.fetch(apps_url+"/%s/users/%s" % (app_id,id), method='DELETE')
+
+        if info['status'] != 204:
+            module.fail_json(msg="Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])))
+
+    return app_ids
+
+def deprovision(module,base_url,client,user_ids,unassign,concurrency):
+
+    stages = ["deactivate", "delete"]
+    if unassign:
+        stages.insert(0, "unassign_apps")
+
+    users = []
+    for value in user_ids:
+        if value not in users:
+            users.append(value)
+
+    known = prefetch(module,base_url,client,sorted(set(value for value in users if is_okta_id(value))),concurrency)
+
+    def task(stage, value):
+
+        def run(item_module, deps):
+
+            # The first stage resolves the login, so an unknown user only fails its own entry
+            if deps:
+                id = next(iter(deps.values()))['id']
+            else:
+                id = resolve_id(item_module,client,"users",value)
+
+            if stage == "unassign_apps":
+                return dict(id=id, apps=unassign_apps(item_module,base_url,client,id))
+
+            # Users already deactivated, or already deleted, are not posted again
+            if stage == "deactivate":
+                user, info, url = current(item_module,base_url,client,known,id)
+                changed = user is not None and user['status'] != "DEPROVISIONED"
+                if changed and not module.check_mode:
+                    deactivate(item_module,base_url,client,id)
+                return dict(id=id, user=user, changed=changed)
+
+            changed = deps["deactivate %s" % (value)]['user'] is not None
+            if changed and not module.check_mode:
+                delete(item_module,base_url,client,id)
+
+            return dict(id=id, changed=changed)
+
+        return run
+
+    # Every user moves through the stages on its own, a later stage only runs
+    # once the previous one succeeded for that user
+    graph = TaskGraph(module)
+    for value in users:
+        previous = ()
+        for stage in stages:
+            name = "%s %s" % (stage, value)
+            graph.add(name, task(stage, value), previous)
+            previous = (name,)
+
+    outcomes = graph.run(concurrency)
+
+    results = []
+    for value in users:
+        result = dict(user=value, id=None, apps=[], deactivated=False, deleted=False, failed=False)
+
+        for stage in stages:
+            outcome = outcomes["%s %s" % (stage, value)]
+            if outcome['failed']:
+                result.update(failed=True, stage=stage, msg=outcome['msg'])
+                break
+            result['id'] = outcome['id']
+            if stage == "unassign_apps":
+                result['apps'] = outcome['apps']
+            elif stage == "deactivate":
+                result['deactivated'] = outcome['changed']
+            else:
+                result['deleted'] = outcome['changed']
+
+        results.append(result)
+
+    return results
+
+def load_snapshot(module,path):
+
+    if not os.path.exists(path):
+        return None, {}
+
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        module.fail_json(msg="Unable to read snapshot %s: %s" % (path, to_native(e)))
+
+    return data.get('lastUpdated'), data.get('users', {})
+
+def save_snapshot(module,path,watermark,users):
+
+    try:
+        with atomic_write(path) as f:
+            json.dump(dict(lastUpdated=watermark, users=users), f)
+    except (IOError, OSError) as e:
+        module.fail_json(msg="Unable to write snapshot %s: %s" % (path, to_native(e)))
+
+def incremental(module,base_url,client,limit,fields,path,full_refresh):
+
+    if full_refresh:
+        watermark, users = None, {}
+    else:
+        watermark, users = load_snapshot(module,path)
+
+    query = {}
+    if watermark is not None:
+        query['filter'] = 'lastUpdated gt "%s"' % (watermark)
+
+    url = list_url(module,base_url,limit,query)
+
+    changes = []
+    pages = 0
+
+    for info, items in client.pages(url, module):
+        changes.extend(items)
+        pages += 1
+
+    watermark = latest_timestamp(changes, watermark)
+
+    if fields:
+        changes = project(changes, fields + ['id', 'lastUpdated'])
+
+    for user in changes:
+        users[user['id']] = user
+
+    if not module.check_mode:
+        save_snapshot(module,path,watermark,users)
+
+    return changes, len(users), watermark, url, pages
+
 def main():
-    module = AnsibleModule(
-        argument_spec = dict(
-            organization      = dict(type='str', default=None),
-            api_key       = dict(type='str', no_log=True),
-            action         = dict(type='str', default='list', choices=['create', 'update', 'delete', 'list', 'activate', 'deactivate']),
-            id     = dict(type='str', default=None),
-            login    = dict(type='str', default=None),
+    argument_spec = okta_argument_spec()
+    argument_spec.update(
+        action         = dict(type='str', default='list', choices=['create', 'update', 'delete', 'list', 'activate', 'deactivate', 'deprovision']),
+        id     = dict(type='str', default=None),
+        login    = dict(type='str', default=None),
+        password    = dict(type='str', default=None, no_log=True),
+        first_name  = dict(type='str', default=None),
+        last_name  = dict(type='str', default=None),
+        email       = dict(type='str', default=None),
+        group_ids       = dict(type='list', default=None),
+        user_ids       = dict(type='list', default=None),
+        unassign_apps       = dict(type='bool', default=False),
+        limit     = dict(type='int', default=25),
+        paginate     = dict(type='str', default='page', choices=['page', 'all']),
+        dest         = dict(type='path', default=None),
+        q     = dict(type='str', default=None),
+        filter     = dict(type='str', default=None),
+        search     = dict(type='str', default=None),
+        fields     = dict(type='list', default=None),
+        snapshot     = dict(type='path', default=None),
+        full_refresh     = dict(type='bool', default=False),
+        state    = dict(type='str', default=None, choices=['present', 'absent']),
+        activate   = dict(type='bool', default='yes'),
+        users      = dict(type='list', elements='dict', default=None, options=dict(
+            id          = dict(type='str', default=None),
+            login       = dict(type='str', default=None),
             password    = dict(type='str', default=None, no_log=True),
             first_name  = dict(type='str', default=None),
-            last_name  = dict(type='str', default=None),
+            last_name   = dict(type='str', default=None),
             email       = dict(type='str', default=None),
-            group_ids       = dict(type='list', default=None),
-            limit     = dict(type='int', default=25),
-            activate   = dict(type='bool', default='yes')
-        )
+            group_ids   = dict(type='list', default=None),
+            activate    = dict(type='bool', default=None)
+        ))
+    )
+
+    module = AnsibleModule(
+        argument_spec = argument_spec,
+        mutually_exclusive = [['q', 'filter', 'search'], ['snapshot', 'dest'], ['snapshot', 'q'], ['snapshot', 'filter'], ['snapshot', 'search']],
+        supports_check_mode = True
     )
 
-    organization = module.params['organization']
-    api_key = module.params['api_key']
     action = module.params['action']
     id = module.params['id']
     login = module.params['login']
@@ -354,44 +1083,173 @@ def main():
     last_name = module.params['last_name']
     email = module.params['email']
     group_ids = module.params['group_ids']
+    user_ids = module.params['user_ids']
+    unassign = module.params['unassign_apps']
     limit = module.params['limit']
-    activate = module.params['activate']
-
-    base_url = "https://%s-admin.okta.com/api/v1/users" % (organization)
+    paginate = module.params['paginate']
+    dest = module.params['dest']
+    q = module.params['q']
+    filter = module.params['filter']
+    search = module.params['search']
+    fields = module.params['fields']
+    snapshot = module.params['snapshot']
+    full_refresh = module.params['full_refresh']
+    state = module.params['state']
+    activate_user = module.params['activate']
+    users = module.params['users']
+    concurrency = module.params['concurrency']
+    return_mode = module.params['return_mode']
+
+    query = dict(q=q, filter=filter, search=search)
+
+    if state is not None and users is None and id is None and login is None:
+        module.fail_json(msg="state needs id or login")
+
+    base_url = okta_base_url(module, "users")
+    client = okta_client(module)
+
+    # present, absent and deprovision look users up by id or login themselves
+    if state is None and action not in ("list", "deprovision"):
+        id = resolve_id(module,client,"users",id)
+    group_ids = resolve_ids(module,client,"groups",group_ids)
+
+    if state is None and action == "list" and snapshot is not None:
+        changes, count, watermark, url, pages = incremental(module,base_url,client,limit,fields,snapshot,full_refresh)
+
+        uresp = {}
+        uresp['changed'] = len(changes) > 0
+        uresp['json'] = changes
+        uresp['count'] = count
+        uresp['watermark'] = watermark
+        uresp['snapshot'] = snapshot
+        uresp['pages'] = pages
+        uresp['url'] = url
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
+
+        module.exit_json(**uresp)
+
+    if state is None and action == "list" and dest is not None:
+        if module.check_mode:
+            module.exit_json(changed=True, dest=dest)
+
+        url, count, pages = export(module,base_url,client,limit,query,fields,paginate,dest)
+
+        uresp = {}
+        uresp['changed'] = True
+        uresp['dest'] = dest
+        uresp['count'] = count
+        uresp['pages'] = pages
+        uresp['url'] = url
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
+
+        module.exit_json(**uresp)
+
+    if state is None and action == "deprovision":
+        if users is not None:
+            module.fail_json(msg="The users option cannot be used with the deprovision action, use user_ids")
+        if not user_ids and id is None:
+            module.fail_json(msg="deprovision needs user_ids or id")
+
+        results = deprovision(module,base_url,client,user_ids or [id],unassign,concurrency)
+        failed = len([result for result in results if result['failed']])
+
+        uresp = {}
+        uresp['changed'] = len([result for result in results if result['apps'] or result['deactivated'] or result['deleted']]) > 0
+        uresp['results'] = results
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
+
+        if failed:
+            module.fail_json(msg="%s of %s users failed" % (failed, len(results)), **uresp)
+
+        module.exit_json(**uresp)
+
+    if users is not None:
+        if state is None and action == "list":
+            module.fail_json(msg="The users option cannot be used with the list action")
+
+        results = bulk(module,base_url,client,state,action,users,group_ids,activate_user,concurrency)
+        failed = len([result for result in results if result['failed']])
+
+        uresp = {}
+        if module.check_mode or state is not None or action in ("delete", "activate", "deactivate"):
+            uresp['changed'] = len([result for result in results if result.get('changed')]) > 0
+        uresp['results'] = results
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
+
+        if failed:
+            module.fail_json(msg="%s of %s users failed" % (failed, len(results)), **uresp)
+
+        module.exit_json(**uresp)
+
+    if module.check_mode and (state is not None or action != "list"):
+        changed, diff = check(module,base_url,client,state,action,id,login,password,email,first_name,last_name,group_ids)
+
+        uresp = {}
+        uresp['changed'] = changed
+        uresp['diff'] = diff
+        shape_result(uresp, return_mode)
+        uresp.update(client.stats())
+
+        module.exit_json(**uresp)
+
+    changed = None
 
-    if action == "create":
-        status, message, content, url = create(module,base_url,api_key,login,password,email,first_name,last_name,group_ids,activate)
+    if state == "present":
+        changed, status, message, content, url = present(module,base_url,client,id,login,password,email,first_name,last_name,group_ids,activate_user)
+    elif state == "absent":
+        changed, status, message, content, url = absent(module,base_url,client,id,login)
+    elif action == "create":
+        status, message, content, url = create(module,base_url,client,login,password,email,first_name,last_name,group_ids,activate_user)
     elif action == "update":
-        status, message, content, url = update(module,base_url,api_key,id,login,email,first_name,last_name)
-    elif action == "delete":
-        status, message, content, url = deactivate(module,base_url,api_key,id)
-        status, message, content, url = delete(module,base_url,api_key,id)
-    elif action == "activate":
-        status, message, content, url = activate(module,base_url,api_key,id)
-    elif action == "deactivate":
-        status, message, content, url = deactivate(module,base_url,api_key,id)
+        status, message, content, url = update(module,base_url,client,id,login,email,first_name,last_name)
+    elif action in ("delete", "activate", "deactivate"):
+        user, info, url = find(module,base_url,client,id,None)
+        changed, status, message, content, url = lifecycle(module,base_url,client,action,id,user,info,url)
     elif action == "list":
-        status, message, content, url = list(module,base_url,api_key,limit)
+        if paginate == "all":
+            status, message, content, url, pages = list_all(module,base_url,client,limit,query)
+        else:
+            status, message, content, url = list(module,base_url,client,limit,query)
 
     uresp = {}
-    content = to_text(content, encoding='UTF-8')
 
-    try:
-        js = json.loads(content)
-    except ValueError, e:
-        js = ""
+    if changed is not None:
+        uresp['changed'] = changed
+
+    if state is None and action == "list" and paginate == "all":
+        js = content
+        uresp['pages'] = pages
+    else:
+        content = to_text(content, encoding='UTF-8')
+
+        try:
+            js = json.loads(content)
+        except ValueError, e:
+            js = ""
+
+    if state is None and action == "list" and js:
+        js = project(js, fields)
 
     uresp['json'] = js
     uresp['status'] = status
     uresp['msg'] = message
     uresp['url'] = url
+    shape_result(uresp, return_mode)
+    uresp.update(client.stats())
 
     module.exit_json(**uresp)
 
 # import module snippets
+import copy
 import json
+import os
 from ansible.module_utils.basic import *
-from ansible.module_utils.urls import *
+from ansible.module_utils.six.moves.urllib.parse import quote
+from ansible.module_utils.okta_client import atomic_write, export, is_okta_id, latest_timestamp, list_all, list_url, okta_argument_spec, okta_base_url, okta_client, project, resolve_id, resolve_ids, run_batch, shape_result, TaskGraph
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,208 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+    lookup: okta
+    short_description: Resolve Okta user logins, group names and app labels to IDs
+    description:
+        - Returns the ID of each user login, group name or app label given,
+          resolved on the controller through the same client and ID index as
+          the modules (module_utils/okta_client.py). Values that already look
+          like Okta IDs are returned as is.
+        - Results are kept in the SQLite ID index in cache_dir, shared with the
+          modules and kept for id_cache_ttl seconds, so a name is only searched
+          for once per id_cache_ttl. Ansible templates every task in a new
+          worker process, so with id_cache_ttl set to 0 each task searches again.
+        - All names of one lookup missing from the index are resolved together, with
+          one paginated search per chunk of 20 users or groups, chunks fetched
+          concurrently, and a single paginated list of the apps.
+    options:
+        _terms:
+            description: User logins, group names or app labels.
+            required: True
+        kind:
+            description: What the terms name.
+            default: users
+            choices: ['users', 'groups', 'apps']
+        organization:
+            description:
+                - Okta subdomain for your organization. (i.e.
+                  mycompany.okta.com).
+            env:
+                - name: OKTA_ORGANIZATION
+            vars:
+                - name: okta_organization
+        api_url:
+            description:
+                - Base URL of the Okta org, used instead of organization for orgs
+                  outside okta.com or a local test server (i.e.
+                  https://mycompany.oktapreview.com).
+            env:
+                - name: OKTA_API_URL
+            vars:
+                - name: okta_api_url
+        api_key:
+            description:
+                - Okta API key.
+            env:
+                - name: OKTA_API_KEY
+            vars:
+                - name: okta_api_key
+        max_retries:
+            description:
+                - Number of times a request is retried after a 429 rate limit
+                  response, or after a 5xx error.
+            type: int
+            default: 5
+        concurrency:
+            description:
+                - Maximum number of searches run in parallel.
+            type: int
+            default: 10
+        cache_dir:
+            description:
+                - Directory holding the ID index.
+            type: path
+            default: ~/.ansible/okta_cache
+        id_cache_ttl:
+            description:
+                - Number of seconds a resolved name is kept in the ID index. 0
+                  disables the index.
+            type: int
+            default: 86400
+"""
+
+EXAMPLES = """
+- okta_users:
+    action: update
+    id: "{{ lookup('okta', 'alice@example.com') }}"
+    first_name: Alice
+
+- okta_apps:
+    action: assign_groups
+    id: "{{ lookup('okta', 'Payroll', kind='apps') }}"
+    group_ids: "{{ query('okta', 'Engineering', 'Finance', 'Support', kind='groups') }}"
+  vars:
+    okta_organization: unicorns
+    okta_api_key: "{{ vault_okta_api_key }}"
+"""
+
+RETURN = """
+    _raw:
+        description: ID of each term, in order.
+        type: list
+"""
+
+import os
+import sys
+
+from ansible import constants as C
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_native
+from ansible.plugins.lookup import LookupBase
+
+# load_okta_client and PluginModule are shared with the okta inventory plugin
+MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'module_utils')
+for path in list(C.DEFAULT_MODULE_UTILS_PATH or []) + [MODULE_UTILS]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from okta_plugin import load_okta_client, PluginModule  # noqa: E402
+
+CHUNK_SIZE = 20
+SEARCH_FIELDS = {
+    'users': 'profile.login',
+    'groups': 'profile.name',
+}
+
+
+class LookupModule(LookupBase):
+
+    def search(self, okta, module, client, kind, names):
+        """Every object whose login or name is one of names, with one OR search
+        per chunk of names, or for apps, which cannot be searched by label, a
+        single list of all apps."""
+
+        base_url = okta.okta_base_url(module, kind)
+        limit = 200
+
+        if kind == 'apps':
+            urls = [okta.list_url(module, base_url, limit, {})]
+        else:
+            urls = []
+            for start in range(0, len(names), CHUNK_SIZE):
+                clauses = ['%s eq "%s"' % (SEARCH_FIELDS[kind], name.replace('\\', '\\\\').replace('"', '\\"'))
+                           for name in names[start:start + CHUNK_SIZE]]
+                urls.append(okta.list_url(module, base_url, limit, dict(search=" or ".join(clauses))))
+
+        def fetch(item_module, url):
+            items = []
+            for info, page in client.pages(url, item_module):
+                items.extend(page)
+            return dict(url=url, items=items)
+
+        items = []
+        for result in okta.run_batch(module, fetch, urls, self.get_option('concurrency')):
+            if result['failed']:
+                raise AnsibleError("Okta lookup failed: %s" % result['msg'])
+            items.extend(result['items'])
+
+        return items
+
+    def run(self, terms, variables=None, **kwargs):
+        self.set_options(var_options=variables, direct=kwargs)
+
+        okta = load_okta_client()
+
+        params = dict((name, self.get_option(name)) for name in
+                      ('organization', 'api_url', 'api_key', 'max_retries', 'cache_dir', 'id_cache_ttl'))
+        if not params['organization'] and not params['api_url']:
+            raise AnsibleError("The okta lookup needs organization or api_url")
+
+        kind = self.get_option('kind')
+        module = PluginModule(params)
+        org = okta.okta_base_url(module)
+
+        index = None
+        if okta.HAS_SQLITE and params['id_cache_ttl'] > 0:
+            index = okta.IdIndex(os.path.join(params['cache_dir'], 'ids.sqlite'), params['id_cache_ttl'])
+
+        terms = [to_native(term) for term in self._flatten(terms)]
+
+        def key(name):
+            return name.lower() if kind == 'users' else name
+
+        ids = {}
+        missing = []
+
+        for term in terms:
+            if okta.is_okta_id(term):
+                ids[term] = term
+            else:
+                object_id = index.get(org, kind, key(term)) if index is not None else None
+                if object_id is not None:
+                    ids[term] = object_id
+                elif term not in missing:
+                    missing.append(term)
+
+        if missing:
+            client = okta.OktaClient(None, params['api_key'], pool_size=self.get_option('concurrency'),
+                                     max_retries=params['max_retries'], index=index)
+            items = self.search(okta, module, client, kind, missing)
+            okta.remember_ids(module, client, kind, items)
+
+            found = {}
+            for item in items:
+                found.setdefault(okta.object_name(kind, item), set()).add(item['id'])
+
+            for term in missing:
+                matches = found.get(key(term), set())
+                if len(matches) > 1:
+                    raise AnsibleError("More than one %s %s, use the id instead" % (okta.NAMED_KINDS[kind], term))
+                if not matches:
+                    raise AnsibleError("No %s %s" % (okta.NAMED_KINDS[kind], term))
+                ids[term] = matches.pop()
+
+        return [ids[term] for term in terms]
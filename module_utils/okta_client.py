@@ -0,0 +1,1373 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Shared HTTP client for the Okta modules.
+
+All requests made during one module run go through a single OktaClient, which
+keeps a pool of keep-alive connections per host so that multi-request actions
+(deactivate then delete, paginated lists, bulk operations) reuse the same TLS
+session instead of opening a new one per call.
+"""
+
+import base64
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email.utils import mktime_tz, parsedate_tz
+from multiprocessing.pool import ThreadPool
+
+from ansible.module_utils._text import to_bytes, to_native, to_text
+from ansible.module_utils.six import reraise, string_types
+from ansible.module_utils.six.moves import http_client
+from ansible.module_utils.six.moves.urllib.parse import quote, unquote, urlparse
+from ansible.module_utils.six.moves.urllib.request import getproxies, proxy_bypass
+
+try:
+    import sqlite3
+    HAS_SQLITE = True
+except ImportError:
+    HAS_SQLITE = False
+
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+RETURN_MODES = ['full', 'compact', 'ids', 'none']
+COMPACT_DROP = frozenset(['_links', '_embedded', 'credentials'])
+WRITTEN_OBJECT = re.compile(r'(/api/v1)/(users|groups|apps)(?:/([^/?]+))?$')
+OKTA_ID = re.compile(r'(00u|00g|0oa)[0-9A-Za-z]{17}\Z')
+NAMED_KINDS = {
+    'users': 'user with login',
+    'groups': 'group named',
+    'apps': 'app labelled',
+}
+ESCAPED = re.compile(r'\\.')
+QUOTED = re.compile(r'"[^"]*"')
+SEARCH_OPERATOR = re.compile(r'\s(eq|ne|gt|ge|lt|le|sw|co|ew)\s+\S|\spr(\s|\)|$)', re.IGNORECASE)
+TIMESTAMP = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d+))?(Z|([+-])(\d\d):?(\d\d))?\Z')
+CLIENT_OPTIONS = ('api_key', 'concurrency', 'max_retries', 'cache', 'cache_dir', 'cache_ttl',
+                  'cache_max_entries', 'id_cache_ttl', 'metrics', 'trace_file')
+
+# Set by the persistent worker (okta_worker.py) so clients outlive a module run
+CLIENT_POOL = None
+
+
+def okta_argument_spec():
+    """Options shared by every Okta module."""
+
+    return dict(
+        organization=dict(type='str', default=None),
+        api_url=dict(type='str', default=None),
+        api_key=dict(type='str', no_log=True),
+        max_retries=dict(type='int', default=5),
+        concurrency=dict(type='int', default=10),
+        cache=dict(type='bool', default=False),
+        cache_dir=dict(type='path', default='~/.ansible/okta_cache'),
+        cache_ttl=dict(type='int', default=300),
+        cache_max_entries=dict(type='int', default=1000),
+        id_cache_ttl=dict(type='int', default=86400),
+        return_mode=dict(type='str', default='full', choices=RETURN_MODES),
+        metrics=dict(type='bool', default=False),
+        trace_file=dict(type='path', default=None),
+    )
+
+
+def okta_base_url(module, path=''):
+    """API base URL for the org, from api_url when given or the organization subdomain otherwise."""
+
+    if module.params['api_url']:
+        base_url = module.params['api_url'].rstrip('/') + "/api/v1"
+    else:
+        base_url = "https://%s-admin.okta.com/api/v1" % (module.params['organization'])
+
+    if path:
+        base_url += "/" + path
+
+    return base_url
+
+
+def okta_client(module):
+    """Build the OktaClient for a module run from the shared options, or reuse
+    an idle one built with the same options when running in the persistent worker."""
+
+    params = module.params
+    proxies = None if CLIENT_POOL is None else CLIENT_POOL.proxies()
+
+    def build():
+        cache = None
+        if params['cache']:
+            cache = ResponseCache(params['cache_dir'], params['api_key'],
+                                  params['cache_ttl'], params['cache_max_entries'])
+
+        index = None
+        if HAS_SQLITE and params['id_cache_ttl'] > 0:
+            index = IdIndex(os.path.join(params['cache_dir'], 'ids.sqlite'), params['id_cache_ttl'])
+
+        return OktaClient(module, params['api_key'],
+                          pool_size=params['concurrency'],
+                          max_retries=params['max_retries'],
+                          cache=cache,
+                          index=index,
+                          metrics=params['metrics'],
+                          trace_file=params['trace_file'],
+                          proxies=proxies)
+
+    if CLIENT_POOL is None:
+        return build()
+
+    key = tuple(params[name] for name in CLIENT_OPTIONS) + (tuple(sorted(proxies.items())),)
+    return CLIENT_POOL.checkout(key, module, build)
+
+
+def is_okta_id(value):
+    """Okta object IDs are 20 letters and digits starting with the prefix of
+    their kind, 00u for users, 00g for groups and 0oa for apps, e.g.
+    00u5b3gqiLpE114tV2M7."""
+
+    return OKTA_ID.match(value) is not None
+
+
+def endpoint_template(path):
+    """Collapse object ids and logins in a request path, e.g. /api/v1/users/{id}/lifecycle/activate."""
+
+    segments = []
+    for segment in path.split('?')[0].split('/'):
+        if '@' in segment or is_okta_id(segment):
+            segment = '{id}'
+        segments.append(segment)
+    return '/'.join(segments)
+
+
+def list_url(module, base_url, limit, query):
+    """URL of the first page of a list, passing the non-empty query parameters
+    (q, filter, search, expand) through to Okta so it does the filtering.
+
+    filter and search expressions are checked for balanced quotes and
+    parentheses outside quoted values, where a backslash escapes a quote, and
+    for at least one operator, so an obvious typo fails the task before any
+    request is made rather than with a 400 from Okta.
+    """
+
+    params = [('limit', limit)]
+
+    for key in sorted(query):
+        value = query[key]
+        if value is None or value == '':
+            continue
+        if key in ('filter', 'search'):
+            outside = QUOTED.sub('', ESCAPED.sub('', value))
+            if '"' in outside or outside.count('(') != outside.count(')') or not SEARCH_OPERATOR.search(value):
+                module.fail_json(msg="Invalid %s expression: %s" % (key, value))
+        params.append((key, value))
+
+    return base_url + "/?" + "&".join("%s=%s" % (key, quote(to_bytes(value), safe='')) for key, value in params)
+
+
+def list_all(module, base_url, client, limit, query):
+    """Every item of a list, following the pagination to the last page.
+
+    Returns the status and message of the last page, the items, the URL of the
+    first page and the number of pages read.
+    """
+
+    url = list_url(module, base_url, limit, query)
+
+    results = []
+    pages = 0
+
+    for info, items in client.pages(url, module):
+        results.extend(items)
+        pages += 1
+
+    return info['status'], info['msg'], results, url, pages
+
+
+def project(items, fields):
+    """Keep only the given fields of each object, dotted names reaching into
+    nested dictionaries (e.g. profile.login). Returns items unchanged when no
+    fields are given."""
+
+    if not fields:
+        return items
+
+    projected = []
+
+    for item in items:
+        result = {}
+        for field in fields:
+            keys = field.split('.')
+            source, target = item, result
+            for key in keys[:-1]:
+                source = source.get(key) if isinstance(source, dict) else None
+                if not isinstance(source, dict):
+                    break
+                target = target.setdefault(key, {})
+            else:
+                if isinstance(source, dict) and keys[-1] in source:
+                    target[keys[-1]] = source[keys[-1]]
+        projected.append(result)
+
+    return projected
+
+
+def parse_timestamp(value):
+    """The UTC datetime of an ISO 8601 timestamp such as 2024-05-01T10:00:00.000Z,
+    or None when value is not one."""
+
+    match = TIMESTAMP.match(value) if isinstance(value, string_types) else None
+    if match is None:
+        return None
+
+    fraction = (match.group(7) or '')[:6].ljust(6, '0')
+    stamp = datetime(*[int(part) for part in match.group(1, 2, 3, 4, 5, 6)] + [int(fraction)])
+
+    if match.group(9):
+        offset = timedelta(hours=int(match.group(10)), minutes=int(match.group(11)))
+        stamp = stamp - offset if match.group(9) == '+' else stamp + offset
+
+    return stamp
+
+
+def latest_timestamp(items, since=None):
+    """The newest lastUpdated of items, or since when none is newer. Values are
+    compared as times rather than strings, since Okta drops the milliseconds
+    on some objects, and items without a readable lastUpdated are ignored."""
+
+    latest, latest_time = since, parse_timestamp(since)
+
+    for item in items:
+        stamp = parse_timestamp(item.get('lastUpdated'))
+        if stamp is not None and (latest_time is None or stamp > latest_time):
+            latest, latest_time = item['lastUpdated'], stamp
+
+    return latest
+
+
+def compact(data, mode):
+    """Reduce one Okta object, or a list of them, to what mode asks for: compact
+    drops the _links, _embedded and credentials blocks, ids keeps only the id."""
+
+    if isinstance(data, list):
+        return [compact(item, mode) for item in data]
+    if not isinstance(data, dict) or mode == 'full':
+        return data
+    if mode == 'ids':
+        return data.get('id')
+    return dict((key, value) for key, value in data.items() if key not in COMPACT_DROP)
+
+
+def shape_result(result, mode, keys=('json',)):
+    """Apply return_mode to a module result in place, to the objects under keys
+    and under json in each entry of results. With none they are removed, leaving
+    status, counts and per-entry outcomes."""
+
+    def apply(container, key):
+        if key not in container:
+            return
+        if mode == 'none':
+            del container[key]
+        else:
+            container[key] = compact(container[key], mode)
+
+    if mode != 'full':
+        for key in keys:
+            apply(result, key)
+        for entry in result.get('results') or []:
+            apply(entry, 'json')
+
+    return result
+
+
+def object_name(kind, item):
+    """The login, name or label a user, group or app is referred to by."""
+
+    if kind == 'users':
+        return item['profile']['login'].lower()
+    if kind == 'groups':
+        return item['profile'].get('name')
+    return item.get('label')
+
+
+def remember_ids(module, client, kind, items):
+    """Record the names of listed users, groups or apps in the ID index."""
+
+    if client.index is None:
+        return
+
+    names = {}
+    duplicates = set()
+
+    for item in items:
+        name = object_name(kind, item)
+        if name in names and names[name] != item['id']:
+            duplicates.add(name)
+        names[name] = item['id']
+
+    for name in duplicates:
+        del names[name]
+
+    client.index.put(okta_base_url(module), kind, names)
+
+
+def lookup_id(module, client, kind, value):
+    """Find the ID behind a login, group name or app label with the API. Users are
+    read directly, groups and apps are searched with q, a prefix match, and every
+    object on the result pages is added to the index on the way."""
+
+    base_url = okta_base_url(module, kind)
+
+    if kind == 'users':
+        user = client.get(base_url+"/%s" % quote(to_bytes(value), safe='@'), module)
+        if user is None:
+            return None
+        remember_ids(module, client, kind, [user])
+        return user['id']
+
+    items = []
+    for info, page in client.pages(list_url(module, base_url, 200, dict(q=value)), module):
+        items.extend(page)
+
+    matches = [item['id'] for item in items if object_name(kind, item) == value]
+    if len(matches) > 1:
+        module.fail_json(msg="More than one %s %s, use the id instead" % (NAMED_KINDS[kind], value))
+
+    remember_ids(module, client, kind, items)
+
+    return matches[0] if matches else None
+
+
+def resolve_ids(module, client, kind, values, required=True):
+    """Replace user logins, group names or app labels with object IDs.
+
+    Values that already look like IDs are kept. Others are looked up in the
+    on-disk index and, when missing or older than id_cache_ttl, with the API.
+    Unknown names fail the task when required, or come back as None.
+    """
+
+    if not values:
+        return values
+
+    resolved = []
+
+    for value in values:
+        if value is None or is_okta_id(value):
+            resolved.append(value)
+            continue
+
+        key = value.lower() if kind == 'users' else value
+        object_id = None
+        if client.index is not None:
+            object_id = client.index.get(okta_base_url(module), kind, key)
+        if object_id is None:
+            object_id = lookup_id(module, client, kind, value)
+        if object_id is None and required:
+            module.fail_json(msg="No %s %s" % (NAMED_KINDS[kind], value))
+        resolved.append(object_id)
+
+    return resolved
+
+
+def resolve_id(module, client, kind, value, required=True):
+    """resolve_ids for a single value."""
+
+    if value is None:
+        return None
+
+    return resolve_ids(module, client, kind, [value], required)[0]
+
+
+class OktaError(Exception):
+    pass
+
+
+def proxy_environment(environ):
+    """The proxies set by the *_proxy variables of environ, shaped like the
+    result of urllib's getproxies(). Lower case names win, as in urllib."""
+
+    proxies = {}
+    for name, value in environ.items():
+        if value and name.lower().endswith('_proxy'):
+            proxies.setdefault(name.lower()[:-len('_proxy')], value)
+    for name, value in environ.items():
+        if value and name.endswith('_proxy'):
+            proxies[name[:-len('_proxy')]] = value
+
+    return proxies
+
+
+def bypass_proxy(host, no_proxy):
+    """Whether host matches the comma separated no_proxy list, where a name also
+    matches its subdomains and * matches everything."""
+
+    if no_proxy.strip() == '*':
+        return True
+
+    host = (host or '').lower()
+    for name in no_proxy.split(','):
+        name = name.strip().lstrip('.').lower()
+        if name and (host == name or host.endswith('.' + name)):
+            return True
+
+    return False
+
+
+def proxy_for(scheme, netloc, proxies=None):
+    """The (host, port, headers) of the proxy to reach netloc through, as set by
+    the http_proxy, https_proxy and no_proxy environment variables, or None to
+    connect directly. headers carries Proxy-Authorization when the proxy URL
+    has credentials. proxies, from proxy_environment, replaces the variables of
+    this process."""
+
+    host = urlparse('//' + netloc).hostname
+    if proxies is None:
+        if proxy_bypass(host):
+            return None
+        proxies = getproxies()
+    elif bypass_proxy(host, proxies.get('no', '')):
+        return None
+
+    proxy = proxies.get(scheme)
+    if not proxy:
+        return None
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+
+    parsed = urlparse(proxy)
+    headers = {}
+    if parsed.username is not None:
+        credentials = "%s:%s" % (unquote(parsed.username), unquote(parsed.password or ''))
+        headers['Proxy-Authorization'] = 'Basic %s' % to_native(base64.b64encode(to_bytes(credentials)))
+
+    return parsed.hostname, parsed.port or 80, headers
+
+
+@contextmanager
+def atomic_write(dest, mode='w', opener=open):
+    """Open a temporary file next to dest for writing, renamed over dest once the
+    block completes, so readers never see a partial file. The temporary file is
+    removed when the block fails."""
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)), suffix='.tmp')
+    os.close(fd)
+
+    try:
+        f = opener(tmp, mode)
+        try:
+            yield f
+        finally:
+            f.close()
+        os.rename(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def write_jsonl(module, dest, pages):
+    """Stream the items of (info, items) pages to dest as JSON lines, gzip compressed
+    when dest ends in .gz. Only one page is held in memory at a time. The file is
+    written next to dest and renamed into place once complete.
+
+    Returns the number of items and pages written.
+    """
+
+    dest = os.path.expanduser(dest)
+
+    count = 0
+    page_count = 0
+
+    try:
+        with atomic_write(dest, 'wb', gzip.open if dest.endswith('.gz') else open) as f:
+            for info, items in pages:
+                for item in items:
+                    f.write(to_bytes(json.dumps(item)) + b'\n')
+                count += len(items)
+                page_count += 1
+    except (IOError, OSError) as e:
+        module.fail_json(msg="Unable to write %s: %s" % (dest, to_native(e)))
+
+    return count, page_count
+
+
+def export(module, base_url, client, limit, query, fields, paginate, dest):
+    """Write a list to dest with write_jsonl, its first page or, with paginate
+    all, every page, keeping only fields of each item.
+
+    Returns the URL of the first page and the number of items and pages written.
+    """
+
+    url = list_url(module, base_url, limit, query)
+
+    pages = client.pages(url, module)
+    if paginate != "all":
+        pages = itertools.islice(pages, 1)
+    pages = ((info, project(items, fields)) for info, items in pages)
+
+    count, pages = write_jsonl(module, dest, pages)
+
+    return url, count, pages
+
+
+class BatchItemModule(object):
+    """Stands in for the AnsibleModule while one item of a batch is processed.
+
+    The action helpers report errors with module.fail_json, which would end the
+    whole run; here it raises OktaError so only the current item is marked failed.
+    """
+
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    def fail_json(self, msg, **kwargs):
+        raise OktaError(msg)
+
+
+def run_batch(module, func, items, concurrency):
+    """Call func(item_module, item) for every item on a bounded thread pool.
+
+    Returns one dict per item, in input order: the dict returned by func with
+    failed set to False, or failed and msg when the item raised OktaError.
+    """
+
+    item_module = BatchItemModule(module)
+
+    def worker(item):
+        try:
+            result = func(item_module, item)
+        except OktaError as e:
+            return dict(failed=True, msg=to_native(e))
+        result['failed'] = False
+        return result
+
+    if not items:
+        return []
+
+    pool = ThreadPool(max(1, min(concurrency, len(items))))
+    try:
+        return pool.map(worker, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class TaskGraph(object):
+    """Runs a graph of dependent Okta calls, independent ones concurrently.
+
+    Each task is func(item_module, deps), deps holding the results of the tasks
+    it requires, and returns a dict like the functions given to run_batch. A
+    task starts as soon as everything it requires has succeeded; when one fails
+    its dependents are skipped. Tasks may add further tasks while running, such
+    as one fetch per group once the group list is known.
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.item_module = BatchItemModule(module)
+        self.tasks = {}
+        self.results = {}
+        self._waiting = {}
+        self._ready = []
+        self._running = 0
+        self._error = None
+        self._cond = threading.Condition()
+
+    def add(self, name, func, requires=()):
+        """Add a task, which may only require tasks added before it."""
+
+        with self._cond:
+            if name in self.tasks:
+                raise ValueError("Duplicate task %s" % name)
+            for required in requires:
+                if required not in self.tasks:
+                    raise ValueError("Task %s requires unknown task %s" % (name, required))
+
+            self.tasks[name] = (func, tuple(requires))
+
+            failed = [required for required in requires if self.results.get(required, {}).get('failed')]
+            if failed:
+                self._finish(name, dict(failed=True, skipped=True, msg="Skipped, %s failed" % failed[0]))
+                return
+
+            waiting = set(required for required in requires if required not in self.results)
+            if waiting:
+                self._waiting[name] = waiting
+            else:
+                self._ready.append(name)
+            self._cond.notify_all()
+
+    def _finish(self, name, result):
+        self.results[name] = result
+
+        for other, waiting in list(self._waiting.items()):
+            if name not in waiting:
+                continue
+            if result['failed']:
+                del self._waiting[other]
+                self._finish(other, dict(failed=True, skipped=True, msg="Skipped, %s failed" % name))
+                continue
+            waiting.discard(name)
+            if not waiting:
+                del self._waiting[other]
+                self._ready.append(other)
+
+    def _run_task(self, name):
+        func, requires = self.tasks[name]
+        deps = dict((required, self.results[required]) for required in requires)
+
+        try:
+            try:
+                result = func(self.item_module, deps)
+                result['failed'] = False
+            except OktaError as e:
+                result = dict(failed=True, msg=to_native(e))
+        except Exception:
+            with self._cond:
+                self._error = sys.exc_info()
+                self._running -= 1
+                self._cond.notify_all()
+            return
+
+        with self._cond:
+            self._finish(name, result)
+            self._running -= 1
+            self._cond.notify_all()
+
+    def run(self, concurrency):
+        """Run every task, returning the results keyed by task name."""
+
+        pool = ThreadPool(max(1, concurrency))
+        try:
+            with self._cond:
+                while self._error is None:
+                    while self._ready and self._running < concurrency:
+                        self._running += 1
+                        pool.apply_async(self._run_task, (self._ready.pop(0),))
+                    if not self._running:
+                        break
+                    self._cond.wait()
+        finally:
+            pool.close()
+            pool.join()
+
+        if self._error is not None:
+            reraise(*self._error)
+
+        return self.results
+
+
+class OktaResponse(object):
+    """Fully read response, exposing the read()/info() pair modules expect from fetch_url."""
+
+    def __init__(self, body, headers):
+        self.body = body
+        self.headers = headers
+
+    def read(self):
+        return self.body
+
+    def info(self):
+        return self.headers
+
+
+class CachedHeaders(object):
+    """Minimal stand-in for the headers of a cached response, enough for next_link()."""
+
+    def __init__(self, links):
+        self.links = links
+
+    def get_all(self, name, failobj=None):
+        if name.lower() == 'link':
+            return self.links
+        return failobj
+
+
+def link_headers(response, info):
+
+    try:
+        return response.info().get_all('Link') or []
+    except AttributeError:
+        try:
+            return response.info().getheaders('Link')
+        except AttributeError:
+            return [info.get('link', '')]
+
+
+def next_link(response, info):
+
+    links = link_headers(response, info)
+
+    for link, rel in re.findall(r'<([^>]+)>\s*;\s*rel="([^"]+)"', ', '.join(links)):
+        if rel == "next":
+            return link
+
+    return None
+
+
+class ResponseCache(object):
+    """On-disk cache of GET responses, one JSON file per URL.
+
+    Entries are keyed by the API key and full URL (which includes the org), are
+    served without a request while younger than ttl seconds, and are revalidated
+    with If-None-Match afterwards when Okta supplied an ETag. The directory is
+    kept to max_entries files by evicting the least recently used ones.
+    """
+
+    def __init__(self, path, api_key, ttl, max_entries):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.namespace = hashlib.sha256(to_bytes(api_key or '')).hexdigest()
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, 0o700)
+
+    def _file(self, url):
+        return os.path.join(self.path, hashlib.sha256(to_bytes(self.namespace + url)).hexdigest() + '.json')
+
+    def _entries(self):
+        return [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.json')]
+
+    def get(self, url):
+        path = self._file(url)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return entry
+
+    def fresh(self, entry):
+        return time.time() - entry['stored'] < self.ttl
+
+    def put(self, url, body, links, etag):
+        entry = dict(url=url, stored=time.time(), body=to_text(body, encoding='UTF-8'), links=links, etag=etag)
+
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.rename(tmp, self._file(url))
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        self._evict()
+
+    def _evict(self):
+        entries = self._entries()
+        if len(entries) <= self.max_entries:
+            return
+
+        def mtime(path):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                return 0
+
+        for path in sorted(entries, key=mtime)[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class IdIndex(object):
+    """SQLite index of user logins, group names and app labels to object IDs,
+    shared by every task run on the host.
+
+    Rows are keyed by org, kind and name. Rows older than ttl seconds are
+    ignored and replaced by the next lookup. Writing an object replaces its
+    rows with the name it comes back with, or drops them when deleting it. The
+    index is only an optimisation, so database errors (a locked or read-only
+    file) are treated as misses.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            dirname = os.path.dirname(self.path)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname, 0o700)
+            db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            db.execute("CREATE TABLE IF NOT EXISTS ids (org TEXT, kind TEXT, name TEXT, id TEXT, stored REAL, "
+                       "PRIMARY KEY (org, kind, name))")
+            db.execute("CREATE INDEX IF NOT EXISTS ids_by_id ON ids (id)")
+            db.commit()
+            self._db = db
+        return self._db
+
+    def get(self, org, kind, name):
+        with self._lock:
+            try:
+                row = self._connect().execute("SELECT id FROM ids WHERE org = ? AND kind = ? AND name = ? AND stored > ?",
+                                              (org, kind, name, time.time() - self.ttl)).fetchone()
+            except (sqlite3.Error, OSError):
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return to_native(row[0])
+
+    def put(self, org, kind, names):
+        stored = time.time()
+        with self._lock:
+            try:
+                db = self._connect()
+                db.executemany("INSERT OR REPLACE INTO ids VALUES (?, ?, ?, ?, ?)",
+                               [(org, kind, name, object_id, stored) for name, object_id in names.items()])
+                db.commit()
+            except (sqlite3.Error, OSError):
+                pass
+
+    def forget(self, object_id):
+        with self._lock:
+            try:
+                db = self._connect()
+                db.execute("DELETE FROM ids WHERE id = ?", (object_id,))
+                db.commit()
+            except (sqlite3.Error, OSError):
+                pass
+
+
+class ClientPool(object):
+    """Idle OktaClients kept between module runs by the persistent worker.
+
+    A run checks out a client built with the same options, or builds one, and
+    the worker returns every client a thread checked out once its module exits.
+    """
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self, environ):
+        """Begin a module run in this thread with the task's environment, whose
+        proxy variables pick the clients it checks out."""
+
+        self._local.proxies = proxy_environment(environ)
+
+    def proxies(self):
+        proxies = getattr(self._local, 'proxies', None)
+        if proxies is None:
+            proxies = proxy_environment(os.environ)
+        return proxies
+
+    def checkout(self, key, module, build):
+        with self._lock:
+            idle = self._idle.get(key)
+            client = idle.pop() if idle else None
+
+        if client is None:
+            client = build()
+        else:
+            client.reset(module)
+
+        if not hasattr(self._local, 'borrowed'):
+            self._local.borrowed = []
+        self._local.borrowed.append((key, client))
+
+        return client
+
+    def release(self):
+        borrowed = getattr(self._local, 'borrowed', [])
+        self._local.borrowed = []
+        self._local.proxies = None
+
+        with self._lock:
+            for key, client in borrowed:
+                self._idle.setdefault(key, []).append(client)
+
+
+class OktaClient(object):
+
+    def __init__(self, module, api_key, timeout=30, pool_size=10, max_retries=5, cache=None, index=None,
+                 metrics=False, trace_file=None, proxies=None):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.cache = cache
+        self.index = index
+        self.collect_metrics = metrics
+        self.trace_file = trace_file
+        self._idle = {}
+        self._limits = {}
+        self._lock = threading.Lock()
+        self._context = None
+        self.proxies = proxies
+        self._proxies = {}
+        self.reset(module)
+
+    def reset(self, module):
+        """Start a new module run, zeroing the per-run counters. Pooled connections,
+        the TLS context and the rate limit state carry over."""
+
+        self.module = module
+        self.requests = 0
+        self.retries = 0
+        self.wait_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.metrics = []
+        self.trace_error = None
+        if self.index is not None:
+            self.index.hits = 0
+            self.index.misses = 0
+
+    def headers(self):
+        return {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': 'SSWS %s' % (self.api_key),
+            'User-Agent': 'ansible-okta-modules',
+        }
+
+    def fail(self, msg, module=None):
+        """Report an error through module.fail_json when a module is given,
+        otherwise raise OktaError. Never falls back to the client's own module:
+        from a worker thread its fail_json would exit the thread and leave the
+        pool waiting forever."""
+
+        if module is not None:
+            module.fail_json(msg=msg)
+        raise OktaError(msg)
+
+    def _proxy(self, key):
+        if key not in self._proxies:
+            self._proxies[key] = proxy_for(key[0], key[1], self.proxies)
+        return self._proxies[key]
+
+    def _connect(self, scheme, netloc):
+        """A new connection to netloc, or to the proxy for it. HTTPS goes through
+        the proxy in a CONNECT tunnel, plain HTTP requests are sent to the proxy
+        with the absolute URL (see _send)."""
+
+        proxy = self._proxy((scheme, netloc))
+        host, port = netloc, None
+        if proxy is not None:
+            host, port = proxy[:2]
+
+        if scheme == 'http':
+            return http_client.HTTPConnection(host, port, timeout=self.timeout)
+
+        if not hasattr(ssl, 'create_default_context'):
+            conn = http_client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            # Loading the CA bundle is slow, only do it once a TLS connection is needed
+            if self._context is None:
+                self._context = ssl.create_default_context()
+            conn = http_client.HTTPSConnection(host, port, timeout=self.timeout, context=self._context)
+
+        if proxy is not None:
+            target = urlparse('//' + netloc)
+            conn.set_tunnel(target.hostname, target.port or 443, proxy[2])
+        return conn
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(*key), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+
+    def _open(self, conn, timing):
+        """Connect a new connection step by step, so that name resolution, the
+        TCP connect and the TLS handshake are timed separately."""
+
+        start = time.time()
+
+        tunnelled = getattr(conn, '_tunnel_host', None)
+        if isinstance(conn, http_client.HTTPSConnection) and (self._context is None or tunnelled):
+            conn.connect()
+            timing['connect'] = time.time() - start
+            return
+
+        address = socket.getaddrinfo(conn.host, conn.port, 0, socket.SOCK_STREAM)[0][4]
+        resolved = time.time()
+
+        sock = socket.create_connection(address[:2], self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connected = time.time()
+
+        if isinstance(conn, http_client.HTTPSConnection):
+            try:
+                sock = self._context.wrap_socket(sock, server_hostname=conn.host)
+            except Exception:
+                sock.close()
+                raise
+        conn.sock = sock
+
+        timing.update(dns=resolved - start, connect=connected - resolved, tls=time.time() - connected)
+
+    def _exchange(self, conn, reused, method, path, data, headers, timing):
+        if timing is None:
+            conn.request(method, path, body=data, headers=headers)
+            resp = conn.getresponse()
+            return resp, resp.read()
+
+        timing.update(dns=0.0, connect=0.0, tls=0.0, ttfb=0.0, reused=reused)
+        if not reused:
+            self._open(conn, timing)
+
+        start = time.time()
+        conn.request(method, path, body=data, headers=headers)
+        resp = conn.getresponse()
+        timing['ttfb'] = time.time() - start
+
+        return resp, resp.read()
+
+    def _send(self, key, method, path, data, headers, timing=None):
+        proxy = self._proxy(key)
+        if proxy is not None and key[0] == 'http':
+            path = "%s://%s%s" % (key[0], key[1], path)
+            headers = dict(headers, **proxy[2])
+
+        conn, reused = self._acquire(key)
+        try:
+            resp, body = self._exchange(conn, reused, method, path, data, headers, timing)
+        except (socket.error, http_client.HTTPException):
+            conn.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive connection, retry once on a fresh one.
+            conn = self._connect(*key)
+            try:
+                resp, body = self._exchange(conn, False, method, path, data, headers, timing)
+            except Exception:
+                conn.close()
+                raise
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+
+        return resp, body
+
+    def _sleep(self, delay):
+        if delay <= 0:
+            return 0.0
+        with self._lock:
+            self.wait_time += delay
+        time.sleep(delay)
+        return delay
+
+    def _pace(self, bucket):
+        """Spread the remaining rate limit budget of an endpoint over the time left
+        until it resets. Returns the seconds waited."""
+
+        with self._lock:
+            limit = self._limits.get(bucket)
+            if limit is None:
+                return 0.0
+            remaining, total, reset = limit
+            self._limits[bucket] = (remaining - 1, total, reset)
+
+        now = time.time()
+        if reset <= now:
+            return 0.0
+        if remaining <= 0:
+            return self._sleep(reset - now)
+        if remaining < max(total // 10, 1):
+            return self._sleep((reset - now) / (remaining + 1))
+        return 0.0
+
+    def _record_limits(self, bucket, resp):
+        try:
+            remaining = int(resp.getheader('X-Rate-Limit-Remaining'))
+            total = int(resp.getheader('X-Rate-Limit-Limit'))
+            reset = int(resp.getheader('X-Rate-Limit-Reset'))
+        except (TypeError, ValueError):
+            return None
+
+        # Reset is an epoch timestamp on Okta's clock, convert it to ours using the Date header.
+        server_now = time.time()
+        date = parsedate_tz(resp.getheader('Date') or '')
+        if date is not None:
+            server_now = mktime_tz(date)
+        reset = time.time() + max(reset - server_now, 0)
+
+        with self._lock:
+            self._limits[bucket] = (remaining, total, reset)
+
+        return reset
+
+    def _backoff(self, attempt):
+        return min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def fetch(self, url, method='GET', data=None, headers=None):
+        """Perform one request, returning (response, info) in the same shape as fetch_url.
+
+        When a cache is configured, GET requests are answered from it while fresh
+        and revalidated with If-None-Match once stale. Any successful write
+        empties the cache, since it may have changed what the cached URLs return.
+        Writing a user, group or app also updates the ID index, see reindex().
+        """
+
+        if self.cache is None or method != 'GET':
+            response, info = self._fetch(url, method, data, headers)
+            if 200 <= info['status'] < 300:
+                if self.cache is not None:
+                    self.cache.clear()
+                if self.index is not None:
+                    self.reindex(url, method, response)
+            return response, info
+
+        entry = self.cache.get(url)
+
+        if entry is not None and self.cache.fresh(entry):
+            self._count_cache(True)
+            return self._cached(entry)
+
+        request_headers = dict(headers or {})
+        if entry is not None and entry.get('etag'):
+            request_headers['If-None-Match'] = entry['etag']
+
+        response, info = self._fetch(url, method, data, request_headers)
+
+        if info['status'] == 304 and entry is not None:
+            self.cache.put(url, entry['body'], entry['links'], entry['etag'])
+            self._count_cache(True)
+            return self._cached(entry)
+
+        self._count_cache(False)
+
+        if info['status'] == 200:
+            self.cache.put(url, response.read(), link_headers(response, info), info.get('etag'))
+
+        return response, info
+
+    def reindex(self, url, method, response):
+        """Keep the ID index in step with a successful write to a user, group or
+        app: its old name is forgotten, since an update may have renamed it,
+        and the name of the object returned by a create or update is stored."""
+
+        parsed = urlparse(url)
+        written = WRITTEN_OBJECT.search(parsed.path)
+        if written is None:
+            return
+
+        kind, object_id = written.group(2), written.group(3)
+        if object_id is not None:
+            self.index.forget(object_id)
+
+        if method == 'DELETE':
+            return
+
+        try:
+            item = json.loads(to_text(response.read(), encoding='UTF-8'))
+            name = object_name(kind, item)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return
+
+        if name and item.get('id'):
+            org = "%s://%s%s" % (parsed.scheme, parsed.netloc, parsed.path[:written.end(1)])
+            self.index.put(org, kind, {name: item['id']})
+
+    def stats(self):
+        """Per-run counters merged into every module result."""
+
+        stats = dict(retries=self.retries, rate_limit_wait=round(self.wait_time, 3))
+        if self.cache is not None:
+            stats['cache'] = dict(hits=self.cache_hits, misses=self.cache_misses)
+        if self.index is not None and self.index.hits + self.index.misses:
+            stats['id_cache'] = dict(hits=self.index.hits, misses=self.index.misses)
+        if self.collect_metrics:
+            stats['metrics'] = list(self.metrics)
+        if self.trace_error is not None:
+            stats['warnings'] = [self.trace_error]
+        return stats
+
+    def _count_cache(self, hit):
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def _cached(self, entry):
+        info = dict(url=entry['url'], status=200, msg="OK (cached)", link=', '.join(entry['links']))
+        if entry.get('etag'):
+            info['etag'] = entry['etag']
+        return OktaResponse(to_bytes(entry['body'], encoding='UTF-8'), CachedHeaders(entry['links'])), info
+
+    def _fetch(self, url, method='GET', data=None, headers=None):
+        """Send a request, pacing it using Okta's X-Rate-Limit headers and retrying
+        with jittered backoff on 429 responses and on 5xx errors for idempotent methods.
+        """
+
+        parsed = urlparse(url)
+        key = (parsed.scheme, parsed.netloc)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        bucket = (method, endpoint_template(parsed.path))
+
+        request_headers = self.headers()
+        if headers:
+            request_headers.update(headers)
+        if data is not None:
+            data = to_bytes(data)
+
+        attempt = 0
+
+        started = time.time()
+        wait = 0.0
+        timing = {} if self.collect_metrics or self.trace_file is not None else None
+
+        while True:
+            info = dict(url=url)
+            wait += self._pace(bucket)
+
+            with self._lock:
+                self.requests += 1
+
+            try:
+                resp, body = self._send(key, method, path, data, request_headers, timing)
+            except (socket.error, http_client.HTTPException) as e:
+                info.update(dict(status=-1, msg="Request failed: %s" % to_native(e), body=''))
+                if attempt < self.max_retries and method in IDEMPOTENT_METHODS:
+                    attempt += 1
+                    wait += self._retried(self._backoff(attempt))
+                    continue
+                if timing is not None:
+                    self._measure(method, bucket, -1, None, timing, attempt, wait, started)
+                return None, info
+
+            reset = self._record_limits(bucket, resp)
+
+            if attempt < self.max_retries:
+                if resp.status == 429:
+                    attempt += 1
+                    if reset is not None:
+                        wait += self._retried(min(max(reset - time.time(), 0), 120.0) + random.uniform(0, 1.0))
+                    else:
+                        wait += self._retried(self._backoff(attempt))
+                    continue
+                if resp.status in RETRY_STATUSES and method in IDEMPOTENT_METHODS:
+                    attempt += 1
+                    wait += self._retried(self._backoff(attempt))
+                    continue
+
+            if timing is not None:
+                self._measure(method, bucket, resp.status, body, timing, attempt, wait, started)
+
+            break
+
+        info.update(dict((k.lower(), v) for k, v in resp.getheaders()))
+        info['status'] = resp.status
+
+        if resp.status >= 400:
+            info['msg'] = "HTTP Error %s: %s" % (resp.status, resp.reason)
+            info['body'] = body
+        else:
+            info['msg'] = "OK (%s bytes)" % (info.get('content-length', 'unknown'))
+
+        return OktaResponse(body, resp.msg), info
+
+    def _retried(self, delay):
+        with self._lock:
+            self.retries += 1
+        return self._sleep(delay)
+
+    def _measure(self, method, bucket, status, body, timing, retries, wait, started):
+        """Record one request, retries included, for the metrics result key and
+        the trace file. Timings are in seconds, those of the connection and
+        time to first byte are for the last attempt."""
+
+        record = dict(method=method, endpoint=bucket[1], status=status, bytes=len(body or b''),
+                      retries=retries, wait=round(wait, 4), total=round(time.time() - started, 4))
+        for phase in ('dns', 'connect', 'tls', 'ttfb'):
+            record[phase] = round(timing.get(phase, 0.0), 4)
+        record['reused'] = timing.get('reused', False)
+
+        with self._lock:
+            if self.collect_metrics:
+                self.metrics.append(record)
+            if self.trace_file is not None and self.trace_error is None:
+                line = dict(record, time=round(started, 3), module=getattr(self.module, '_name', None))
+                try:
+                    with open(self.trace_file, 'a') as f:
+                        f.write(json.dumps(line, sort_keys=True) + '\n')
+                except (IOError, OSError) as e:
+                    self.trace_error = "Unable to write trace file %s: %s" % (self.trace_file, to_native(e))
+
+    def get(self, url, module=None):
+        """Read one object, returning None when it does not exist."""
+
+        response, info = self.fetch(url)
+
+        if info['status'] == 404:
+            return None
+
+        if info['status'] != 200:
+            self.fail("Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])), module)
+
+        return json.loads(to_text(response.read(), encoding='UTF-8'))
+
+    def pages(self, url, module=None):
+        """Yield (info, items) for every page of a collection, following the Link header cursor.
+
+        Errors are reported through module.fail_json when a module is given (such
+        as the BatchItemModule of a worker thread), or raised as OktaError.
+        """
+
+        next_url = url
+
+        while next_url:
+            response, info = self.fetch(next_url)
+
+            if info['status'] != 200:
+                self.fail("Fail: %s" % ( "Status: "+str(info['msg']) + ", Message: " + str(info['body'])), module)
+
+            yield info, json.loads(to_text(response.read(), encoding='UTF-8'))
+
+            next_url = next_link(response, info)
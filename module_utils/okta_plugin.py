@@ -0,0 +1,57 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Controller side helpers shared by the okta lookup and inventory plugins, which
+import this file from the module_utils directories rather than shipping it to
+a host.
+"""
+
+import os
+import sys
+
+from ansible import constants as C
+from ansible.errors import AnsibleError
+
+CLIENT_MODULE = 'ansible_okta_client'
+
+
+def load_okta_client():
+    """Import module_utils/okta_client.py from the configured module_utils paths
+    or the directory of this file, once per controller process."""
+
+    if CLIENT_MODULE in sys.modules:
+        return sys.modules[CLIENT_MODULE]
+
+    candidates = list(C.DEFAULT_MODULE_UTILS_PATH or [])
+    candidates.append(os.path.dirname(os.path.realpath(__file__)))
+
+    for path in candidates:
+        source = os.path.join(path, 'okta_client.py')
+        if os.path.exists(source):
+            break
+    else:
+        raise AnsibleError("okta_client.py not found in %s" % ", ".join(candidates))
+
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:
+        import imp
+        return imp.load_source(CLIENT_MODULE, source)
+
+    spec = spec_from_file_location(CLIENT_MODULE, source)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[CLIENT_MODULE] = module
+    return module
+
+
+class PluginModule(object):
+    """Just enough of an AnsibleModule for the okta_client helpers."""
+
+    check_mode = False
+
+    def __init__(self, params):
+        self.params = params
+
+    def fail_json(self, msg, **kwargs):
+        raise AnsibleError(msg)
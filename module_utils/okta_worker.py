@@ -0,0 +1,286 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Persistent worker that runs the Okta modules in-process.
+
+Started by the okta action plugins when okta_persistent_worker is set. It
+listens on a unix socket and runs each task's module in a thread of this
+process, so Ansible and the modules are imported once and the OktaClients, with
+their keep-alive connections, rate limit state and ID index, are reused across
+tasks instead of being rebuilt by a new interpreter for every task. The worker
+exits after idle_timeout seconds without a task.
+
+    python okta_worker.py SOCKET MODULE_UTILS_DIR IDLE_TIMEOUT
+
+The interpreter needs Ansible importable and must be able to compile the
+modules, which are written for Python 2; a module it cannot compile fails its
+task with a message saying so.
+
+Each connection carries one task: a JSON line with module_path, args and the
+task's environment, answered with a JSON line holding the module's stdout. The
+proxy variables of the environment apply to the task's clients only; the action
+plugin runs tasks setting any other variable the usual way.
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+
+def load_source(name, path):
+    """Import a file as module name, like the removed imp.load_source."""
+
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class ThreadOutput(object):
+    """Stands in for sys.stdout, giving each task thread its own buffer so the
+    result printed by exit_json or fail_json goes back to the right task."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, data):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            self.stream.write(data)
+        else:
+            buffer.append(data)
+
+    def flush(self):
+        pass
+
+    def capture(self):
+        self.local.buffer = []
+
+    def release(self):
+        output = ''.join(self.local.buffer)
+        self.local.buffer = None
+        return output
+
+
+class ThreadCollection(object):
+    """Stands in for a module level list or dict, giving each thread its own.
+
+    ansible-base 2.10 and later collect warnings and deprecations in such
+    globals, which are never emptied as a module normally runs once per process.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.local = threading.local()
+
+    def current(self):
+        value = getattr(self.local, 'value', None)
+        if value is None:
+            value = self.local.value = self.factory()
+        return value
+
+    def reset(self):
+        self.local.value = self.factory()
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
+
+    def __iter__(self):
+        return iter(self.current())
+
+    def __len__(self):
+        return len(self.current())
+
+    def __contains__(self, item):
+        return item in self.current()
+
+    def __getitem__(self, key):
+        return self.current()[key]
+
+    def __setitem__(self, key, value):
+        self.current()[key] = value
+
+    def __delitem__(self, key):
+        del self.current()[key]
+
+
+class Worker(object):
+
+    def __init__(self, path, module_utils, idle_timeout):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.active = 0
+        self.last_task = time.time()
+        self.modules = {}
+        self._lock = threading.Lock()
+        self._args_lock = threading.Lock()
+        self._args = threading.local()
+
+        import ansible.module_utils
+        from ansible.module_utils import basic
+
+        self.okta_client = load_source('ansible.module_utils.okta_client',
+                                       os.path.join(module_utils, 'okta_client.py'))
+        self.okta_client.CLIENT_POOL = self.okta_client.ClientPool()
+
+        # AnsibleModule reads its arguments from a module global, hand each
+        # thread its own while it is being constructed
+        self.basic = basic
+        self._load_params = basic._load_params
+        basic._load_params = self.load_params
+
+        # ansible-core 2.19 and later decode the arguments and encode the
+        # result with the serialization profile AnsiballZ would have set
+        if hasattr(basic, '_ANSIBLE_PROFILE'):
+            basic._ANSIBLE_PROFILE = 'legacy'
+
+        # Keep each task's warnings and deprecations out of the other results
+        self.collections = []
+        try:
+            from ansible.module_utils.common import warnings
+        except ImportError:
+            warnings = None
+        for name in ('_global_warnings', '_global_deprecations'):
+            if hasattr(warnings, name):
+                collection = ThreadCollection(type(getattr(warnings, name)))
+                setattr(warnings, name, collection)
+                self.collections.append(collection)
+
+        self.output = ThreadOutput(sys.stdout)
+        sys.stdout = self.output
+
+    def load_params(self):
+        with self._args_lock:
+            self.basic._ANSIBLE_ARGS = self._args.value
+            try:
+                return self._load_params()
+            finally:
+                self.basic._ANSIBLE_ARGS = None
+
+    def load_module(self, path):
+        """Import a module once, and again whenever its file changes."""
+
+        mtime = os.path.getmtime(path)
+
+        with self._lock:
+            loaded = self.modules.get(path)
+            if loaded is None or loaded[0] != mtime:
+                name = 'okta_worker_' + os.path.splitext(os.path.basename(path))[0]
+                loaded = (mtime, load_source(name, path))
+                self.modules[path] = loaded
+
+        return loaded[1]
+
+    def run_task(self, request):
+        args = request['args']
+
+        # The controller may run a newer Ansible than this interpreter, whose
+        # AnsibleModule rejects internal options it does not know
+        known = getattr(self.basic, 'PASS_VARS', None)
+        if known is not None:
+            args = dict((key, value) for key, value in args.items()
+                        if not key.startswith('_ansible_') or key[len('_ansible_'):] in known)
+
+        self._args.value = json.dumps({'ANSIBLE_MODULE_ARGS': args}).encode('utf-8')
+
+        environ = dict(os.environ)
+        environ.update(request.get('environment') or {})
+        self.okta_client.CLIENT_POOL.start(environ)
+
+        for collection in self.collections:
+            collection.reset()
+
+        try:
+            module = self.load_module(request['module_path'])
+        except SyntaxError as e:
+            msg = ("%s cannot be compiled by the Python %s running the Okta persistent worker (%s), set "
+                   "okta_persistent_worker_python to an interpreter the module supports"
+                   % (os.path.basename(request['module_path']), sys.version.split()[0], e))
+            return dict(stdout=json.dumps(dict(failed=True, msg=msg)))
+
+        self.output.capture()
+
+        try:
+            module.main()
+        except SystemExit:
+            pass
+        except Exception:
+            return dict(stdout=self.output.release(), exception=traceback.format_exc())
+        finally:
+            self.okta_client.CLIENT_POOL.release()
+
+        return dict(stdout=self.output.release())
+
+    def handle(self, conn):
+        try:
+            f = conn.makefile('rb')
+            try:
+                request = json.loads(f.readline().decode('utf-8'))
+            finally:
+                f.close()
+            response = self.run_task(request)
+            conn.sendall(json.dumps(response).encode('utf-8') + b'\n')
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+        finally:
+            conn.close()
+            with self._lock:
+                self.active -= 1
+                self.last_task = time.time()
+
+    def serve(self):
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.inode = os.stat(self.path).st_ino
+        server.listen(128)
+        server.settimeout(1.0)
+
+        try:
+            while True:
+                try:
+                    conn, address = server.accept()
+                except socket.timeout:
+                    with self._lock:
+                        if not self.active and time.time() - self.last_task > self.idle_timeout:
+                            break
+                    continue
+
+                conn.settimeout(None)
+                with self._lock:
+                    self.active += 1
+
+                thread = threading.Thread(target=self.handle, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            server.close()
+            # A worker started after this one may already own the path
+            try:
+                if os.stat(self.path).st_ino == self.inode:
+                    os.remove(self.path)
+            except OSError:
+                pass
+
+
+def main():
+    path, module_utils, idle_timeout = sys.argv[1], sys.argv[2], float(sys.argv[3])
+
+    worker = Worker(path, module_utils, idle_timeout)
+    worker.serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import json
+import os
+import unittest
+
+from ansible.inventory.data import InventoryData
+from ansible.parsing.dataloader import DataLoader
+from ansible.plugins.loader import inventory_loader
+
+from helpers import ROOT, bench, OktaMockTestCase
+
+inventory_loader.add_directory(os.path.join(ROOT, 'inventory_plugins'))
+
+
+class InventorySnapshotTest(OktaMockTestCase):
+
+    def setUp(self):
+        super(InventorySnapshotTest, self).setUp()
+        self.snapshot = os.path.join(self.tmp, 'snapshot.json')
+        self.config = os.path.join(self.tmp, 'okta.yml')
+        with open(self.config, 'w') as f:
+            json.dump(dict(plugin='okta', api_url=self.api_url, api_key=bench.API_KEY, snapshot=self.snapshot,
+                           max_retries=0), f)
+
+    def parse(self):
+        inventory = InventoryData()
+        inventory_loader.get('okta').parse(inventory, DataLoader(), self.config, cache=False)
+        return inventory
+
+    def saved(self):
+        with open(self.snapshot) as f:
+            return json.load(f)
+
+    def test_members_become_hosts(self):
+        inventory = self.parse()
+
+        with self.org.lock:
+            members = set()
+            for group_id in self.org.groups:
+                members.update(self.org.members[group_id])
+            logins = sorted(self.org.users[user_id]['profile']['login'] for user_id in members)
+            latest = max(self.org.users[user_id]['lastUpdated'] for user_id in members)
+
+        self.assertEqual(sorted(inventory.hosts), logins)
+        self.assertEqual(self.saved()['lastUpdated'], latest)
+
+    def test_refresh_only_reads_what_changed(self):
+        self.parse()
+        group_id = self.group_ids()[0]
+        with self.org.lock:
+            user_id = sorted(self.org.members[group_id])[0]
+            user = self.org.users[user_id]
+            user['profile']['title'] = 'Changed'
+            user['lastUpdated'] = '2999-01-01T00:00:00.000Z'
+
+        before = self.org.requests
+        inventory = self.parse()
+
+        # The group list and the users updated since the snapshot, no members
+        self.assertEqual(self.org.requests, before + 2)
+        host = inventory.get_host(user['profile']['login'])
+        self.assertEqual(host.vars['okta_profile']['title'], 'Changed')
+        self.assertEqual(self.saved()['lastUpdated'], '2999-01-01T00:00:00.000Z')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import unittest
+
+from helpers import OktaMockTestCase
+
+
+class SyncMembersTest(OktaMockTestCase):
+
+    def setUp(self):
+        super(SyncMembersTest, self).setUp()
+        self.group_id = self.group_ids()[0]
+        with self.org.lock:
+            self.current = sorted(self.org.members[self.group_id])
+        others = [user_id for user_id in self.user_ids() if user_id not in self.current]
+        self.wanted = self.current[:3] + others[:2]
+
+    def members(self):
+        with self.org.lock:
+            return sorted(self.org.members[self.group_id])
+
+    def test_only_the_difference_is_written(self):
+        result = self.run_module('okta_groups', action='sync_members', id=self.group_id, user_ids=self.wanted)
+
+        self.assertFalse(result.get('failed'), result.get('msg'))
+        self.assertTrue(result['changed'])
+        self.assertEqual(sorted(result['added']), sorted(self.wanted[3:]))
+        self.assertEqual(sorted(result['removed']), sorted(self.current[3:]))
+        self.assertEqual(self.members(), sorted(self.wanted))
+
+    def test_a_second_run_changes_nothing(self):
+        self.run_module('okta_groups', action='sync_members', id=self.group_id, user_ids=self.wanted)
+        before = self.org.requests
+        result = self.run_module('okta_groups', action='sync_members', id=self.group_id, user_ids=self.wanted)
+
+        self.assertFalse(result['changed'])
+        self.assertEqual(result['results'], [])
+        self.assertEqual(self.org.requests, before + 1)
+
+    def test_check_mode_reports_without_writing(self):
+        result = self.run_module('okta_groups', action='sync_members', id=self.group_id, user_ids=self.wanted,
+                                 _ansible_check_mode=True)
+
+        self.assertTrue(result['changed'])
+        self.assertEqual(len(result['results']), 4)
+        self.assertEqual(self.members(), self.current)
+
+    def test_failed_changes_fail_the_task_and_keep_the_rest(self):
+        removed = self.current[3]
+        self.fail_requests(lambda method, path: method == 'DELETE' and removed in path)
+
+        result = self.run_module('okta_groups', action='sync_members', id=self.group_id, user_ids=self.wanted,
+                                 max_retries=0)
+
+        self.assertTrue(result['failed'])
+        self.assertEqual(result['msg'], "1 of 4 membership changes failed")
+        self.assertEqual(sorted(result['added']), sorted(self.wanted[3:]))
+        self.assertEqual(result['removed'], [self.current[4]])
+
+
+class MembershipCheckModeTest(OktaMockTestCase):
+
+    def setUp(self):
+        super(MembershipCheckModeTest, self).setUp()
+        self.group_id = self.group_ids()[0]
+        with self.org.lock:
+            self.members = sorted(self.org.members[self.group_id])
+        self.other = [user_id for user_id in self.user_ids() if user_id not in self.members][0]
+
+    def check(self, action, user_id):
+        result = self.run_module('okta_groups', action=action, id=self.group_id, user_id=user_id,
+                                 _ansible_check_mode=True)
+        self.assertFalse(result.get('failed'), result.get('msg'))
+        return result['changed']
+
+    def test_only_membership_changes_are_reported(self):
+        self.assertFalse(self.check('add_user', self.members[0]))
+        self.assertTrue(self.check('add_user', self.other))
+        self.assertTrue(self.check('remove_user', self.members[0]))
+        self.assertFalse(self.check('remove_user', self.other))
+
+        with self.org.lock:
+            self.assertEqual(sorted(self.org.members[self.group_id]), self.members)
+
+
+class SyncAssignmentsTest(OktaMockTestCase):
+
+    def setUp(self):
+        super(SyncAssignmentsTest, self).setUp()
+        self.app_id = self.app_ids()[0]
+        users, groups = self.user_ids(), self.group_ids()
+        with self.org.lock:
+            self.org.app_users[self.app_id] = {
+                users[0]: dict(id=users[0], scope='USER'),
+                users[1]: dict(id=users[1], scope='USER'),
+                users[2]: dict(id=users[2], scope='GROUP'),
+            }
+            self.org.app_groups[self.app_id] = {
+                groups[0]: dict(id=groups[0], priority=0),
+                groups[1]: dict(id=groups[1], priority=1),
+            }
+        self.users, self.groups = users, groups
+
+    def test_users_and_groups_are_reconciled(self):
+        result = self.run_module('okta_apps', action='sync_assignments', id=self.app_id,
+                                 user_ids=[self.users[1], self.users[3]],
+                                 groups=[dict(id=self.groups[1], priority=5), self.groups[2]])
+
+        self.assertFalse(result.get('failed'), result.get('msg'))
+        self.assertEqual(result['added_users'], [self.users[3]])
+        self.assertEqual(result['removed_users'], [self.users[0]])
+        self.assertEqual(result['added_groups'], [self.groups[2]])
+        self.assertEqual(result['updated_groups'], [self.groups[1]])
+        self.assertEqual(result['removed_groups'], [self.groups[0]])
+
+        with self.org.lock:
+            assigned = self.org.app_users[self.app_id]
+            # Users assigned through a group are left to the group assignments
+            self.assertEqual(sorted(assigned), sorted(self.users[1:4]))
+            self.assertEqual(assigned[self.users[3]]['scope'], 'USER')
+            self.assertEqual(self.org.app_groups[self.app_id][self.groups[1]]['priority'], 5)
+
+    def test_a_second_run_changes_nothing(self):
+        args = dict(action='sync_assignments', id=self.app_id, user_ids=[self.users[0], self.users[1]],
+                    groups=[self.groups[0], self.groups[1]])
+
+        result = self.run_module('okta_apps', **args)
+
+        self.assertFalse(result['changed'])
+        self.assertEqual(result['results'], [])
+
+
+class AppBulkTest(OktaMockTestCase):
+
+    def setUp(self):
+        super(AppBulkTest, self).setUp()
+        self.app_id = self.app_ids()[0]
+        self.groups = self.group_ids()[:2]
+
+    def test_assignments_written_report_changed(self):
+        result = self.run_module('okta_apps', action='assign_groups', id=self.app_id, group_ids=self.groups)
+
+        self.assertFalse(result.get('failed'), result.get('msg'))
+        self.assertTrue(result['changed'])
+        with self.org.lock:
+            self.assertEqual(sorted(self.org.app_groups[self.app_id]), self.groups)
+
+        result = self.run_module('okta_apps', action='remove_groups', id=self.app_id, group_ids=self.groups)
+
+        self.assertTrue(result['changed'])
+        with self.org.lock:
+            self.assertEqual(self.org.app_groups[self.app_id], {})
+
+    def test_nothing_written_is_not_a_change(self):
+        result = self.run_module('okta_apps', action='assign_users', id=self.app_id, user_ids=['00u00000000000000000'])
+
+        self.assertTrue(result['failed'])
+        self.assertFalse(result['changed'])
+
+
+class BulkLifecycleTest(OktaMockTestCase):
+
+    def setUp(self):
+        super(BulkLifecycleTest, self).setUp()
+        self.ids = self.user_ids()[:3]
+        with self.org.lock:
+            self.logins = [self.org.users[user_id]['profile']['login'] for user_id in self.ids]
+
+    def statuses(self):
+        with self.org.lock:
+            return [self.org.users[user_id]['status'] for user_id in self.ids]
+
+    def test_deactivate_by_login_only(self):
+        # Entries without an id, prefetched by id or not, used to fail the whole task
+        users = [dict(id=self.ids[0]), dict(login=self.logins[1]), dict(login=self.logins[2])]
+
+        result = self.run_module('okta_users', action='deactivate', users=users)
+
+        self.assertFalse(result.get('failed'), result.get('msg'))
+        self.assertTrue(result['changed'])
+        self.assertEqual([entry['id'] for entry in result['results']], self.ids)
+        self.assertEqual(self.statuses(), ['DEPROVISIONED'] * 3)
+
+    def test_users_already_in_the_status_are_not_posted(self):
+        with self.org.lock:
+            self.org.users[self.ids[1]]['status'] = 'DEPROVISIONED'
+        users = [dict(id=self.ids[0]), dict(id=self.ids[1]), dict(login=self.logins[2])]
+
+        result = self.run_module('okta_users', action='deactivate', users=users)
+
+        self.assertEqual([entry['changed'] for entry in result['results']], [True, False, True])
+        rerun = self.run_module('okta_users', action='deactivate', users=users)
+        self.assertFalse(rerun['changed'])
+
+    def test_check_mode_by_login_reports_without_writing(self):
+        result = self.run_module('okta_users', action='deactivate', users=[dict(login=self.logins[0])],
+                                 _ansible_check_mode=True)
+
+        self.assertTrue(result['changed'])
+        self.assertEqual(self.statuses(), ['ACTIVE'] * 3)
+
+    def test_entries_without_id_or_login_fail_alone(self):
+        result = self.run_module('okta_users', action='activate', users=[dict(id=self.ids[0]), dict(email='x@example.com')])
+
+        self.assertTrue(result['failed'])
+        self.assertEqual(result['msg'], "1 of 2 users failed")
+        self.assertEqual(result['results'][1]['msg'], "activate needs id or login in each users entry")
+
+
+class BulkFailureTest(OktaMockTestCase):
+
+    def test_users_failing_creation_are_reported(self):
+        with self.org.lock:
+            taken = self.org.users[self.user_ids()[0]]['profile']['login']
+        users = [dict(login=login, email=login, first_name='New', last_name='User')
+                 for login in ('new1@example.com', taken, 'new2@example.com')]
+
+        result = self.run_module('okta_users', action='create', users=users)
+
+        self.assertTrue(result['failed'])
+        self.assertEqual(result['msg'], "1 of 3 users failed")
+        self.assertEqual([entry['failed'] for entry in result['results']], [False, True, False])
+        self.assertIn("already exists", result['results'][1]['msg'])
+
+    def test_unknown_users_fail_only_their_assignment(self):
+        app_id = self.app_ids()[0]
+        user_ids = self.user_ids()[:2] + ['00u00000000000000000']
+
+        result = self.run_module('okta_apps', action='assign_users', id=app_id, user_ids=user_ids)
+
+        self.assertTrue(result['failed'])
+        self.assertEqual(result['msg'], "1 of 3 assignments failed")
+        with self.org.lock:
+            self.assertEqual(sorted(self.org.app_users[app_id]), user_ids[:2])
+
+    def test_deprovision_fails_cleanly_when_every_user_fails(self):
+        # The apps of each user are listed from worker threads; an error there
+        # used to exit the thread and leave the module hanging
+        user_ids = self.user_ids()[:3]
+        self.fail_requests(lambda method, path: path.startswith('/api/v1/apps'))
+
+        result = self.run_module('okta_users', action='deprovision', user_ids=user_ids, unassign_apps=True,
+                                 max_retries=0, timeout=30)
+
+        self.assertTrue(result['failed'])
+        self.assertEqual(result['msg'], "3 of 3 users failed")
+        self.assertEqual([entry['stage'] for entry in result['results']], ['unassign_apps'] * 3)
+        with self.org.lock:
+            self.assertEqual([self.org.users[user_id]['status'] for user_id in user_ids], ['ACTIVE'] * 3)
+
+    def test_deprovision_removes_the_users(self):
+        user_ids = self.user_ids()[:3]
+        app_id = self.app_ids()[0]
+        with self.org.lock:
+            self.org.app_users[app_id] = dict((user_id, dict(id=user_id, scope='USER')) for user_id in user_ids)
+
+        result = self.run_module('okta_users', action='deprovision', user_ids=user_ids, unassign_apps=True)
+
+        self.assertFalse(result.get('failed'), result.get('msg'))
+        with self.org.lock:
+            self.assertEqual(self.org.app_users[app_id], {})
+            self.assertFalse(set(user_ids) & set(self.org.users))
+
+
+if __name__ == '__main__':
+    unittest.main()
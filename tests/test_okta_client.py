@@ -0,0 +1,300 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import json
+import os
+import threading
+import time
+import unittest
+
+from helpers import okta, ExitingModule, FakeModule, OktaMockTestCase
+
+
+class ListUrlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.module = FakeModule()
+
+    def test_passes_non_empty_parameters(self):
+        url = okta.list_url(self.module, 'https://x/api/v1/users', 50,
+                            dict(q='ann', filter='status eq "ACTIVE"', search=None, expand=''))
+        self.assertEqual(url, 'https://x/api/v1/users/?limit=50&filter=status%20eq%20%22ACTIVE%22&q=ann')
+
+    def test_accepts_valid_expressions(self):
+        for expression in ('status eq "ACTIVE" and (type eq "A" or type eq "B")',
+                           'profile.name eq "Eng (EU"',
+                           'profile.name eq "say \\"hi\\""',
+                           'profile.nickName pr'):
+            okta.list_url(self.module, 'https://x/api/v1/users', 1, dict(search=expression))
+
+    def test_rejects_invalid_expressions(self):
+        for expression in ('status eq "ACTIVE', '(status eq "ACTIVE"', 'status "ACTIVE"',
+                           'profile.name eq "a\\"'):
+            with self.assertRaises(okta.OktaError) as raised:
+                okta.list_url(self.module, 'https://x/api/v1/users', 1, dict(search=expression))
+            self.assertIn('Invalid search expression', str(raised.exception))
+
+
+class ProjectTest(unittest.TestCase):
+
+    def test_keeps_dotted_fields(self):
+        items = [dict(id='1', status='ACTIVE', profile=dict(login='a@x', email='a@x')),
+                 dict(id='2', profile='not a dict')]
+        self.assertEqual(okta.project(items, ['id', 'profile.login', 'missing.field']),
+                         [dict(id='1', profile=dict(login='a@x')), dict(id='2')])
+
+    def test_without_fields_returns_items(self):
+        items = [dict(id='1')]
+        self.assertIs(okta.project(items, None), items)
+
+
+class LatestTimestampTest(unittest.TestCase):
+
+    def test_compares_times_not_strings(self):
+        items = [dict(lastUpdated='2024-05-01T10:00:00.900Z'), dict(lastUpdated='2024-05-01T10:00:01Z'),
+                 dict(lastUpdated='2024-05-01T12:00:00.000+02:00')]
+
+        self.assertEqual(okta.latest_timestamp(items), '2024-05-01T10:00:01Z')
+        self.assertEqual(okta.latest_timestamp(items[:1], '2024-05-01T10:00:00Z'), '2024-05-01T10:00:00.900Z')
+
+    def test_missing_and_unreadable_values_are_ignored(self):
+        items = [dict(id='1'), dict(lastUpdated=None), dict(lastUpdated='yesterday'),
+                 dict(lastUpdated='2024-05-01T10:00:00.000Z')]
+
+        self.assertEqual(okta.latest_timestamp(items), '2024-05-01T10:00:00.000Z')
+        self.assertEqual(okta.latest_timestamp(items, '2024-05-01T10:00:00.001Z'), '2024-05-01T10:00:00.001Z')
+        self.assertIsNone(okta.latest_timestamp([dict(id='1')]))
+
+
+class OktaIdTest(unittest.TestCase):
+
+    def test_known_prefixes(self):
+        for value in ('00u5b3gqiLpE114tV2M7', '00g1emaKYZTWRYYRRTSK', '0oa1gjh63g214q0Hq0g4'):
+            self.assertTrue(okta.is_okta_id(value), value)
+
+    def test_names_of_the_same_shape(self):
+        for value in ('Engineering2024Teams', 'abcdefghij0123456789', '00u5b3gqiLpE114tV2M', '00u5b3gqiLpE114tV2M7\n'):
+            self.assertFalse(okta.is_okta_id(value), value)
+
+
+class TaskGraphTest(unittest.TestCase):
+
+    def test_dependents_of_a_failed_task_are_skipped(self):
+        calls = []
+
+        def ok(name):
+            def run(module, deps):
+                calls.append(name)
+                return dict(deps=sorted(deps))
+            return run
+
+        def fail(module, deps):
+            calls.append('fail')
+            module.fail_json(msg="boom")
+
+        graph = okta.TaskGraph(FakeModule())
+        graph.add('a', ok('a'))
+        graph.add('b', fail, requires=['a'])
+        graph.add('c', ok('c'), requires=['b'])
+        graph.add('d', ok('d'), requires=['c'])
+        graph.add('e', ok('e'), requires=['a'])
+        results = graph.run(4)
+
+        self.assertEqual(sorted(calls), ['a', 'e', 'fail'])
+        self.assertEqual(results['b'], dict(failed=True, msg="boom"))
+        self.assertTrue(results['c']['skipped'])
+        self.assertEqual(results['c']['msg'], "Skipped, b failed")
+        self.assertEqual(results['d']['msg'], "Skipped, c failed")
+        self.assertEqual(results['e'], dict(deps=['a'], failed=False))
+
+    def test_tasks_added_after_a_failure_are_skipped(self):
+        graph = okta.TaskGraph(FakeModule())
+
+        def fail(module, deps):
+            module.fail_json(msg="boom")
+
+        def add_later(module, deps):
+            time.sleep(0.1)
+            graph.add('late', lambda module, deps: dict(), requires=['fail'])
+            return dict()
+
+        graph.add('fail', fail)
+        graph.add('adder', add_later)
+        results = graph.run(2)
+
+        self.assertTrue(results['late']['skipped'])
+
+
+class ResponseCacheTest(OktaMockTestCase):
+
+    def cache(self, ttl=300, max_entries=100):
+        return okta.ResponseCache(os.path.join(self.tmp, 'responses'), 'key', ttl, max_entries)
+
+    def test_fresh_entries_are_served_without_a_request(self):
+        client = self.client(cache=self.cache())
+        url = self.base_url + '/users?limit=5'
+
+        client.fetch(url)
+        before = self.org.requests
+        response, info = client.fetch(url)
+
+        self.assertEqual(self.org.requests, before)
+        self.assertEqual(info['msg'], "OK (cached)")
+        self.assertEqual(len(json.loads(response.read())), 5)
+        self.assertEqual((client.cache_hits, client.cache_misses), (1, 1))
+
+    def test_stale_entries_are_revalidated_with_the_etag(self):
+        client = self.client(cache=self.cache(ttl=0))
+        url = self.base_url + '/groups'
+
+        client.fetch(url)
+        before = self.org.requests
+        response, info = client.fetch(url)
+
+        self.assertEqual(self.org.requests, before + 1)
+        self.assertEqual(info['msg'], "OK (cached)")
+        self.assertEqual((client.cache_hits, client.cache_misses), (1, 1))
+
+    def test_changed_responses_replace_the_entry(self):
+        client = self.client(cache=self.cache(ttl=0))
+        url = self.base_url + '/groups'
+
+        client.fetch(url)
+        with self.org.lock:
+            self.org.add_group('Added behind the cache')
+        response, info = client.fetch(url)
+
+        self.assertEqual(info['status'], 200)
+        self.assertEqual(len(json.loads(response.read())), 5)
+        self.assertEqual(client.cache_misses, 2)
+
+    def test_writes_empty_the_cache(self):
+        cache = self.cache()
+        client = self.client(cache=cache)
+
+        client.fetch(self.base_url + '/groups')
+        client.fetch(self.base_url + '/groups', method='POST',
+                     data=json.dumps(dict(profile=dict(name='New'))))
+
+        self.assertEqual(cache._entries(), [])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self.cache(max_entries=2)
+        now = time.time()
+
+        cache.put('a', '[]', [], None)
+        cache.put('b', '[]', [], None)
+        os.utime(cache._file('a'), (now - 100, now - 100))
+        os.utime(cache._file('b'), (now - 50, now - 50))
+
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('c', '[]', [], None)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+
+class IdIndexTest(OktaMockTestCase):
+
+    def setUp(self):
+        super(IdIndexTest, self).setUp()
+        self.index = okta.IdIndex(os.path.join(self.tmp, 'ids.sqlite'), 3600)
+        self.client = self.client(index=self.index)
+
+    def write(self, method, path, data=None):
+        response, info = self.client.fetch(self.base_url + path, method=method,
+                                           data=None if data is None else json.dumps(data))
+        self.assertTrue(200 <= info['status'] < 300, info)
+        return json.loads(response.read() or '{}')
+
+    def test_created_objects_are_indexed(self):
+        group = self.write('POST', '/groups', dict(profile=dict(name='Created')))
+
+        self.assertEqual(self.index.get(self.base_url, 'groups', 'Created'), group['id'])
+
+    def test_renames_replace_the_old_name(self):
+        group = self.write('POST', '/groups', dict(profile=dict(name='Group X')))
+        self.write('PUT', '/groups/%s' % group['id'], dict(profile=dict(name='Group Y')))
+        replacement = self.write('POST', '/groups', dict(profile=dict(name='Group X')))
+
+        self.assertEqual(self.index.get(self.base_url, 'groups', 'Group Y'), group['id'])
+        self.assertEqual(self.index.get(self.base_url, 'groups', 'Group X'), replacement['id'])
+
+    def test_deleted_objects_are_forgotten(self):
+        group = self.write('POST', '/groups', dict(profile=dict(name='Doomed')))
+        self.write('DELETE', '/groups/%s' % group['id'])
+
+        self.assertIsNone(self.index.get(self.base_url, 'groups', 'Doomed'))
+
+    def test_membership_changes_keep_the_group(self):
+        group = self.write('POST', '/groups', dict(profile=dict(name='Kept')))
+        user_id = self.user_ids()[0]
+        self.write('PUT', '/groups/%s/users/%s' % (group['id'], user_id))
+
+        self.assertEqual(self.index.get(self.base_url, 'groups', 'Kept'), group['id'])
+
+    def test_resolve_looks_up_unknown_names_once(self):
+        with self.org.lock:
+            login = self.org.users[self.user_ids()[3]]['profile']['login']
+        module = FakeModule(api_url=self.api_url, organization=None)
+
+        first = okta.resolve_id(module, self.client, 'users', login)
+        before = self.org.requests
+        second = okta.resolve_id(module, self.client, 'users', login.upper())
+
+        self.assertEqual(first, self.user_ids()[3])
+        self.assertEqual(second, first)
+        self.assertEqual(self.org.requests, before)
+
+    def test_expired_rows_are_ignored(self):
+        self.index.put(self.base_url, 'groups', {'Old': '00g00000000000000000'})
+        self.index.ttl = 0
+
+        self.assertIsNone(self.index.get(self.base_url, 'groups', 'Old'))
+
+
+class BatchTest(OktaMockTestCase):
+
+    def test_failed_items_are_reported_and_the_rest_run(self):
+        client = self.client(max_retries=0)
+        user_ids = self.user_ids()[:4]
+        self.fail_requests(lambda method, path: user_ids[1] in path)
+
+        def fetch(item_module, user_id):
+            return dict(user=client.get(self.base_url + '/users/%s' % user_id, item_module)['id'])
+
+        results = okta.run_batch(self.module, fetch, user_ids, 4)
+
+        self.assertEqual([result['failed'] for result in results], [False, True, False, False])
+        self.assertIn("HTTP Error 500", results[1]['msg'])
+        self.assertEqual(results[2]['user'], user_ids[2])
+
+    def test_errors_without_a_module_raise_in_worker_threads(self):
+        # Failing through the client's own module from a pool thread used to
+        # leave the pool waiting forever
+        client = self.client(max_retries=0)
+        client.module = ExitingModule()
+        self.fail_requests(lambda method, path: '/groups' in path)
+
+        def fetch(item_module, group_id):
+            list(client.pages(self.base_url + '/groups/%s/users' % group_id))
+            return dict()
+
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(okta.run_batch(self.module, fetch, self.group_ids(), 2)))
+        thread.daemon = True
+        thread.start()
+        thread.join(30)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([result['failed'] for result in results], [True] * 4)
+
+    def test_client_fail_raises_without_a_module(self):
+        client = self.client()
+        client.module = ExitingModule()
+
+        self.assertRaises(okta.OktaError, client.fail, "boom")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+from helpers import ROOT, bench, load_module, okta, OktaMockTestCase
+
+worker = bench.load_source('okta_worker', os.path.join(ROOT, 'module_utils', 'okta_worker.py'))
+
+DEAD_PROXY = 'http://127.0.0.1:9'
+
+
+class ThreadCollectionTest(unittest.TestCase):
+
+    def test_each_thread_has_its_own_list(self):
+        collection = worker.ThreadCollection(list)
+        collection.append('main')
+        seen = []
+
+        def other():
+            seen.append(collection[:])
+            collection.append('other')
+            seen.append(len(collection))
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(seen, [[], 1])
+        self.assertEqual(collection[:], ['main'])
+        collection.reset()
+        self.assertEqual(list(collection), [])
+
+    def test_dicts_keep_their_interface(self):
+        collection = worker.ThreadCollection(dict)
+        collection['warning'] = None
+
+        self.assertIn('warning', collection)
+        self.assertEqual(list(collection), ['warning'])
+
+
+class ProxyEnvironmentTest(unittest.TestCase):
+
+    def test_lower_case_names_win(self):
+        proxies = okta.proxy_environment({'HTTPS_PROXY': 'http://upper:3128', 'https_proxy': 'http://lower:3128',
+                                          'HTTP_PROXY': 'http://upper:3128', 'NO_PROXY': 'internal', 'PATH': '/bin'})
+
+        self.assertEqual(proxies, dict(https='http://lower:3128', http='http://upper:3128', no='internal'))
+
+    def test_no_proxy_matches_hosts_and_subdomains(self):
+        proxies = dict(https='http://proxy:3128', no='.example.com, okta.local')
+
+        self.assertIsNone(okta.proxy_for('https', 'unicorns.example.com', proxies))
+        self.assertIsNone(okta.proxy_for('https', 'okta.local:443', proxies))
+        self.assertEqual(okta.proxy_for('https', 'unicorns.okta.com', proxies), ('proxy', 3128, {}))
+        self.assertIsNone(okta.proxy_for('https', 'unicorns.okta.com', dict(https='http://proxy:3128', no='*')))
+
+
+class WorkerTest(OktaMockTestCase):
+    """Runs tasks through a worker process the way the okta action plugin does."""
+
+    def setUp(self):
+        super(WorkerTest, self).setUp()
+        load_module('okta_groups')
+
+        self.path = os.path.join(self.tmp, 'worker.sock')
+        env = dict((name, value) for name, value in os.environ.items() if not name.lower().endswith('_proxy'))
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'module_utils', 'okta_worker.py'),
+                                    self.path, os.path.join(ROOT, 'module_utils'), '60'], env=env)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.terminate)
+
+        deadline = time.time() + 30
+        while not os.path.exists(self.path):
+            self.assertIsNone(process.poll(), "the worker exited")
+            self.assertLess(time.time(), deadline, "the worker did not start")
+            time.sleep(0.05)
+
+    def run_task(self, name, environment=None, **args):
+        args.setdefault('api_url', self.api_url)
+        args.setdefault('api_key', bench.API_KEY)
+        args.setdefault('cache_dir', os.path.join(self.tmp, 'cache'))
+        request = dict(module_path=os.path.join(ROOT, 'library', name + '.py'), args=args,
+                       environment=environment or {})
+
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(60)
+        try:
+            conn.connect(self.path)
+            conn.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            f = conn.makefile('rb')
+            try:
+                response = json.loads(f.readline().decode('utf-8'))
+            finally:
+                f.close()
+        finally:
+            conn.close()
+
+        return json.loads(response['stdout'])
+
+    def test_proxies_of_the_task_environment_apply_to_that_task(self):
+        result = self.run_task('okta_groups', environment=dict(http_proxy=DEAD_PROXY), action='list', max_retries=0)
+        self.assertTrue(result.get('failed'), result)
+
+        result = self.run_task('okta_groups', action='list')
+        self.assertFalse(result.get('failed'), result.get('msg'))
+
+        result = self.run_task('okta_groups', environment=dict(HTTP_PROXY=DEAD_PROXY, no_proxy='127.0.0.1'),
+                               action='list')
+        self.assertFalse(result.get('failed'), result.get('msg'))
+
+
+if __name__ == '__main__':
+    unittest.main()